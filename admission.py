@@ -0,0 +1,198 @@
+"""
+Ограничение частоты запросов и сброс нагрузки
+
+Каждому пользователю выдается корзина токенов (USER_BURST запросов
+подряд, дальше USER_RATE в секунду): частые нажатия одной кнопки не
+доходят до БД. Кроме того, при перегрузке всего процесса - слишком много
+обновлений в обработке или долгое ожидание подключения из пула БД -
+новые обновления не обрабатываются вовсе.
+
+Отказ стоит дешево: короткий ответ уходит прямо в HTTP-ответе на вебхук
+(без отдельного запроса к Bot API), а повторные отказы тому же
+пользователю - молча.
+"""
+import os
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from database import Database, breaker
+
+logger = logging.getLogger(__name__)
+
+# Обновлений в секунду на пользователя и запас для коротких всплесков
+USER_RATE = float(os.environ.get('USER_RATE', 1.0))
+USER_BURST = int(os.environ.get('USER_BURST', 10))
+# Пороги перегрузки процесса
+MAX_IN_FLIGHT = int(os.environ.get('MAX_IN_FLIGHT', 100))
+MAX_POOL_WAIT = float(os.environ.get('MAX_POOL_WAIT', 0.5))
+# Как часто замерять ожидание подключения из пула (секунды)
+POOL_PROBE_INTERVAL = 2
+# Сколько корзин держать в памяти (полные корзины вытесняются)
+MAX_TRACKED_USERS = 100_000
+
+ADMIT = 'admit'
+THROTTLED = 'throttled'
+SHED = 'shed'
+
+REPLY_TEXTS = {
+    THROTTLED: "⏳ Слишком много запросов. Подождите несколько секунд.",
+    SHED: "⚠️ Бот сейчас перегружен, попробуйте через минуту.",
+}
+
+
+class UserRateLimiter:
+    """Корзины токенов по пользователям"""
+
+    def __init__(self, rate: float = USER_RATE, burst: int = USER_BURST, max_users: int = MAX_TRACKED_USERS):
+        self._rate = rate
+        self._burst = burst
+        self._max_users = max_users
+        # user_id -> [токены, когда пересчитаны, отказ уже объяснен]
+        self._buckets: Dict[int, List[Any]] = {}
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, user_id: int, now: Optional[float] = None) -> Optional[bool]:
+        """
+        True - запрос разрешен; False - отказ, о котором стоит сообщить
+        пользователю; None - повторный отказ (молча).
+        """
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self._max_users:
+                self._evict(now)
+            bucket = self._buckets[user_id] = [float(self._burst), now, False]
+
+        tokens = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            bucket[2] = False
+            return True
+        bucket[0] = tokens
+        if bucket[2]:
+            return None
+        bucket[2] = True
+        return False
+
+    def _evict(self, now: float):
+        """Удаляет корзины, которые успели наполниться (они не отличаются от новых)"""
+        burst, rate = self._burst, self._rate
+        full = [
+            user_id for user_id, (tokens, updated, _) in self._buckets.items()
+            if tokens + (now - updated) * rate >= burst
+        ]
+        for user_id in full:
+            del self._buckets[user_id]
+        if len(self._buckets) >= self._max_users:
+            # Все корзины активны - забываем самые старые
+            for user_id in list(self._buckets)[:len(self._buckets) // 10 or 1]:
+                del self._buckets[user_id]
+
+
+class AdmissionController:
+    """Решает, обрабатывать ли обновление, и считает отказы"""
+
+    def __init__(
+        self,
+        limiter: UserRateLimiter,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        max_pool_wait: float = MAX_POOL_WAIT
+    ):
+        self.limiter = limiter
+        self._max_in_flight = max_in_flight
+        self._max_pool_wait = max_pool_wait
+        self.in_flight = 0
+        # Сглаженное время ожидания подключения из пула (секунды)
+        self.pool_wait = 0.0
+        self.admitted = 0
+        self.throttled = 0
+        self.shed = 0
+        self.replied = 0
+
+    @property
+    def overloaded(self) -> bool:
+        return self.in_flight >= self._max_in_flight or self.pool_wait >= self._max_pool_wait
+
+    def admit(self, update: Update) -> Optional[Dict[str, Any]]:
+        """
+        None - обновление нужно обработать. Иначе - обновление отброшено,
+        а результат - ответ для тела HTTP-ответа вебхука ({} - без ответа).
+        """
+        user = update.effective_user
+        if user is None:
+            self.admitted += 1
+            return None
+
+        allowed = self.limiter.allow(user.id)
+        if allowed:
+            if not self.overloaded:
+                self.admitted += 1
+                return None
+            self.shed += 1
+            verdict, notify = SHED, True
+        else:
+            self.throttled += 1
+            verdict, notify = THROTTLED, allowed is False
+
+        reply = canned_reply(update, REPLY_TEXTS[verdict]) if notify else None
+        if reply:
+            self.replied += 1
+        return reply or {}
+
+    @contextmanager
+    def track(self):
+        """Учитывает обновление как находящееся в обработке"""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def record_pool_wait(self, seconds: float):
+        previous = self.pool_wait
+        self.pool_wait = 0.7 * previous + 0.3 * seconds
+        if self.pool_wait >= self._max_pool_wait > previous:
+            logger.warning(f"🚦 Перегрузка: ожидание подключения к БД {self.pool_wait:.2f} сек")
+
+
+def canned_reply(update: Update, text: str) -> Optional[Dict[str, Any]]:
+    """Вызов Bot API для ответа вебхуку: сообщение или всплывающее уведомление"""
+    if update.callback_query is not None:
+        return {
+            'method': 'answerCallbackQuery',
+            'callback_query_id': update.callback_query.id,
+            'text': text,
+        }
+    if update.effective_chat is not None and update.message is not None:
+        return {
+            'method': 'sendMessage',
+            'chat_id': update.effective_chat.id,
+            'text': text,
+        }
+    return None
+
+
+async def pool_probe_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: замер ожидания свободного подключения из пула"""
+    if breaker.is_open:
+        # Запросы к БД сейчас сразу отклоняются - пул никого не задерживает
+        admission.record_pool_wait(0.0)
+        return
+    try:
+        wait = await Database.measure_pool_wait(timeout=MAX_POOL_WAIT * 4)
+    except Exception as e:
+        logger.debug(f"Замер пула БД не удался: {e}")
+        return
+    admission.record_pool_wait(wait)
+
+
+# Глобальный контроль допуска
+admission = AdmissionController(UserRateLimiter())
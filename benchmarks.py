@@ -0,0 +1,301 @@
+"""
+Микро-бенчмарки горячих мест бота
+
+Запуск: python benchmarks.py [имя ...]   (без аргументов - все)
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+
+def _report(name: str, count: int, elapsed: float):
+    print(f"{name:<40} {count:>9} за {elapsed:8.3f} с  ({count / elapsed:12,.0f} в сек.)")
+
+
+# ==================== ИМПОРТ ====================
+
+def _write_ics(path: str, events: int):
+    """Календарь семестра: 20 пар в неделю, повторенных нужное число недель"""
+    start = date(2024, 9, 2)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+        for i in range(events):
+            day = start + timedelta(days=(i % 20) // 4 + 7 * (i // 20))
+            hour = 9 + (i % 4) * 2
+            f.write(
+                "BEGIN:VEVENT\r\n"
+                f"DTSTART;TZID=Europe/Moscow:{day:%Y%m%d}T{hour:02d}0000\r\n"
+                f"DTEND;TZID=Europe/Moscow:{day:%Y%m%d}T{hour + 1:02d}3000\r\n"
+                f"SUMMARY:Предмет {i % 20}\r\n"
+                "ORGANIZER;CN=Иванов И.И.:mailto:ivanov@example.com\r\n"
+                "BEGIN:VALARM\r\nTRIGGER:-PT15M\r\nEND:VALARM\r\n"
+                "END:VEVENT\r\n"
+            )
+        f.write("END:VCALENDAR\r\n")
+
+
+def _write_csv(path: str, rows: int):
+    days = ["пн", "вт", "ср", "чт", "пт", "сб"]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("день;время;предмет;преподаватель;напоминание\n")
+        for i in range(rows):
+            hour = 8 + i % 12
+            f.write(f"{days[i % 6]};{hour:02d}:00-{hour:02d}:45;Предмет {i};Иванов;15\n")
+
+
+def bench_import():
+    from importers import load_schedule_file
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for events in (1000, 10000, 50000):
+            path = os.path.join(tmp_dir, 'calendar.ics')
+            _write_ics(path, events)
+            started = time.perf_counter()
+            load_schedule_file(path, 'calendar.ics')
+            _report(f"import .ics ({events} событий)", events, time.perf_counter() - started)
+
+        for rows in (1000, 10000, 50000):
+            path = os.path.join(tmp_dir, 'schedule.csv')
+            _write_csv(path, rows)
+            started = time.perf_counter()
+            load_schedule_file(path, 'schedule.csv')
+            _report(f"import .csv ({rows} строк)", rows, time.perf_counter() - started)
+
+
+# ==================== ВАЛИДАЦИЯ ====================
+
+def _time_loop(func, values, rounds: int) -> float:
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for value in values:
+            func(value)
+    return time.perf_counter() - started
+
+
+def bench_validators():
+    import re
+    from datetime import datetime
+    from validators import parse_deadline, parse_time_range
+
+    rounds = 20000
+    deadlines = ["2024-12-31 23:59", "2025-02-29 10:00", "2024-09-01 08:30", "31.12.2024 23:59"]
+
+    def with_strptime(value):
+        try:
+            return datetime.strptime(value, "%Y-%m-%d %H:%M")
+        except ValueError:
+            return None
+
+    count = rounds * len(deadlines)
+    _report("strptime", count, _time_loop(with_strptime, deadlines, rounds))
+    _report("validators.parse_deadline", count, _time_loop(parse_deadline, deadlines, rounds))
+
+    times = ["14:30-16:00", "09:00-10:30", "25:99-26:00", "16:00-14:30"]
+
+    def with_regex(value):
+        return re.match(r'^\d{2}:\d{2}-\d{2}:\d{2}$', value)
+
+    range_re = re.compile(r'^(\d{2}):(\d{2})-(\d{2}):(\d{2})$')
+
+    def with_regex_and_ranges(value):
+        match = range_re.match(value)
+        if not match:
+            return None
+        sh, sm, eh, em = map(int, match.groups())
+        if sh > 23 or eh > 23 or sm > 59 or em > 59 or sh * 60 + sm >= eh * 60 + em:
+            return None
+        return sh * 60 + sm, eh * 60 + em
+
+    count = rounds * len(times)
+    _report("re.match (без проверки диапазонов)", count, _time_loop(with_regex, times, rounds))
+    _report("regex + int + диапазоны", count, _time_loop(with_regex_and_ranges, times, rounds))
+    _report("validators.parse_time_range", count, _time_loop(parse_time_range, times, rounds))
+
+
+# ==================== НАПОМИНАНИЯ О ПАРАХ ====================
+
+def _make_schedules(users: int, entries: int, holiday: date):
+    """Синтетические пользователи: entries пар, часть через неделю, часть с праздником"""
+    from keyboards import WEEKDAYS
+
+    zones = ("Europe/Moscow", "Europe/Berlin", "Asia/Novosibirsk")
+    weeks = [None, None, 'odd', 'even']
+    for user_id in range(users):
+        schedule = []
+        for i in range(entries):
+            hour = 8 + (i * 7 + user_id) % 12
+            entry = {
+                'day': WEEKDAYS[(i + user_id) % 6],
+                'time': f"{hour:02d}:00-{hour + 1:02d}:30",
+                'className': f"Предмет {i}",
+                'reminderBefore': 15,
+            }
+            if weeks[(i + user_id) % 4]:
+                entry['weeks'] = weeks[(i + user_id) % 4]
+            schedule.append(entry)
+        state = {'tz': zones[user_id % 3]}
+        if user_id % 50 == 0:
+            state['holidays'] = [holiday.isoformat()]
+        yield user_id, schedule, state
+
+
+def bench_reminders():
+    from datetime import datetime
+    from keyboards import WEEKDAYS
+    from occurrences import Rules, occurs_on
+    from reminders import ReminderScheduler, user_timezone
+    from validators import parse_time_range
+
+    users, entries = 100_000, 20
+    begin = int(time.time())
+    end = begin + 24 * 3600
+    sources = list(_make_schedules(users, entries, date.today() + timedelta(days=1)))
+
+    def naive():
+        # Каждый пользователь по отдельности: разбор времени и datetime на каждую пару и дату
+        fired = []
+        for user_id, schedule, state in sources:
+            tz = user_timezone(state)
+            rules = Rules(state)
+            first = datetime.fromtimestamp(begin, tz).date()
+            days = [first + timedelta(days=offset) for offset in range(3)]
+            for item in schedule:
+                time_range, _ = parse_time_range(item['time'])
+                for day in days:
+                    if WEEKDAYS[day.weekday()] != item['day'] or not occurs_on(item, day, rules):
+                        continue
+                    start = datetime(
+                        day.year, day.month, day.day,
+                        time_range.start // 60, time_range.start % 60, tzinfo=tz
+                    )
+                    fire = int(start.timestamp()) - item['reminderBefore'] * 60
+                    if begin < fire <= end:
+                        fired.append((fire, user_id, item['className']))
+        fired.sort()
+        return fired
+
+    started = time.perf_counter()
+    expected = naive()
+    _report(f"по пользователям ({users}x{entries}), сутки", users * entries, time.perf_counter() - started)
+
+    scheduler = ReminderScheduler()
+    started = time.perf_counter()
+    for user_id, schedule, state in sources:
+        scheduler.update_user(user_id, {'schedule': schedule, 'deadlines': [], 'state': state})
+    _report("таблицы срабатываний (при запуске)", users * entries, time.perf_counter() - started)
+
+    started = time.perf_counter()
+    fired = sorted(
+        (fire, table.user_id, item['className'])
+        for _, table, items in scheduler.pop_due(end)
+        for fire, _, item in items
+    )
+    _report("очередь: срабатывания за сутки", len(fired), time.perf_counter() - started)
+    assert fired == expected, "результаты не совпадают"
+    print(f"напоминаний за сутки: {len(fired)}")
+
+
+# ==================== МАРШРУТИЗАЦИЯ КНОПОК ====================
+
+def _dispatch_chain(handlers, update):
+    """Как Application: первый обработчик группы, принявший update"""
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler
+    return None
+
+
+def bench_dispatch():
+    from datetime import datetime
+    from telegram import Chat, Message, Update, User
+    from telegram.ext import ConversationHandler, MessageHandler, filters
+    from keyboards import (
+        BTN_ADD_SCHEDULE, BTN_ADD_DEADLINE, BTN_SHOW_SCHEDULE,
+        BTN_SHOW_DEADLINES, BTN_RESET, BTN_HELP, BTN_CANCEL
+    )
+    from router import LabelRouter, USER_INPUT
+
+    async def noop(update, context):
+        return None
+
+    def conversations(text_filter, cancel_filter):
+        return [
+            ConversationHandler(
+                entry_points=[MessageHandler(entry, noop)],
+                states={1: [MessageHandler(text_filter, noop)]},
+                fallbacks=[MessageHandler(cancel_filter, noop)],
+            )
+            for entry in (filters.Text([BTN_ADD_SCHEDULE]), filters.Text([BTN_ADD_DEADLINE]))
+        ]
+
+    # До: отмена и кнопки меню - отдельные MessageHandler с регулярками
+    old_conversations = conversations(filters.TEXT & ~filters.COMMAND, filters.Regex(f"^{BTN_CANCEL}$"))
+    before = (
+        [MessageHandler(filters.Regex(f"^{BTN_CANCEL}$"), noop)]
+        + [
+            MessageHandler(filters.Regex(f"^{label}$"), noop)
+            for label in (BTN_SHOW_SCHEDULE, BTN_SHOW_DEADLINES, BTN_RESET, BTN_HELP)
+        ]
+        + [MessageHandler(filters.Document.ALL, noop)]
+        + old_conversations
+    )
+
+    # После: один LabelRouter со словарем
+    new_conversations = conversations(USER_INPUT, filters.Text([BTN_CANCEL]))
+    router = LabelRouter(
+        {label: noop for label in (BTN_SHOW_SCHEDULE, BTN_SHOW_DEADLINES, BTN_RESET, BTN_HELP, BTN_CANCEL)},
+        conversations=new_conversations,
+        conversation_labels=[BTN_CANCEL]
+    )
+    after = [router, MessageHandler(filters.Document.ALL, noop)] + new_conversations
+
+    user = User(1, "bench", False)
+    chat = Chat(1, Chat.PRIVATE)
+    texts = [
+        BTN_SHOW_SCHEDULE, BTN_SHOW_DEADLINES, BTN_RESET, BTN_HELP, BTN_CANCEL,
+        BTN_ADD_SCHEDULE, "пн 10:00-11:30 Математика",
+    ]
+    updates = [
+        Update(i, message=Message(i, datetime.now(), chat, from_user=user, text=text))
+        for i, text in enumerate(texts)
+    ]
+
+    rounds = 20000
+    count = rounds * len(updates)
+    for name, handlers in (("цепочка Regex (до)", before), ("LabelRouter (после)", after)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for update in updates:
+                _dispatch_chain(handlers, update)
+        _report(f"выбор обработчика: {name}", count, time.perf_counter() - started)
+
+        # Пользователь внутри диалога добавления расписания
+        key = (chat.id, user.id)
+        handlers[-2]._conversations[key] = 1
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for update in updates:
+                _dispatch_chain(handlers, update)
+        _report(f"  в диалоге: {name}", count, time.perf_counter() - started)
+        handlers[-2]._conversations.pop(key)
+
+
+BENCHMARKS = {
+    'import': bench_import,
+    'validators': bench_validators,
+    'reminders': bench_reminders,
+    'dispatch': bench_dispatch,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,539 @@
+"""
+Бот: обработчики, вебхук, запуск и остановка
+
+Импортируется из main.py только в процессах, которые обрабатывают
+обновления, - диспетчеру воркеров стек telegram/asyncpg/redis не нужен
+"""
+import os
+import time
+import logging
+import asyncio
+from typing import Dict, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import (
+    Application,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    ConversationHandler,
+    filters
+)
+
+from database import Database, DatabaseUnavailable, breaker, replica_breaker
+from storage import user_storage
+from calendar_feed import handle_calendar
+from reminders import reminder_scheduler, reminder_job, TICK_INTERVAL
+from broadcast import resume_broadcasts_job, BROADCAST_LEASE
+from retention import retention_job, RETENTION_INTERVAL
+from migrations import migration_job, MIGRATION_INTERVAL
+from dedup import update_deduplicator
+from admission import admission, pool_probe_job, POOL_PROBE_INTERVAL
+from groups import group_timetables
+from search import search_indexes
+from stats import usage_stats, stats_job, update_route, STATS_INTERVAL
+from memdebug import DEBUG_TOKEN, memory_route
+from workers import is_primary
+from keyboards import (
+    BTN_ADD_SCHEDULE, BTN_ADD_DEADLINE, BTN_SHOW_SCHEDULE,
+    BTN_SHOW_DEADLINES, BTN_RESET, BTN_HELP, BTN_CANCEL
+)
+from router import LabelRouter, USER_INPUT
+from callback_data import CALLBACK_PATTERN
+from handlers import (
+    start, help_command, reset_command, cancel, error_handler,
+    show_schedule, show_deadlines,
+    start_add_schedule, add_schedule_day_callback, add_schedule_time,
+    add_schedule_quick, add_command, import_schedule_document,
+    calendar_command, timezone_command, holiday_command, semester_command,
+    broadcast_command, group_command, find_command, stats_command,
+    add_schedule_class, add_schedule_professor, add_schedule_reminder,
+    start_add_deadline, add_deadline_name, add_deadline_date,
+    add_deadline_description, add_deadline_reminder,
+    item_callback, edit_item_value,
+    ADD_SCHEDULE_DAY, ADD_SCHEDULE_TIME, ADD_SCHEDULE_CLASS,
+    ADD_SCHEDULE_PROFESSOR, ADD_SCHEDULE_REMINDER,
+    ADD_DEADLINE_NAME, ADD_DEADLINE_DATE, ADD_DEADLINE_DESC,
+    ADD_DEADLINE_REMINDER, EDIT_ITEM_VALUE
+)
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+TOKEN = os.environ.get('BOT_TOKEN')
+if not TOKEN:
+    raise ValueError("BOT_TOKEN не установлен")
+
+PORT = int(os.environ.get('PORT', 8080))
+WEBHOOK_URL = os.environ.get('RAILWAY_STATIC_URL', '')
+REPLICA_ENABLED = bool(os.environ.get('DATABASE_REPLICA_URL'))
+
+if WEBHOOK_URL and not WEBHOOK_URL.startswith('https://'):
+    WEBHOOK_URL = f"https://{WEBHOOK_URL}"
+
+# Пауза между попытками загрузить напоминания, пока БД недоступна
+REMINDERS_RETRY_INTERVAL = 15
+
+# Application создается лениво при старте, а не при импорте модуля
+application: Optional[Application] = None
+
+def get_application() -> Application:
+    """Возвращает (и при первом вызове создает) application"""
+    global application
+    if application is None:
+        from persistence import PostgresPersistence
+        application = (
+            Application.builder()
+            .token(TOKEN)
+            .persistence(PostgresPersistence())
+            .build()
+        )
+    return application
+
+def setup_handlers():
+    """Настройка всех обработчиков"""
+    application = get_application()
+    
+    # Основные команды
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("reset", reset_command))
+    application.add_handler(CommandHandler("add", add_command))
+    application.add_handler(CommandHandler("calendar", calendar_command))
+    application.add_handler(CommandHandler("timezone", timezone_command))
+    application.add_handler(CommandHandler("holiday", holiday_command))
+    application.add_handler(CommandHandler("semester", semester_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("group", group_command))
+    application.add_handler(CommandHandler("find", find_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    
+    # Добавление расписания
+    conv_handler_schedule = ConversationHandler(
+        entry_points=[
+            MessageHandler(
+                filters.Text([BTN_ADD_SCHEDULE]),
+                start_add_schedule
+            )
+        ],
+        states={
+            ADD_SCHEDULE_DAY: [
+                CallbackQueryHandler(
+                    add_schedule_day_callback,
+                    pattern="^day_"
+                ),
+                MessageHandler(
+                    USER_INPUT,
+                    add_schedule_quick  # Пары текстом вместо кнопки
+                )
+            ],
+            ADD_SCHEDULE_TIME: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_schedule_time
+                )
+            ],
+            ADD_SCHEDULE_CLASS: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_schedule_class
+                )
+            ],
+            ADD_SCHEDULE_PROFESSOR: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_schedule_professor
+                )
+            ],
+            ADD_SCHEDULE_REMINDER: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_schedule_reminder
+                )
+            ],
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            MessageHandler(filters.Text([BTN_CANCEL]), cancel)
+        ],
+        name="add_schedule",
+        persistent=True,
+    )
+    
+    # Добавление дедлайна
+    conv_handler_deadline = ConversationHandler(
+        entry_points=[
+            MessageHandler(
+                filters.Text([BTN_ADD_DEADLINE]),
+                start_add_deadline
+            )
+        ],
+        states={
+            ADD_DEADLINE_NAME: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_deadline_name
+                )
+            ],
+            ADD_DEADLINE_DATE: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_deadline_date
+                )
+            ],
+            ADD_DEADLINE_DESC: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_deadline_description
+                )
+            ],
+            ADD_DEADLINE_REMINDER: [
+                MessageHandler(
+                    USER_INPUT,
+                    add_deadline_reminder
+                )
+            ],
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            MessageHandler(filters.Text([BTN_CANCEL]), cancel)
+        ],
+        name="add_deadline",
+        persistent=True,
+    )
+    
+    # Листание, правка и удаление записей из списков
+    conv_handler_edit = ConversationHandler(
+        entry_points=[
+            CallbackQueryHandler(item_callback, pattern=CALLBACK_PATTERN)
+        ],
+        states={
+            EDIT_ITEM_VALUE: [
+                CallbackQueryHandler(item_callback, pattern=CALLBACK_PATTERN),
+                MessageHandler(USER_INPUT, edit_item_value)
+            ],
+        },
+        fallbacks=[
+            CommandHandler("cancel", cancel),
+            MessageHandler(filters.Text([BTN_CANCEL]), cancel)
+        ],
+        name="edit_item",
+        persistent=True,
+    )
+    
+    # Кнопки меню: один поиск по словарю вместо цепочки регулярок.
+    # Регистрируется перед диалогами, но уступает им сообщение, если
+    # диалог его ждет (кнопка "Отменить" внутри диалога завершает диалог)
+    application.add_handler(LabelRouter(
+        {
+            BTN_SHOW_SCHEDULE: show_schedule,
+            BTN_SHOW_DEADLINES: show_deadlines,
+            BTN_RESET: reset_command,
+            BTN_HELP: help_command,
+            BTN_CANCEL: cancel,
+        },
+        conversations=[conv_handler_schedule, conv_handler_deadline, conv_handler_edit],
+        conversation_labels=[BTN_CANCEL]
+    ))
+    
+    # Импорт расписания из файла
+    application.add_handler(MessageHandler(
+        filters.Document.ALL,
+        import_schedule_document
+    ))
+    
+    # Регистрируем ConversationHandler
+    application.add_handler(conv_handler_schedule)
+    application.add_handler(conv_handler_deadline)
+    application.add_handler(conv_handler_edit)
+    
+    # Глобальный обработчик ошибок
+    application.add_error_handler(error_handler)
+    
+    # Напоминания о парах и дедлайнах
+    application.job_queue.run_repeating(reminder_job, interval=TICK_INTERVAL, first=TICK_INTERVAL)
+    
+    # Продолжение рассылок, прерванных перезапуском
+    application.job_queue.run_repeating(
+        resume_broadcasts_job, interval=BROADCAST_LEASE, first=BROADCAST_LEASE
+    )
+    
+    # Архивация прошедших дедлайнов и неактивных пользователей
+    application.job_queue.run_repeating(retention_job, interval=RETENTION_INTERVAL, first=10 * 60)
+    
+    # Фоновые шаги схемы: индексы CONCURRENTLY и перенос данных порциями
+    application.job_queue.run_repeating(migration_job, interval=MIGRATION_INTERVAL, first=30)
+    
+    # Замер ожидания подключения к БД для сброса нагрузки
+    application.job_queue.run_repeating(pool_probe_job, interval=POOL_PROBE_INTERVAL, first=POOL_PROBE_INTERVAL)
+    
+    # Счетчики использования - одной записью в stats_hourly раз в минуту
+    application.job_queue.run_repeating(stats_job, interval=STATS_INTERVAL, first=STATS_INTERVAL)
+
+async def set_webhook():
+    """Установка вебхука (пропускается, если он уже настроен)"""
+    if WEBHOOK_URL:
+        webhook_url = f"{WEBHOOK_URL}/webhook"
+        bot = get_application().bot
+        info = await bot.get_webhook_info()
+        if info.url == webhook_url:
+            logger.info(f"🌐 Вебхук уже установлен: {webhook_url}")
+            return
+        await bot.set_webhook(webhook_url)
+        logger.info(f"🌐 Вебхук установлен: {webhook_url}")
+    else:
+        logger.warning("⚠️ WEBHOOK_URL не установлен, бот будет работать в polling режиме")
+
+async def _timed(timings: Dict[str, float], name: str, coro):
+    """Выполняет шаг запуска и запоминает его длительность"""
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        timings[name] = time.perf_counter() - started
+
+def _timed_sync(timings: Dict[str, float], name: str, func):
+    """Синхронный вариант _timed"""
+    started = time.perf_counter()
+    try:
+        return func()
+    finally:
+        timings[name] = time.perf_counter() - started
+
+# Фоновая загрузка напоминаний (ссылка, чтобы задачу не собрал сборщик мусора)
+_reminders_task: Optional[asyncio.Task] = None
+
+async def init_storage(timings: Dict[str, float]) -> bool:
+    """
+    Инициализация БД и общего кэша. Если БД недоступна, бот работает без
+    нее (кэш, отложенные записи), а схема и таблицы напоминаний
+    догружаются в фоне после ее восстановления
+    """
+    # Индекс поиска в памяти нужен и без БД (данные из кэша и отложенных записей)
+    user_storage.add_change_listener(search_indexes.on_user_change)
+    
+    db_ok = True
+    try:
+        created = await _timed(timings, 'db', Database.init_database())
+        if created:
+            logger.info("✅ База данных инициализирована")
+        else:
+            logger.info("✅ Схема БД актуальна, DDL пропущен")
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации БД: {e}")
+        db_ok = False
+    
+    # Записи, отложенные до аварийной остановки, дописываются в БД
+    try:
+        recovered = await _timed(timings, 'journal', user_storage.recover_journal())
+        if recovered:
+            logger.info(f"✅ Восстановлено из журнала записей: {recovered}")
+    except Exception as e:
+        logger.error(f"❌ Ошибка чтения журнала отложенных записей: {e}")
+    
+    # Общий кэш для нескольких реплик
+    try:
+        await _timed(timings, 'cache', user_storage.start())
+    except Exception as e:
+        logger.error(f"❌ Общий кэш недоступен, работаем без него: {e}")
+    
+    # Таблицы напоминаний строятся в фоне и обновляются при изменениях данных
+    user_storage.add_change_listener(reminder_scheduler.update_user)
+    # Изменения расписания старосты публикуются как расписание группы
+    user_storage.add_change_listener(group_timetables.on_user_change)
+    # Воркеру нужны только свои пользователи и старосты их групп
+    user_storage.set_remote_filter(reminder_scheduler.needs)
+    global _reminders_task
+    _reminders_task = asyncio.create_task(load_reminders(schema_ready=db_ok))
+    return db_ok
+
+async def load_reminders(schema_ready: bool = True):
+    """
+    Фоновая загрузка таблиц напоминаний. Пока БД недоступна, повторяется
+    раз в REMINDERS_RETRY_INTERVAL секунд; схема, не примененная при
+    запуске, применяется перед загрузкой
+    """
+    while True:
+        if not breaker.is_open:
+            try:
+                if not schema_ready:
+                    await Database.init_database()
+                    schema_ready = True
+                    logger.info("✅ БД доступна, схема проверена")
+                await reminder_scheduler.load_all()
+                return
+            except Exception as e:
+                logger.error(
+                    f"❌ Ошибка загрузки напоминаний, повтор через "
+                    f"{REMINDERS_RETRY_INTERVAL} сек: {e}"
+                )
+        await asyncio.sleep(REMINDERS_RETRY_INTERVAL)
+
+async def init_bot(timings: Dict[str, float], webhook: bool):
+    """Инициализация бота и вебхука"""
+    await _timed(timings, 'bot', get_application().initialize())
+    # Вебхук один на всех воркеров - его ставит первый
+    if webhook and is_primary():
+        await _timed(timings, 'webhook', set_webhook())
+
+async def boot(webhook: bool) -> bool:
+    """Параллельный запуск независимых шагов с логированием времени"""
+    timings: Dict[str, float] = {}
+    started = time.perf_counter()
+    
+    # Настройка обработчиков
+    _timed_sync(timings, 'handlers', setup_handlers)
+    
+    db_ok, _ = await asyncio.gather(
+        init_storage(timings),
+        init_bot(timings, webhook)
+    )
+    
+    timings['total'] = time.perf_counter() - started
+    breakdown = ", ".join(f"{name} {elapsed:.2f}s" for name, elapsed in timings.items())
+    logger.info(f"⏱️ Время запуска: {breakdown}")
+    return db_ok
+
+async def health_check(request):
+    """Проверка здоровья сервера"""
+    return web.Response(
+        text=f"✅ Бот работает\n"
+        f"Обновлений: {update_deduplicator.accepted}, повторов отброшено: {update_deduplicator.duplicates}\n"
+        f"БД: {breaker.state}, реплика: {replica_breaker.state if REPLICA_ENABLED else 'нет'}, "
+        f"отложенных записей: {user_storage.pending_writes}\n"
+        f"В обработке: {admission.in_flight}, ожидание пула: {admission.pool_wait * 1000:.0f} мс\n"
+        f"Ограничено: {admission.throttled}, сброшено при перегрузке: {admission.shed}, "
+        f"ответов об отказе: {admission.replied}"
+    )
+
+async def handle_webhook(request):
+    """Обработка входящих вебхуков"""
+    try:
+        # Парсим обновление
+        data = await request.json()
+        
+        # Повторная доставка того же обновления - отвечаем OK без обработки
+        update_id = data.get('update_id')
+        if update_id is not None and not await update_deduplicator.check(update_id):
+            logger.info(
+                f"🔁 Повтор update {update_id} пропущен "
+                f"(всего повторов: {update_deduplicator.duplicates})"
+            )
+            return web.Response(text="OK")
+        
+        application = get_application()
+        update = Update.de_json(data, application.bot)
+        
+        # Слишком частые запросы или перегрузка - короткий ответ прямо в теле вебхука
+        rejection = admission.admit(update)
+        if rejection is not None:
+            if rejection:
+                return web.json_response(rejection)
+            return web.Response(text="OK")
+        
+        # Логируем входящий запрос
+        if update.message:
+            logger.info(f"📨 Сообщение от {update.effective_user.id}: {update.message.text}")
+        elif update.callback_query:
+            logger.info(f"📨 Callback от {update.effective_user.id}: {update.callback_query.data}")
+        
+        # Обрабатываем обновление
+        started = time.perf_counter()
+        with admission.track():
+            await application.process_update(update)
+        usage_stats.record_update(
+            update.effective_user.id if update.effective_user else None,
+            update_route(update),
+            time.perf_counter() - started
+        )
+        
+        return web.Response(text="OK")
+        
+    except Exception as e:
+        logger.error(f"🚨 Ошибка в обработке вебхука: {e}")
+        return web.Response(text="ERROR", status=500)
+
+async def startup(app):
+    """Запуск приложения"""
+    logger.info("🚀 Запуск бота...")
+    
+    await boot(webhook=True)
+    
+    # Запускаем фоновые задачи application (сохранение состояний, job queue)
+    await get_application().start()
+    
+    logger.info(f"✅ Бот запущен на порту {PORT}")
+
+async def shutdown(app):
+    """Завершение работы"""
+    logger.info("🛑 Остановка бота...")
+    
+    # Останавливаем бота
+    application = get_application()
+    await application.stop()
+    await application.shutdown()
+    if _reminders_task is not None:
+        _reminders_task.cancel()
+    
+    # Счетчики текущего часа - в stats_hourly, пока пул открыт
+    try:
+        await usage_stats.flush()
+    except DatabaseUnavailable:
+        pass
+    
+    # Закрываем общий кэш и пул БД
+    await user_storage.close()
+    await Database.close_pool()
+    
+    logger.info("✅ Бот остановлен")
+
+async def polling_mode():
+    """Режим polling для разработки"""
+    logger.info("🔄 Запуск в режиме polling...")
+    
+    if not await boot(webhook=False):
+        if _reminders_task is not None:
+            _reminders_task.cancel()
+        await get_application().shutdown()
+        return
+    
+    # Запуск бота
+    application = get_application()
+    await application.start()
+    
+    # Начинаем polling
+    try:
+        await application.updater.start_polling()
+        logger.info("✅ Бот запущен в режиме polling")
+        
+        # Бесконечное ожидание
+        await asyncio.Event().wait()
+        
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("🛑 Получен сигнал остановки")
+    finally:
+        await application.stop()
+        await application.shutdown()
+        await user_storage.close()
+        await Database.close_pool()
+
+def create_app():
+    """Создание aiohttp приложения"""
+    app = web.Application()
+    
+    # Регистрация маршрутов
+    app.router.add_get('/', health_check)
+    app.router.add_post('/webhook', handle_webhook)
+    app.router.add_get('/health', health_check)
+    app.router.add_get('/calendar/{token}.ics', handle_calendar)
+    # Отладка памяти - только если задан DEBUG_TOKEN
+    if DEBUG_TOKEN:
+        app.router.add_get('/debug/memory', memory_route(get_application))
+    
+    # Регистрация событий жизненного цикла
+    app.on_startup.append(startup)
+    # on_cleanup - после того, как дообработаны уже принятые вебхуки
+    app.on_cleanup.append(shutdown)
+    
+    return app
@@ -0,0 +1,165 @@
+"""
+Рассылка сообщения всем пользователям (команда /broadcast для администраторов)
+
+Получатели читаются курсором по возрастанию user_id и через ограниченную
+очередь уходят на отправку порциями не быстрее BROADCAST_RATE сообщений
+в секунду. После каждой порции в БД сохраняется контрольная точка
+(последний обработанный user_id и счетчики), поэтому после перезапуска
+рассылка продолжается с того же места.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from telegram import Bot
+from telegram.error import Forbidden, RetryAfter
+from telegram.ext import ContextTypes
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+ADMIN_IDS = {
+    int(value) for value in os.environ.get('ADMIN_IDS', '').replace(' ', '').split(',')
+    if value.isdigit()
+}
+
+# Сообщений в секунду (лимит Telegram - около 30)
+BROADCAST_RATE = max(1, int(os.environ.get('BROADCAST_RATE', 25)))
+# Рассылка без обновления прогресса дольше этого времени считается брошенной
+BROADCAST_LEASE = 60
+# Как часто писать прогресс в лог (секунды)
+PROGRESS_LOG_INTERVAL = 30
+
+# Рассылки, которые ведет этот процесс
+_running: Set[int] = set()
+
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
+
+
+async def _deliver(bot: Bot, user_id: int, text: str) -> str:
+    """Отправляет одно сообщение: 'sent', 'blocked' или 'failed'"""
+    for _ in range(2):
+        try:
+            await bot.send_message(chat_id=user_id, text=text)
+            return 'sent'
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except Forbidden:
+            return 'blocked'
+        except Exception as e:
+            logger.warning(f"⚠️ Рассылка: не доставлено user {user_id}: {e}")
+            return 'failed'
+    return 'failed'
+
+
+async def _produce(queue: asyncio.Queue, after_user_id: int):
+    """Читает получателей курсором в очередь (None - конец)"""
+    try:
+        async for user_id in Database.iter_broadcast_recipients(after_user_id):
+            await queue.put(user_id)
+    finally:
+        await queue.put(None)
+
+
+async def _next_chunk(queue: asyncio.Queue, size: int) -> Optional[List[int]]:
+    """До size получателей из очереди (None, если очередь закончилась)"""
+    user_id = await queue.get()
+    if user_id is None:
+        return None
+    chunk = [user_id]
+    while len(chunk) < size and not queue.empty():
+        user_id = queue.get_nowait()
+        if user_id is None:
+            queue.put_nowait(None)
+            break
+        chunk.append(user_id)
+    return chunk
+
+
+async def run_broadcast(bot: Bot, broadcast: Dict[str, Any]):
+    """Ведет рассылку от контрольной точки до конца"""
+    broadcast_id = broadcast['id']
+    if broadcast_id in _running:
+        return
+    _running.add(broadcast_id)
+
+    text = broadcast['text']
+    last_user_id = broadcast['last_user_id']
+    counters = {
+        'sent': broadcast['sent'],
+        'failed': broadcast['failed'],
+        'blocked': broadcast['blocked'],
+    }
+    processed = 0
+    started = time.monotonic()
+    logged = started
+    logger.info(f"📣 Рассылка #{broadcast_id} запущена с user_id > {last_user_id}")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_RATE * 4)
+    producer = asyncio.create_task(_produce(queue, last_user_id))
+    try:
+        while True:
+            chunk = await _next_chunk(queue, BROADCAST_RATE)
+            if chunk is None:
+                break
+            chunk_started = time.monotonic()
+
+            results = await asyncio.gather(*(_deliver(bot, user_id, text) for user_id in chunk))
+            blocked_ids = [user_id for user_id, result in zip(chunk, results) if result == 'blocked']
+            for result in results:
+                counters[result] += 1
+            await Database.mark_users_blocked(blocked_ids)
+
+            processed += len(chunk)
+            last_user_id = chunk[-1]
+            await Database.save_broadcast_progress(broadcast_id, last_user_id, **counters)
+
+            now = time.monotonic()
+            if now - logged >= PROGRESS_LOG_INTERVAL:
+                logged = now
+                logger.info(
+                    f"📣 Рассылка #{broadcast_id}: {processed} за {now - started:.0f} сек "
+                    f"({processed / (now - started):.1f}/сек), {counters}"
+                )
+            # Не быстрее BROADCAST_RATE сообщений в секунду
+            await asyncio.sleep(max(0.0, 1.0 - (now - chunk_started)))
+
+        await producer
+        await Database.save_broadcast_progress(broadcast_id, last_user_id, status='done', **counters)
+    except Exception as e:
+        logger.error(f"❌ Рассылка #{broadcast_id} прервана на user_id {last_user_id}: {e}")
+        producer.cancel()
+        return
+    finally:
+        _running.discard(broadcast_id)
+
+    elapsed = time.monotonic() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    report = (
+        f"✅ Рассылка #{broadcast_id} завершена\n"
+        f"Доставлено: {counters['sent']}\n"
+        f"Заблокировали бота: {counters['blocked']}\n"
+        f"Ошибки: {counters['failed']}\n"
+        f"Скорость: {rate:.1f} сообщ./сек"
+    )
+    logger.info(report.replace("\n", ", "))
+    try:
+        await bot.send_message(chat_id=broadcast['admin_id'], text=report)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось отправить отчет о рассылке: {e}")
+
+
+async def resume_broadcasts_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: продолжает рассылки, брошенные остановившимся процессом"""
+    try:
+        broadcast = await Database.claim_stale_broadcast(BROADCAST_LEASE)
+    except Exception as e:
+        logger.error(f"❌ Ошибка проверки рассылок: {e}")
+        return
+    if broadcast and broadcast['id'] not in _running:
+        context.application.create_task(run_broadcast(context.bot, broadcast))
@@ -0,0 +1,225 @@
+"""
+Общий кэш второго уровня и распределенные блокировки через Redis
+"""
+import os
+import json
+import uuid
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import WatchError
+except ImportError:  # Redis необязателен: без него работаем в одном процессе
+    aioredis = None
+
+    class WatchError(Exception):
+        """Без пакета redis не возникает"""
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "typekeeper"
+INVALIDATION_CHANNEL = f"{KEY_PREFIX}:invalidate"
+
+
+class SharedCache:
+    """L2-кэш данных пользователей и блокировки, общие для всех реплик"""
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        ttl_seconds: int = 300,
+        lock_timeout: float = 10,
+        lock_wait: float = 5,
+    ):
+        self._url = url
+        self._ttl = ttl_seconds
+        self._lock_timeout = lock_timeout
+        self._lock_wait = lock_wait
+        self._redis = None
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._on_invalidate: Optional[Callable[[int], None]] = None
+        # Идентификатор процесса, чтобы не обрабатывать свои же сообщения
+        self.instance_id = uuid.uuid4().hex[:12]
+
+    @property
+    def enabled(self) -> bool:
+        return self._redis is not None
+
+    async def connect(self, on_invalidate: Callable[[int], None], client=None):
+        """Подключаемся к Redis и подписываемся на канал инвалидации"""
+        if client is None:
+            if not self._url:
+                return
+            if aioredis is None:
+                logger.warning("⚠️ REDIS_URL задан, но пакет redis не установлен")
+                return
+            client = aioredis.from_url(self._url)
+
+        self._on_invalidate = on_invalidate
+        self._pubsub = client.pubsub()
+        await self._pubsub.subscribe(INVALIDATION_CHANNEL)
+        self._redis = client
+        self._listener = asyncio.create_task(self._listen())
+        logger.info(f"✅ Общий кэш Redis подключен (instance {self.instance_id})")
+
+    async def close(self):
+        """Отключаемся от Redis"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(INVALIDATION_CHANNEL)
+            await self._pubsub.aclose()
+            self._pubsub = None
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    async def _listen(self):
+        """Сбрасываем L1 при изменениях в других процессах"""
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=1.0
+                )
+                if message is None:
+                    continue
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode()
+                sender, _, user_id = data.partition(':')
+                if sender != self.instance_id and user_id:
+                    self._on_invalidate(int(user_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка в подписке на инвалидацию: {e}")
+                await asyncio.sleep(1)
+
+    @staticmethod
+    def _data_key(user_id: int) -> str:
+        return f"{KEY_PREFIX}:user:{user_id}"
+
+    @staticmethod
+    def _lock_key(user_id: int) -> str:
+        return f"{KEY_PREFIX}:lock:{user_id}"
+
+    @staticmethod
+    def _version_key(user_id: int) -> str:
+        return f"{KEY_PREFIX}:version:{user_id}"
+
+    async def get_versioned(self, user_id: int) -> Tuple[Optional[Dict[str, Any]], Optional[bytes]]:
+        """
+        Данные пользователя из L2 и версия его данных (меняется при каждой
+        записи и инвалидации) - для populate после промаха
+        """
+        if not self.enabled:
+            return None, None
+        try:
+            raw, version = await self._redis.mget(self._data_key(user_id), self._version_key(user_id))
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения из Redis: {e}")
+            return None, None
+        return (json.loads(raw) if raw else None), version
+
+    async def populate(self, user_id: int, data: Dict[str, Any], version: Optional[bytes]) -> bool:
+        """
+        Кладет в L2 данные, прочитанные из БД после промаха. Только если
+        ключа нет и версия не изменилась с get_versioned: иначе другой
+        процесс успел записать новые данные, а прочитанные устарели.
+        Другие процессы не оповещаются - у них нечего сбрасывать.
+        """
+        if not self.enabled:
+            return False
+        version_key = self._version_key(user_id)
+        try:
+            payload = json.dumps(data, ensure_ascii=False)
+            async with self._redis.pipeline(transaction=True) as pipe:
+                await pipe.watch(version_key)
+                if await pipe.get(version_key) != version:
+                    return False
+                pipe.multi()
+                pipe.set(self._data_key(user_id), payload, ex=self._ttl, nx=True)
+                stored, = await pipe.execute()
+            return bool(stored)
+        except WatchError:
+            # Версия изменилась между проверкой и записью
+            return False
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи в Redis: {e}")
+            return False
+
+    async def set(self, user_id: int, data: Dict[str, Any]):
+        """Записывает данные пользователя в L2 и оповещает другие процессы (только под блокировкой записи)"""
+        if not self.enabled:
+            return
+        try:
+            payload = json.dumps(data, ensure_ascii=False)
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.set(self._data_key(user_id), payload, ex=self._ttl)
+                pipe.incr(self._version_key(user_id))
+                pipe.expire(self._version_key(user_id), self._ttl)
+                pipe.publish(INVALIDATION_CHANNEL, f"{self.instance_id}:{user_id}")
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи в Redis: {e}")
+
+    async def invalidate(self, user_id: int):
+        """Удаляет данные пользователя из L2 во всех процессах"""
+        if not self.enabled:
+            return
+        try:
+            async with self._redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self._data_key(user_id))
+                pipe.incr(self._version_key(user_id))
+                pipe.expire(self._version_key(user_id), self._ttl)
+                pipe.publish(INVALIDATION_CHANNEL, f"{self.instance_id}:{user_id}")
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"❌ Ошибка инвалидации в Redis: {e}")
+
+    async def claim(self, key: str, ttl: int) -> bool:
+        """Однократное действие на все реплики: True только у первого (без Redis - всегда)"""
+        if not self.enabled:
+            return True
+        try:
+            return bool(await self._redis.set(f"{KEY_PREFIX}:claim:{key}", self.instance_id, nx=True, ex=ttl))
+        except Exception as e:
+            logger.error(f"❌ Ошибка claim в Redis: {e}")
+            return True
+
+    @asynccontextmanager
+    async def lock(self, user_id: int):
+        """Распределенная блокировка пользователя (без Redis ничего не делает)"""
+        if not self.enabled:
+            yield
+            return
+
+        lock = self._redis.lock(
+            self._lock_key(user_id),
+            timeout=self._lock_timeout,
+            blocking_timeout=self._lock_wait,
+        )
+        acquired = await lock.acquire()
+        if not acquired:
+            raise TimeoutError(f"Не удалось получить блокировку для user {user_id}")
+        try:
+            yield
+        finally:
+            try:
+                await lock.release()
+            except Exception as e:
+                # Блокировка могла истечь по таймауту - это не фатально
+                logger.warning(f"⚠️ Блокировка user {user_id} уже освобождена: {e}")
+
+
+# Глобальный экземпляр общего кэша
+shared_cache = SharedCache(os.environ.get('REDIS_URL'))
@@ -0,0 +1,323 @@
+"""
+Экспорт расписания и дедлайнов в календарь (ICS-подписка)
+"""
+import os
+import hmac
+import base64
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from aiohttp import web
+
+from database import Database
+from groups import group_timetables
+from keyboards import WEEKDAYS
+from occurrences import WEEK_PARITIES, Rules, parse_dates
+from reminders import offset_transitions, user_timezone
+from storage import user_storage
+from validators import parse_deadline
+
+logger = logging.getLogger(__name__)
+
+# Коды дней недели для RRULE в порядке WEEKDAYS
+_ICS_WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+
+# Размер порции, которой отдаем календарь клиенту
+CHUNK_SIZE = 16 * 1024
+
+# Как часто клиентам стоит перепроверять календарь
+CACHE_MAX_AGE = 300
+
+
+def _secret() -> bytes:
+    """Ключ подписи ссылок (по умолчанию производный от токена бота)"""
+    secret = os.environ.get('CALENDAR_SECRET') or f"calendar:{os.environ.get('BOT_TOKEN', '')}"
+    return secret.encode()
+
+
+def _sign(user_id: int) -> str:
+    digest = hmac.new(_secret(), str(user_id).encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip('=')
+
+
+def make_token(user_id: int) -> str:
+    """Подписанный токен для ссылки на календарь пользователя"""
+    return f"{user_id}.{_sign(user_id)}"
+
+
+def parse_token(token: str) -> Optional[int]:
+    """Проверяет токен и возвращает user_id"""
+    user_part, _, signature = token.partition('.')
+    if not user_part.isdigit() or not signature:
+        return None
+    user_id = int(user_part)
+    if not hmac.compare_digest(signature, _sign(user_id)):
+        return None
+    return user_id
+
+
+def feed_url(user_id: int) -> Optional[str]:
+    """Публичная ссылка на календарь (нужен RAILWAY_STATIC_URL)"""
+    base_url = os.environ.get('RAILWAY_STATIC_URL', '')
+    if not base_url:
+        return None
+    if not base_url.startswith('https://'):
+        base_url = f"https://{base_url}"
+    return f"{base_url}/calendar/{make_token(user_id)}.ics"
+
+
+# ==================== ФОРМИРОВАНИЕ ICS ====================
+
+def _escape(text: str) -> str:
+    return (
+        str(text).replace('\\', '\\\\').replace(';', '\\;')
+        .replace(',', '\\,').replace('\n', '\\n')
+    )
+
+
+def _fold(line: str) -> str:
+    """Переносит строки длиннее 75 байт (RFC 5545, 3.1)"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + "\r\n"
+
+    parts = []
+    current = ""
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(current)
+            current, size, limit = "", 0, 74
+        current += char
+        size += char_size
+    parts.append(current)
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _uid(user_id: int, kind: str, *parts) -> str:
+    raw = "|".join(str(part) for part in (user_id, kind) + parts)
+    return f"{hashlib.sha1(raw.encode()).hexdigest()[:20]}@typekeeper"
+
+
+def _offset(seconds: int) -> str:
+    sign = '-' if seconds < 0 else '+'
+    hours, rest = divmod(abs(seconds), 3600)
+    minutes, rest = divmod(rest, 60)
+    return f"{sign}{hours:02d}{minutes:02d}" + (f"{rest:02d}" if rest else "")
+
+
+def _observance(tz: ZoneInfo, ts: int, offset_from: int) -> List[str]:
+    """STANDARD/DAYLIGHT с момента ts (DTSTART - местное время по прежнему смещению)"""
+    moment = datetime.fromtimestamp(ts, tz)
+    kind = "DAYLIGHT" if moment.dst() else "STANDARD"
+    onset = datetime.fromtimestamp(ts + offset_from, timezone.utc)
+    return [
+        f"BEGIN:{kind}",
+        f"DTSTART:{onset:%Y%m%dT%H%M%S}",
+        f"TZOFFSETFROM:{_offset(offset_from)}",
+        f"TZOFFSETTO:{_offset(int(moment.utcoffset().total_seconds()))}",
+        f"TZNAME:{moment.tzname()}",
+        f"END:{kind}",
+    ]
+
+
+@lru_cache(maxsize=64)
+def _vtimezone(tz: ZoneInfo, year: int) -> Tuple[str, ...]:
+    """
+    VTIMEZONE пояса со сменами смещения с прошлого года по следующий:
+    календарь перепроверяется каждые CACHE_MAX_AGE секунд, и с новым годом
+    окно сдвигается
+    """
+    start = int(datetime(year - 1, 1, 1, tzinfo=timezone.utc).timestamp())
+    end = int(datetime(year + 2, 1, 1, tzinfo=timezone.utc).timestamp())
+    offset = int(datetime.fromtimestamp(start, tz).utcoffset().total_seconds())
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{tz.key}"] + _observance(tz, start, offset)
+    for transition in offset_transitions(tz, start, end):
+        lines += _observance(tz, transition, offset)
+        offset = int(datetime.fromtimestamp(transition, tz).utcoffset().total_seconds())
+    lines.append("END:VTIMEZONE")
+    return tuple(lines)
+
+
+def _week_start(now: datetime) -> datetime:
+    """Полночь понедельника текущей недели по местному времени now (без пояса)"""
+    return datetime(now.year, now.month, now.day) - timedelta(days=now.weekday())
+
+
+def _schedule_event(
+    user_id: int,
+    item: Dict,
+    week_start: datetime,
+    stamp: str,
+    rules: Rules,
+    tzid: str
+) -> List[str]:
+    day = item.get('day')
+    time_range = item.get('time', '')
+    if day not in WEEKDAYS or len(time_range) != 11:
+        return []
+
+    day_index = WEEKDAYS.index(day)
+    date = week_start + timedelta(days=day_index)
+    rule = f"RRULE:FREQ=WEEKLY;BYDAY={_ICS_WEEKDAYS[day_index]}"
+    if item.get('weeks') in WEEK_PARITIES:
+        # Пара через неделю: начинаем с ближайшей недели нужной четности
+        if rules.parity(date.date()) != item['weeks']:
+            date += timedelta(days=7)
+        rule = f"RRULE:FREQ=WEEKLY;INTERVAL=2;BYDAY={_ICS_WEEKDAYS[day_index]}"
+    start_time = f"T{time_range[0:2]}{time_range[3:5]}00"
+    start = f"{date:%Y%m%d}{start_time}"
+    end = f"{date:%Y%m%d}T{time_range[6:8]}{time_range[9:11]}00"
+
+    # Праздники и отмененные пары этого дня недели
+    excluded = sorted(
+        ordinal for ordinal in rules.holidays | parse_dates(item.get('skip'))
+        if ordinal % 7 == (day_index + 1) % 7
+    )
+
+    summary = item.get('className', 'Без названия')
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{_uid(user_id, 'schedule', day, time_range, summary)}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;TZID={tzid}:{start}",
+        f"DTEND;TZID={tzid}:{end}",
+        rule,
+        f"SUMMARY:{_escape(summary)}",
+    ]
+    if excluded:
+        dates = ",".join(
+            f"{datetime.fromordinal(ordinal):%Y%m%d}{start_time}" for ordinal in excluded
+        )
+        lines.append(f"EXDATE;TZID={tzid}:{dates}")
+    if item.get('professor'):
+        lines.append(f"DESCRIPTION:{_escape(item['professor'])}")
+    lines += _alarm(item.get('reminderBefore'))
+    lines.append("END:VEVENT")
+    return lines
+
+
+def _deadline_event(user_id: int, item: Dict, stamp: str, tzid: str) -> List[str]:
+    deadline = parse_deadline(item.get('datetime', ''))
+    if deadline is None:
+        return []
+
+    name = item.get('name', 'Без названия')
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{_uid(user_id, 'deadline', item.get('datetime'), name)}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART;TZID={tzid}:{deadline:%Y%m%dT%H%M%S}",
+        "DURATION:PT0M",
+        f"SUMMARY:{_escape('⏰ ' + name)}",
+    ]
+    if item.get('description'):
+        lines.append(f"DESCRIPTION:{_escape(item['description'])}")
+    lines += _alarm(item.get('reminderBefore'))
+    lines.append("END:VEVENT")
+    return lines
+
+
+def _alarm(minutes) -> List[str]:
+    if not isinstance(minutes, int) or minutes <= 0:
+        return []
+    return [
+        "BEGIN:VALARM",
+        "ACTION:DISPLAY",
+        "DESCRIPTION:Напоминание",
+        f"TRIGGER:-PT{minutes}M",
+        "END:VALARM",
+    ]
+
+
+def iter_calendar(
+    user_id: int,
+    schedule: List[Dict],
+    deadlines: List[Dict],
+    state: Optional[Dict] = None
+) -> Iterator[str]:
+    """Генерирует календарь порциями не больше CHUNK_SIZE символов"""
+    rules = Rules(state)
+    # Время пар и дедлайнов - местное время пользователя
+    tz = user_timezone(state or {})
+    now = datetime.now(timezone.utc)
+    stamp = f"{now:%Y%m%dT%H%M%SZ}"
+    # Повторяющиеся пары начинаются с текущей недели пользователя
+    week_start = _week_start(now.astimezone(tz))
+
+    def lines() -> Iterator[str]:
+        yield "BEGIN:VCALENDAR"
+        yield "VERSION:2.0"
+        yield "PRODID:-//typekeeper-bot//RU"
+        yield "CALSCALE:GREGORIAN"
+        yield "X-WR-CALNAME:Расписание"
+        yield f"X-WR-TIMEZONE:{tz.key}"
+        yield from _vtimezone(tz, now.year)
+        for item in schedule:
+            if isinstance(item, dict):
+                yield from _schedule_event(user_id, item, week_start, stamp, rules, tz.key)
+        for item in deadlines:
+            if isinstance(item, dict):
+                yield from _deadline_event(user_id, item, stamp, tz.key)
+        yield "END:VCALENDAR"
+
+    chunk: List[str] = []
+    size = 0
+    for line in lines():
+        folded = _fold(line)
+        chunk.append(folded)
+        size += len(folded)
+        if size >= CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+# ==================== HTTP ====================
+
+def _etag(user_id: int, updated_at: datetime, group_hash: Optional[str]) -> str:
+    # Расписание группы меняется без изменения updated_at участника
+    suffix = f"-{group_hash[:16]}" if group_hash else ""
+    return f'"{user_id}-{int(updated_at.timestamp() * 1_000_000)}{suffix}"'
+
+
+async def handle_calendar(request: web.Request) -> web.StreamResponse:
+    """GET /calendar/{token}.ics - календарь пользователя"""
+    user_id = parse_token(request.match_info['token'])
+    if user_id is None:
+        raise web.HTTPNotFound()
+
+    # Дешевая проверка по updated_at без чтения расписания
+    version = await Database.get_feed_version(user_id)
+    if version is None:
+        raise web.HTTPNotFound()
+
+    etag = _etag(user_id, *version)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'private, max-age={CACHE_MAX_AGE}',
+    }
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+        return web.Response(status=304, headers=headers)
+
+    user_data = await user_storage.get_user_data(user_id)
+
+    response = web.StreamResponse(headers=headers)
+    response.content_type = 'text/calendar'
+    response.charset = 'utf-8'
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    schedule = await group_timetables.effective_schedule(user_id, user_data)
+    chunks = iter_calendar(user_id, schedule, user_data['deadlines'], user_data['state'])
+    for chunk in chunks:
+        await response.write(chunk.encode('utf-8'))
+    await response.write_eof()
+    return response
@@ -0,0 +1,80 @@
+"""
+Компактные callback_data для кнопок списков (расписание и дедлайны)
+
+Telegram ограничивает callback_data 64 байтами, поэтому поля кнопки
+упаковываются в 12 байт и кодируются base64 (16 символов):
+версия формата, действие, список, версия данных пользователя, страница,
+номер записи и поле. Версия данных - контрольная сумма списка на момент
+отрисовки: если список с тех пор изменился, нажатие не применяется
+к чужой записи, а страница перерисовывается.
+"""
+import base64
+import binascii
+import struct
+from typing import NamedTuple, Optional
+
+# Первый символ отличает эти кнопки от остальных ("day_..." и т.п.)
+CALLBACK_PREFIX = "~"
+CALLBACK_PATTERN = f"^{CALLBACK_PREFIX}"
+
+# При изменении _STRUCT увеличивается - старые кнопки перестают разбираться
+FORMAT_VERSION = 1
+_STRUCT = struct.Struct('>BBBIHHB')
+
+# Списки
+KIND_SCHEDULE = 0
+KIND_DEADLINES = 1
+KIND_FIELDS = {KIND_SCHEDULE: 'schedule', KIND_DEADLINES: 'deadlines'}
+
+# Действия
+ACTION_PAGE = 0
+ACTION_EDIT = 1
+ACTION_DELETE = 2
+ACTION_FIELD = 3
+
+# Поля дедлайна для ACTION_FIELD
+FIELD_NONE = 0
+FIELD_NAME = 1
+FIELD_DATETIME = 2
+FIELD_DESCRIPTION = 3
+FIELD_REMINDER = 4
+DEADLINE_FIELDS = {
+    FIELD_NAME: 'name',
+    FIELD_DATETIME: 'datetime',
+    FIELD_DESCRIPTION: 'description',
+    FIELD_REMINDER: 'reminderBefore',
+}
+
+
+class ItemCallback(NamedTuple):
+    action: int
+    kind: int
+    version: int
+    page: int
+    index: int = 0
+    field: int = FIELD_NONE
+
+
+def encode_callback(callback: ItemCallback) -> str:
+    """ItemCallback -> строка для callback_data"""
+    packed = _STRUCT.pack(
+        FORMAT_VERSION, callback.action, callback.kind,
+        callback.version, callback.page, callback.index, callback.field
+    )
+    return CALLBACK_PREFIX + base64.urlsafe_b64encode(packed).decode('ascii')
+
+
+def decode_callback(data: str) -> Optional[ItemCallback]:
+    """Строка callback_data -> ItemCallback (None, если кнопка устарела или повреждена)"""
+    if not data or not data.startswith(CALLBACK_PREFIX):
+        return None
+    try:
+        packed = base64.urlsafe_b64decode(data[len(CALLBACK_PREFIX):])
+    except (binascii.Error, ValueError):
+        return None
+    if len(packed) != _STRUCT.size:
+        return None
+    fmt, action, kind, version, page, index, field = _STRUCT.unpack(packed)
+    if fmt != FORMAT_VERSION or kind not in KIND_FIELDS:
+        return None
+    return ItemCallback(action, kind, version, page, index, field)
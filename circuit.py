@@ -0,0 +1,85 @@
+"""
+Предохранитель (circuit breaker) для обращений к базе данных
+
+Закрыт - запросы идут как обычно. После failure_threshold сбоев подряд
+размыкается: запросы сразу получают DatabaseUnavailable, не дожидаясь
+таймаута и не занимая подключения пула. Через reset_timeout секунд
+пропускает один пробный запрос (полуоткрыт): успех замыкает предохранитель,
+сбой снова размыкает, а отмененный пробный запрос уступает место следующему.
+"""
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class DatabaseUnavailable(Exception):
+    """БД не отвечает или предохранитель разомкнут"""
+
+
+class CircuitBreaker:
+    """Предохранитель с порогом сбоев подряд и пробным запросом"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 15.0):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        # Сколько запросов отклонено без обращения к БД
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._reset_timeout:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def is_open(self) -> bool:
+        """Разомкнут и время пробного запроса еще не пришло"""
+        return self.state == OPEN
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self._state != CLOSED:
+            logger.info(f"✅ {self.name}: связь восстановлена, предохранитель замкнут")
+        self._state = CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def release_trial(self):
+        """
+        Пробный запрос отменен, не дождавшись ответа БД (клиент отключился):
+        о состоянии БД он ничего не сказал, следующий запрос станет пробным
+        """
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        was_trial = self._trial_in_flight
+        self._trial_in_flight = False
+        if was_trial or self._failures >= self._failure_threshold:
+            if self._state != OPEN or was_trial:
+                logger.error(
+                    f"🔌 {self.name}: предохранитель разомкнут на {self._reset_timeout:.0f} сек "
+                    f"(сбоев подряд: {self._failures})"
+                )
+            self._state = OPEN
+            self._opened_at = time.monotonic()
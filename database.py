@@ -1,75 +1,618 @@
 """
 Асинхронный пул подключений к PostgreSQL
+
+Если задан DATABASE_REPLICA_URL, запросы только на чтение идут через
+второй пул - на реплику. Пользователь, который только что что-то записал,
+REPLICA_STICKY_SECONDS читает свои данные с основной БД: реплика может
+еще не получить его изменения.
 """
 import os
+import time
+import asyncio
 import asyncpg
 import json
-from typing import List, Dict, Any, Optional
+import functools
+import contextvars
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, TypeVar, Union
+
+from circuit import CircuitBreaker, DatabaseUnavailable
+
+# Таймауты обычных операций (секунды); фоновые задачи живут с command_timeout пула
+READ_TIMEOUT = float(os.environ.get('DB_READ_TIMEOUT', 3))
+WRITE_TIMEOUT = float(os.environ.get('DB_WRITE_TIMEOUT', 5))
+
+# Ошибки, означающие, что БД недоступна (а не что запрос неверный)
+_UNAVAILABLE_ERRORS = (
+    asyncio.TimeoutError,
+    OSError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.InterfaceError,
+    asyncpg.InsufficientResourcesError,
+    asyncpg.OperatorInterventionError,
+)
+
+# Общий предохранитель для всех обращений к БД
+breaker = CircuitBreaker("PostgreSQL")
+# Отдельный предохранитель реплики: при ее сбое чтение идет с основной БД
+replica_breaker = CircuitBreaker("PostgreSQL (реплика)")
+
+# Сколько секунд после записи читать данные пользователя с основной БД,
+# чтобы он видел свои изменения, пока реплика отстает
+REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+# Сколько ждать реплику (подключение и запрос), прежде чем повторить чтение
+# на основной БД: вместе с повтором укладывается в READ_TIMEOUT
+REPLICA_TIMEOUT = float(os.environ.get('DB_REPLICA_TIMEOUT', READ_TIMEOUT / 2))
+# Порог размера таблицы недавних записей, после которого из нее удаляются устаревшие
+_MAX_RECENT_WRITERS = 10_000
+
+# Вложенные вызовы (load_user_data -> create_user_if_not_exists) идут
+# под таймаутом и учетом внешнего вызова
+_inside_guard = contextvars.ContextVar('inside_guard', default=False)
+
+T = TypeVar('T')
+
+def guarded(timeout: float):
+    """
+    Оборачивает метод Database: ограничивает время выполнения и учитывает
+    сбои в предохранителе. При недоступности БД - DatabaseUnavailable.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _inside_guard.get():
+                return await func(*args, **kwargs)
+            if not breaker.allow():
+                raise DatabaseUnavailable(f"{func.__name__}: БД временно недоступна")
+            token = _inside_guard.set(True)
+            try:
+                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+            except _UNAVAILABLE_ERRORS as e:
+                breaker.record_failure()
+                raise DatabaseUnavailable(f"{func.__name__}: {e!r}") from e
+            except asyncio.CancelledError:
+                # Отмена (клиент вебхука отключился) - не ответ БД, но пробный
+                # запрос полуоткрытого предохранителя нужно освободить
+                breaker.release_trial()
+                raise
+            except Exception:
+                # БД ответила, ошибка в самом запросе
+                breaker.record_success()
+                raise
+            finally:
+                _inside_guard.reset(token)
+            breaker.record_success()
+            return result
+        return wrapper
+    return decorator
+
+# Изменения схемы без блокировки users: DDL ждет блокировку таблицы не дольше
+# DDL_LOCK_TIMEOUT (иначе за ним в очередь встают обычные запросы) и повторяется
+DDL_LOCK_TIMEOUT = os.environ.get('DB_DDL_LOCK_TIMEOUT', '3s')
+DDL_RETRIES = 5
+# Сборка индекса CONCURRENTLY на большой таблице идет дольше command_timeout пула
+INDEX_BUILD_TIMEOUT = 6 * 3600
+# Ключ advisory-блокировки миграций (к нему прибавляется версия шага)
+MIGRATION_LOCK_ID = 7_046_000
+
+
+class ConcurrentIndex(NamedTuple):
+    """Индекс, который строится CREATE INDEX CONCURRENTLY в фоне, не блокируя запись"""
+    name: str
+    # Все после имени индекса: "ON users (...) WHERE ..."
+    definition: str
+
+
+class Backfill(NamedTuple):
+    """
+    Перенос данных порциями по возрастанию ключа table.key в фоне.
+    sql получает $1 - массив ключей порции - и меняет только эти строки,
+    не трогая updated_at. Прогресс хранится в schema_backfills, поэтому
+    после перезапуска перенос продолжается с места остановки.
+    """
+    table: str
+    sql: str
+    key: str = 'user_id'
+    # Какие строки вообще нужно обработать
+    where: str = 'TRUE'
+    batch_size: int = 500
+
+
+SchemaStep = Union[str, ConcurrentIndex, Backfill]
+
+# Шаги схемы по версиям. Строка - DDL в транзакции при запуске (init_database),
+# ConcurrentIndex и Backfill - в фоне (migrations.migration_job).
+# Шаги, которым нужен завершенный Backfill, выпускаются отдельным релизом.
+SCHEMA_STEPS: Dict[int, SchemaStep] = {
+    1: '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            schedule JSONB DEFAULT '[]',
+            deadlines JSONB DEFAULT '[]',
+            state JSONB DEFAULT '{}',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_users_updated 
+        ON users(updated_at DESC);
+    ''',
+    # Время хранится в UTC с часовым поясом
+    2: '''
+        ALTER TABLE users
+            ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at AT TIME ZONE 'UTC',
+            ALTER COLUMN updated_at TYPE TIMESTAMPTZ USING updated_at AT TIME ZONE 'UTC';
+    ''',
+    # Рассылки и пользователи, заблокировавшие бота
+    3: '''
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMPTZ;
+        
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id BIGSERIAL PRIMARY KEY,
+            admin_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+    ''',
+    # Холодный архив: давно неактивные пользователи и прошедшие дедлайны
+    4: '''
+        CREATE TABLE IF NOT EXISTS users_archive (
+            user_id BIGINT PRIMARY KEY,
+            schedule JSONB DEFAULT '[]',
+            deadlines JSONB DEFAULT '[]',
+            state JSONB DEFAULT '{}',
+            created_at TIMESTAMPTZ,
+            updated_at TIMESTAMPTZ,
+            blocked_at TIMESTAMPTZ,
+            archived_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE TABLE IF NOT EXISTS deadlines_archive (
+            id BIGSERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            deadline JSONB NOT NULL,
+            archived_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_deadlines_archive_user
+        ON deadlines_archive(user_id);
+    ''',
+    # Участники групп: индекс по ссылке на группу в state, строится
+    # в фоне (таблицы групп - шаг 7, при запуске)
+    5: ConcurrentIndex(
+        'idx_users_group',
+        "ON users (((state -> 'group' ->> 'id')::bigint)) WHERE state ? 'group'"
+    ),
+    # Статистика использования: строка на (час, процесс), см. stats.py
+    6: '''
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            hour TIMESTAMPTZ NOT NULL,
+            instance TEXT NOT NULL,
+            updates BIGINT NOT NULL DEFAULT 0,
+            users BYTEA NOT NULL,
+            schedule_added BIGINT NOT NULL DEFAULT 0,
+            deadlines_added BIGINT NOT NULL DEFAULT 0,
+            reminders_sent BIGINT NOT NULL DEFAULT 0,
+            latency JSONB NOT NULL DEFAULT '{}',
+            PRIMARY KEY (hour, instance)
+        );
+    ''',
+    # Общие расписания групп: содержимое хранится один раз по хэшу,
+    # участники ссылаются на группу через state -> 'group'
+    7: '''
+        CREATE TABLE IF NOT EXISTS timetables (
+            hash TEXT PRIMARY KEY,
+            schedule JSONB NOT NULL,
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE TABLE IF NOT EXISTS groups (
+            id BIGSERIAL PRIMARY KEY,
+            invite_code TEXT UNIQUE NOT NULL,
+            owner_id BIGINT NOT NULL,
+            timetable_hash TEXT NOT NULL REFERENCES timetables(hash),
+            created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+    ''',
+    # Примененные записи журнала (storage): повтор записи с тем же id
+    # после сбоя посреди воспроизведения пропускается
+    8: '''
+        CREATE TABLE IF NOT EXISTS applied_writes (
+            id TEXT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            applied_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_applied_writes_applied
+        ON applied_writes(applied_at);
+    ''',
+}
+
+def _parse_json(data, default):
+    """asyncpg без кодека отдает JSONB строкой"""
+    if isinstance(data, str):
+        try:
+            return json.loads(data)
+        except ValueError:
+            return default
+    return data if data is not None else default
 
 class Database:
     """Класс для работы с базой данных через пул подключений"""
     
     _pool: Optional[asyncpg.Pool] = None
+    _replica_pool: Optional[asyncpg.Pool] = None
+    _pool_lock = asyncio.Lock()
+    # user_id -> когда пользователь последний раз писал (time.monotonic())
+    _recent_writes: Dict[int, float] = {}
+    
+    @classmethod
+    async def _create_pool(cls, database_url: str) -> asyncpg.Pool:
+        # Парсим URL для Railway (может быть с postgresql:// или postgres://)
+        if database_url.startswith('postgresql://'):
+            database_url = database_url.replace('postgresql://', 'postgres://', 1)
+        
+        return await asyncpg.create_pool(
+            dsn=database_url,
+            min_size=1,
+            max_size=10,  # Ограничиваем подключения
+            max_queries=50000,
+            max_inactive_connection_lifetime=300,  # 5 минут
+            command_timeout=60,  # 60 секунд на запрос
+        )
     
     @classmethod
     async def get_pool(cls) -> asyncpg.Pool:
         """Получаем или создаем пул подключений"""
-        if cls._pool is None or cls._pool._closed:
+        if cls._pool is not None and not cls._pool._closed:
+            return cls._pool
+        
+        # Шаги запуска идут параллельно - пул должен создаваться один раз
+        async with cls._pool_lock:
+            if cls._pool is not None and not cls._pool._closed:
+                return cls._pool
+            
             database_url = os.environ.get('DATABASE_URL')
             if not database_url:
                 raise ValueError("DATABASE_URL not set")
             
-            # Парсим URL для Railway (может быть с postgresql:// или postgres://)
-            if database_url.startswith('postgresql://'):
-                database_url = database_url.replace('postgresql://', 'postgres://', 1)
-            
-            cls._pool = await asyncpg.create_pool(
-                dsn=database_url,
-                min_size=1,
-                max_size=10,  # Ограничиваем подключения
-                max_queries=50000,
-                max_inactive_connection_lifetime=300,  # 5 минут
-                command_timeout=60,  # 60 секунд на запрос
-            )
+            cls._pool = await cls._create_pool(database_url)
         
         return cls._pool
     
+    @classmethod
+    async def get_replica_pool(cls) -> Optional[asyncpg.Pool]:
+        """Пул реплики для чтения (None, если DATABASE_REPLICA_URL не задан)"""
+        if cls._replica_pool is not None and not cls._replica_pool._closed:
+            return cls._replica_pool
+        
+        replica_url = os.environ.get('DATABASE_REPLICA_URL')
+        if not replica_url:
+            return None
+        
+        async with cls._pool_lock:
+            if cls._replica_pool is None or cls._replica_pool._closed:
+                cls._replica_pool = await cls._create_pool(replica_url)
+        
+        return cls._replica_pool
+    
+    @classmethod
+    def mark_written(cls, *user_ids: int):
+        """Запоминает запись: ближайшие чтения этих пользователей - с основной БД"""
+        if not os.environ.get('DATABASE_REPLICA_URL'):
+            return
+        now = time.monotonic()
+        if len(cls._recent_writes) > _MAX_RECENT_WRITERS:
+            cls._recent_writes = {
+                user_id: written for user_id, written in cls._recent_writes.items()
+                if now - written < REPLICA_STICKY_SECONDS
+            }
+        for user_id in user_ids:
+            cls._recent_writes[user_id] = now
+    
+    @classmethod
+    def _sticky(cls, user_id: Optional[int]) -> bool:
+        written = cls._recent_writes.get(user_id) if user_id is not None else None
+        return written is not None and time.monotonic() - written < REPLICA_STICKY_SECONDS
+    
+    @classmethod
+    async def _acquire_replica(
+        cls, user_id: Optional[int]
+    ) -> Optional[Tuple[asyncpg.Pool, asyncpg.Connection]]:
+        """
+        Подключение к реплике, если она настроена и доступна, а пользователь
+        user_id недавно ничего не писал. Иначе None - читать с основной БД.
+        """
+        if cls._sticky(user_id) or not os.environ.get('DATABASE_REPLICA_URL'):
+            return None
+        if not replica_breaker.allow():
+            return None
+        try:
+            replica = await cls.get_replica_pool()
+            return replica, await replica.acquire(timeout=REPLICA_TIMEOUT)
+        except Exception as e:
+            # Любая ошибка подключения к реплике (и ее настройки) - читаем с основной
+            replica_breaker.record_failure()
+            print(f"❌ Реплика недоступна, чтение с основной БД: {e!r}")
+            return None
+        except asyncio.CancelledError:
+            replica_breaker.release_trial()
+            raise
+    
+    @classmethod
+    @asynccontextmanager
+    async def read_connection(cls, user_id: Optional[int] = None):
+        """
+        Подключение для долгого чтения курсором (фоновые задачи): с реплики,
+        если она доступна (см. _acquire_replica), иначе с основной БД.
+        Обычные запросы идут через read - с повтором на основной БД.
+        """
+        acquired = await cls._acquire_replica(user_id)
+        if acquired is None:
+            pool = await cls.get_pool()
+            async with pool.acquire() as conn:
+                yield conn
+            return
+        
+        replica, conn = acquired
+        replica_breaker.record_success()
+        try:
+            yield conn
+        finally:
+            await replica.release(conn)
+    
+    @classmethod
+    async def read(
+        cls,
+        query: Callable[[asyncpg.Connection], Awaitable[T]],
+        user_id: Optional[int] = None
+    ) -> T:
+        """
+        Выполняет query(conn) только на чтение: на реплике, а если реплика
+        не ответила за REPLICA_TIMEOUT или оборвала соединение - повторно на
+        основной БД. Сбои реплики учитываются только в replica_breaker:
+        отстающая реплика не размыкает основной предохранитель.
+        """
+        acquired = await cls._acquire_replica(user_id)
+        if acquired is not None:
+            replica, conn = acquired
+            try:
+                result = await asyncio.wait_for(query(conn), REPLICA_TIMEOUT)
+            except _UNAVAILABLE_ERRORS as e:
+                replica_breaker.record_failure()
+                print(f"❌ Реплика не ответила, чтение с основной БД: {e!r}")
+            except asyncio.CancelledError:
+                replica_breaker.release_trial()
+                raise
+            except Exception:
+                # Реплика ответила, ошибка в самом запросе
+                replica_breaker.record_success()
+                raise
+            else:
+                replica_breaker.record_success()
+                return result
+            finally:
+                await replica.release(conn)
+        
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            return await query(conn)
+    
     @classmethod
     async def close_pool(cls):
-        """Закрываем пул подключений"""
+        """Закрываем пулы подключений"""
         if cls._pool and not cls._pool._closed:
             await cls._pool.close()
             cls._pool = None
+        if cls._replica_pool and not cls._replica_pool._closed:
+            await cls._replica_pool.close()
+            cls._replica_pool = None
     
     @classmethod
-    async def init_database(cls):
-        """Инициализация таблиц"""
+    async def measure_pool_wait(cls, timeout: float) -> float:
+        """Сколько пришлось ждать свободного подключения из пула (не больше timeout)"""
+        pool = await cls.get_pool()
+        started = time.perf_counter()
+        try:
+            async with pool.acquire(timeout=timeout):
+                return time.perf_counter() - started
+        except asyncio.TimeoutError:
+            return timeout
+    
+    @classmethod
+    async def get_applied_versions(cls, conn: asyncpg.Connection) -> Set[int]:
+        """Примененные шаги схемы (пусто, если схема еще не создавалась)"""
+        try:
+            rows = await conn.fetch('SELECT version FROM schema_version')
+        except asyncpg.UndefinedTableError:
+            return set()
+        return {row['version'] for row in rows}
+    
+    @classmethod
+    async def _record_version(cls, conn: asyncpg.Connection, version: int):
+        await conn.execute('''
+            INSERT INTO schema_version (version) VALUES ($1)
+            ON CONFLICT (version) DO NOTHING
+        ''', version)
+    
+    @classmethod
+    async def init_database(cls) -> bool:
+        """
+        Применяет DDL-шаги схемы, которых еще нет в БД (пропускается, если
+        схема актуальна). Фоновые шаги только регистрируются - их выполняет
+        migrations.migration_job. True, если DDL применялся.
+        """
         pool = await cls.get_pool()
         async with pool.acquire() as conn:
+            if await cls.get_applied_versions(conn) >= set(SCHEMA_STEPS):
+                return False
+            
             await conn.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    schedule JSONB DEFAULT '[]',
-                    deadlines JSONB DEFAULT '[]',
-                    state JSONB DEFAULT '{}',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INTEGER PRIMARY KEY,
+                    applied_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
                 );
                 
-                CREATE INDEX IF NOT EXISTS idx_users_updated 
-                ON users(updated_at DESC);
+                CREATE TABLE IF NOT EXISTS schema_backfills (
+                    version INTEGER PRIMARY KEY,
+                    last_key BIGINT NOT NULL,
+                    rows BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+                );
             ''')
+            
+            # Процессы запускаются одновременно - DDL применяет один из них
+            await conn.execute('SELECT pg_advisory_lock($1)', MIGRATION_LOCK_ID)
+            try:
+                applied = await cls.get_applied_versions(conn)
+                pending = [
+                    version for version in sorted(SCHEMA_STEPS)
+                    if version not in applied and isinstance(SCHEMA_STEPS[version], str)
+                ]
+                for version in pending:
+                    await cls._apply_ddl(conn, version)
+                return bool(pending)
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', MIGRATION_LOCK_ID)
+    
+    @classmethod
+    async def _apply_ddl(cls, conn: asyncpg.Connection, version: int):
+        for attempt in range(1, DDL_RETRIES + 1):
+            try:
+                async with conn.transaction():
+                    await conn.execute(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+                    await conn.execute(SCHEMA_STEPS[version])
+                    await cls._record_version(conn, version)
+                return
+            except asyncpg.LockNotAvailableError:
+                if attempt == DDL_RETRIES:
+                    raise
+                print(f"❌ Шаг схемы {version}: таблица занята, повтор {attempt}/{DDL_RETRIES}")
+                await asyncio.sleep(attempt)
+    
+    # ==================== ФОНОВЫЕ МИГРАЦИИ ====================
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def pending_online_steps(cls) -> List[int]:
+        """Фоновые шаги схемы, которые еще не завершены"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            applied = await cls.get_applied_versions(conn)
+        return [
+            version for version in sorted(SCHEMA_STEPS)
+            if version not in applied and not isinstance(SCHEMA_STEPS[version], str)
+        ]
+    
+    @classmethod
+    async def build_index_concurrently(cls, version: int) -> bool:
+        """
+        Строит индекс шага CONCURRENTLY (вне транзакции). False, если его
+        уже строит другой процесс.
+        """
+        step = SCHEMA_STEPS[version]
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            lock_id = MIGRATION_LOCK_ID + version
+            if not await conn.fetchval('SELECT pg_try_advisory_lock($1)', lock_id):
+                return False
+            try:
+                valid = await conn.fetchval('''
+                    SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)
+                ''', step.name)
+                if valid is False:
+                    # Прерванная сборка оставляет нерабочий индекс - строим заново
+                    await conn.execute(
+                        f'DROP INDEX CONCURRENTLY IF EXISTS {step.name}',
+                        timeout=INDEX_BUILD_TIMEOUT
+                    )
+                if not valid:
+                    await conn.execute(
+                        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {step.name} {step.definition}',
+                        timeout=INDEX_BUILD_TIMEOUT
+                    )
+                await cls._record_version(conn, version)
+                return True
+            finally:
+                await conn.execute('SELECT pg_advisory_unlock($1)', lock_id)
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def run_backfill_batch(cls, version: int) -> Optional[List[int]]:
+        """
+        Одна порция переноса данных в своей транзакции. Возвращает ключи
+        обработанных строк ([] - порцию сейчас обрабатывает другой процесс),
+        None - перенос завершен.
+        """
+        step = SCHEMA_STEPS[version]
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if not await conn.fetchval(
+                    'SELECT pg_try_advisory_xact_lock($1)', MIGRATION_LOCK_ID + version
+                ):
+                    return []
+                await conn.execute(f"SET LOCAL lock_timeout = '{DDL_LOCK_TIMEOUT}'")
+                last_key = await conn.fetchval(
+                    'SELECT last_key FROM schema_backfills WHERE version = $1', version
+                )
+                rows = await conn.fetch(f'''
+                    SELECT {step.key} AS key FROM {step.table}
+                    WHERE ($1::bigint IS NULL OR {step.key} > $1) AND ({step.where})
+                    ORDER BY {step.key}
+                    LIMIT $2
+                ''', last_key, step.batch_size)
+                keys = [row['key'] for row in rows]
+                if not keys:
+                    await cls._record_version(conn, version)
+                    await conn.execute('DELETE FROM schema_backfills WHERE version = $1', version)
+                    return None
+                
+                await conn.execute(step.sql, keys)
+                await conn.execute('''
+                    INSERT INTO schema_backfills (version, last_key, rows)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (version) DO UPDATE
+                    SET last_key = EXCLUDED.last_key,
+                        rows = schema_backfills.rows + EXCLUDED.rows,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', version, keys[-1], len(keys))
+                return keys
+    
+    # ==================== ПОЛЬЗОВАТЕЛИ ====================
     
     @classmethod
+    @guarded(WRITE_TIMEOUT)
     async def create_user_if_not_exists(cls, user_id: int) -> bool:
-        """Создает пользователя если не существует"""
+        """Создает пользователя если не существует (или возвращает его из архива)"""
         pool = await cls.get_pool()
         async with pool.acquire() as conn:
             async with conn.transaction():
                 try:
+                    exists = await conn.fetchval(
+                        'SELECT 1 FROM users WHERE user_id = $1', user_id
+                    )
+                    if exists:
+                        return True
+                    cls.mark_written(user_id)
                     await conn.execute('''
-                        INSERT INTO users (user_id, schedule, deadlines, state)
-                        VALUES ($1, '[]', '[]', '{}')
+                        WITH restored AS (
+                            DELETE FROM users_archive WHERE user_id = $1
+                            RETURNING user_id, schedule, deadlines, state, created_at
+                        )
+                        INSERT INTO users (user_id, schedule, deadlines, state, created_at)
+                        SELECT user_id, schedule, deadlines, state, created_at FROM restored
+                        UNION ALL
+                        SELECT $1, '[]', '[]', '{}', CURRENT_TIMESTAMP
+                        WHERE NOT EXISTS (SELECT 1 FROM restored)
                         ON CONFLICT (user_id) DO NOTHING
                     ''', user_id)
                     return True
@@ -77,6 +620,7 @@ class Database:
                     return False
     
     @classmethod
+    @guarded(WRITE_TIMEOUT)
     async def save_user_data(
         cls, 
         user_id: int, 
@@ -103,41 +647,90 @@ class Database:
                             updated_at = CURRENT_TIMESTAMP
                     ''', user_id, schedule_json, deadlines_json, state_json)
                     
+                    cls.mark_written(user_id)
                     return True
                 except Exception as e:
                     print(f"❌ Ошибка сохранения данных: {e}")
                     return False
     
     @classmethod
-    async def load_user_data(cls, user_id: int) -> Dict[str, Any]:
-        """Загружает все данные пользователя"""
-        await cls.create_user_if_not_exists(user_id)
-        
+    @guarded(WRITE_TIMEOUT)
+    async def append_schedule_entries(
+        cls,
+        user_id: int,
+        entries: List[Dict],
+        write_id: Optional[str] = None
+    ) -> bool:
+        """
+        Добавляет пары в конец расписания одним запросом в транзакции.
+        write_id - id записи журнала: он сохраняется в applied_writes в той же
+        транзакции, и повтор записи после сбоя посреди воспроизведения
+        ничего не добавляет (одинаковые пары из разных записей добавляются)
+        """
         pool = await cls.get_pool()
         async with pool.acquire() as conn:
-            row = await conn.fetchrow('''
+            async with conn.transaction():
+                try:
+                    if write_id is not None:
+                        inserted = await conn.fetchval('''
+                            INSERT INTO applied_writes (id, user_id) VALUES ($1, $2)
+                            ON CONFLICT (id) DO NOTHING
+                            RETURNING id
+                        ''', write_id, user_id)
+                        if inserted is None:
+                            return True
+                    entries_json = json.dumps(entries, ensure_ascii=False)
+                    await conn.execute('''
+                        INSERT INTO users (user_id, schedule, deadlines, state, updated_at)
+                        VALUES ($1, $2::jsonb, '[]', '{}', CURRENT_TIMESTAMP)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET schedule = COALESCE(users.schedule, '[]'::jsonb) || EXCLUDED.schedule,
+                            updated_at = CURRENT_TIMESTAMP
+                    ''', user_id, entries_json)
+                    cls.mark_written(user_id)
+                    return True
+                except Exception as e:
+                    print(f"❌ Ошибка импорта расписания: {e}")
+                    return False
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def load_user_data(cls, user_id: int) -> Dict[str, Any]:
+        """Загружает все данные пользователя (нового - создает)"""
+        async def fetch(conn: asyncpg.Connection):
+            return await conn.fetchrow('''
                 SELECT schedule, deadlines, state 
                 FROM users WHERE user_id = $1
             ''', user_id)
+        
+        row = await cls.read(fetch, user_id)
+        if row is None:
+            # Нового пользователя (или вернувшегося из архива) создает основная
+            # БД; реплика могла еще не получить строку - читаем оттуда же
+            await cls.create_user_if_not_exists(user_id)
+            pool = await cls.get_pool()
+            async with pool.acquire() as conn:
+                row = await fetch(conn)
+        
+        if row:
+            def parse_json(data):
+                if isinstance(data, str):
+                    try:
+                        return json.loads(data)
+                    except:
+                        return []
+                return data or []
             
-            if row:
-                def parse_json(data):
-                    if isinstance(data, str):
-                        try:
-                            return json.loads(data)
-                        except:
-                            return []
-                    return data or []
-                
-                return {
-                    'schedule': parse_json(row['schedule']),
-                    'deadlines': parse_json(row['deadlines']),
-                    'state': parse_json(row['state'])
-                }
-            
-            return {'schedule': [], 'deadlines': [], 'state': {}}
+            return {
+                'schedule': parse_json(row['schedule']),
+                'deadlines': parse_json(row['deadlines']),
+                'state': parse_json(row['state'])
+            }
+        
+        return {'schedule': [], 'deadlines': [], 'state': {}}
     
     @classmethod
+    @guarded(WRITE_TIMEOUT)
     async def update_user_state(cls, user_id: int, state: Dict) -> bool:
         """Обновляет только состояние пользователя"""
         pool = await cls.get_pool()
@@ -150,25 +743,586 @@ class Database:
                         SET state = $2, updated_at = CURRENT_TIMESTAMP
                         WHERE user_id = $1
                     ''', user_id, state_json)
+                    cls.mark_written(user_id)
                     return True
                 except Exception:
                     return False
     
     @classmethod
+    @guarded(READ_TIMEOUT)
     async def get_user_state(cls, user_id: int) -> Dict:
         """Получает состояние пользователя"""
+        row = await cls.read(lambda conn: conn.fetchrow('''
+            SELECT state FROM users WHERE user_id = $1
+        ''', user_id), user_id)
+        
+        if row and row['state']:
+            if isinstance(row['state'], str):
+                try:
+                    return json.loads(row['state'])
+                except:
+                    return {}
+            return row['state']
+        
+        return {}
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def get_feed_version(cls, user_id: int) -> Optional[Tuple[datetime, Optional[str]]]:
+        """
+        Время последнего изменения данных пользователя и хэш расписания
+        его группы (None, если пользователя нет)
+        """
+        row = await cls.read(lambda conn: conn.fetchrow('''
+            SELECT u.updated_at, g.timetable_hash
+            FROM users u
+            LEFT JOIN groups g ON g.id = (u.state -> 'group' ->> 'id')::bigint
+            WHERE u.user_id = $1
+        ''', user_id), user_id)
+        return (row['updated_at'], row['timetable_hash']) if row else None
+    
+    @classmethod
+    async def load_state_key(cls, key: str) -> Dict[int, Any]:
+        """Загружает значение ключа state для всех пользователей, у которых он есть"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                rows = await conn.fetch('''
+                    SELECT user_id, state -> $1 AS value
+                    FROM users WHERE state ? $1
+                ''', key)
+            except asyncpg.UndefinedTableError:
+                return {}
+        
+        result = {}
+        for row in rows:
+            value = row['value']
+            if isinstance(value, str):
+                value = json.loads(value)
+            result[row['user_id']] = value
+        return result
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def patch_user_states(
+        cls,
+        patches: List[Tuple[int, Dict, List[str]]]
+    ) -> bool:
+        """
+        Пакетно обновляет ключи state нескольких пользователей одной транзакцией.
+        Каждый патч: (user_id, ключи для записи, ключи для удаления).
+        updated_at не меняется: состояния диалогов не попадают в календарь,
+        и его ETag не должен сбрасываться от каждого нажатия кнопки.
+        """
+        if not patches:
+            return True
+        
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                try:
+                    await conn.executemany('''
+                        INSERT INTO users (user_id, schedule, deadlines, state)
+                        VALUES ($1, '[]', '[]', $2::jsonb)
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET state = (COALESCE(users.state, '{}'::jsonb) - $3::text[]) || $2::jsonb
+                    ''', [
+                        (user_id, json.dumps(values, ensure_ascii=False), removed)
+                        for user_id, values, removed in patches
+                    ])
+                    cls.mark_written(*(user_id for user_id, _, _ in patches))
+                    return True
+                except Exception as e:
+                    print(f"❌ Ошибка пакетного сохранения состояний: {e}")
+                    return False
+    
+    @classmethod
+    async def iter_reminder_sources(cls, batch_size: int = 500):
+        """
+        Курсором перебирает пользователей, у которых есть пары или дедлайны.
+        Отдает (user_id, schedule, deadlines, state).
+        """
+        async with cls.read_connection() as conn:
+            async with conn.transaction():
+                async for row in conn.cursor('''
+                    SELECT user_id, schedule, deadlines, state
+                    FROM users
+                    WHERE schedule <> '[]'::jsonb OR deadlines <> '[]'::jsonb
+                       OR state ? 'group'
+                ''', prefetch=batch_size):
+                    yield (
+                        row['user_id'],
+                        _parse_json(row['schedule'], []),
+                        _parse_json(row['deadlines'], []),
+                        _parse_json(row['state'], {})
+                    )
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def search_user_items(
+        cls,
+        user_id: int,
+        patterns: List[str],
+        limit: int
+    ) -> Optional[Tuple[List[Tuple[int, int, Dict]], bool]]:
+        """
+        Пары и дедлайны пользователя, в тексте которых (в нижнем регистре,
+        ё -> е) есть все шаблоны LIKE из patterns. Отбор идет в БД - передаются
+        только найденные записи: [(список, индекс, запись)] и признак участия
+        в группе. None, если пользователя нет.
+        """
+        async def query(conn: asyncpg.Connection):
+            in_group = await conn.fetchval(
+                "SELECT COALESCE(state ? 'group', FALSE) FROM users WHERE user_id = $1", user_id
+            )
+            if in_group is None:
+                return None
+            rows = await conn.fetch('''
+                SELECT 0 AS kind, e.ordinality - 1 AS index, e.value AS item
+                FROM users u,
+                     jsonb_array_elements(
+                         CASE WHEN jsonb_typeof(u.schedule) = 'array' THEN u.schedule ELSE '[]' END
+                     ) WITH ORDINALITY e
+                WHERE u.user_id = $1
+                  AND lower(translate(concat_ws(' ', e.value ->> 'className', e.value ->> 'professor'),
+                                      'Ёё', 'Ее')) LIKE ALL($2::text[])
+                UNION ALL
+                SELECT 1, e.ordinality - 1, e.value
+                FROM users u,
+                     jsonb_array_elements(
+                         CASE WHEN jsonb_typeof(u.deadlines) = 'array' THEN u.deadlines ELSE '[]' END
+                     ) WITH ORDINALITY e
+                WHERE u.user_id = $1
+                  AND lower(translate(concat_ws(' ', e.value ->> 'name', e.value ->> 'description'),
+                                      'Ёё', 'Ее')) LIKE ALL($2::text[])
+                ORDER BY kind, index
+                LIMIT $3
+            ''', user_id, patterns, limit)
+            return [
+                (row['kind'], row['index'], _parse_json(row['item'], {})) for row in rows
+            ], in_group
+        
+        return await cls.read(query, user_id)
+    
+    # ==================== РАССЫЛКИ ====================
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def create_broadcast(cls, admin_id: int, text: str) -> Optional[Dict[str, Any]]:
+        """Создает рассылку (сразу в статусе running)"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                row = await conn.fetchrow('''
+                    INSERT INTO broadcasts (admin_id, text) VALUES ($1, $2)
+                    RETURNING *
+                ''', admin_id, text)
+                return dict(row)
+            except Exception as e:
+                print(f"❌ Ошибка создания рассылки: {e}")
+                return None
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def claim_stale_broadcast(cls, lease_seconds: int) -> Optional[Dict[str, Any]]:
+        """
+        Забирает незавершенную рассылку, прогресс которой не обновлялся
+        дольше lease_seconds (процесс, который ее вел, остановился).
+        """
         pool = await cls.get_pool()
         async with pool.acquire() as conn:
             row = await conn.fetchrow('''
-                SELECT state FROM users WHERE user_id = $1
-            ''', user_id)
-            
-            if row and row['state']:
-                if isinstance(row['state'], str):
-                    try:
-                        return json.loads(row['state'])
-                    except:
-                        return {}
-                return row['state']
-            
-            return {}
\ No newline at end of file
+                UPDATE broadcasts SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM broadcasts
+                    WHERE status = 'running'
+                      AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+                    ORDER BY id
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+            ''', float(lease_seconds))
+            return dict(row) if row else None
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def save_broadcast_progress(
+        cls,
+        broadcast_id: int,
+        last_user_id: int,
+        sent: int,
+        failed: int,
+        blocked: int,
+        status: str = 'running'
+    ) -> bool:
+        """Контрольная точка рассылки: до какого user_id дошли и счетчики"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                await conn.execute('''
+                    UPDATE broadcasts
+                    SET last_user_id = $2, sent = $3, failed = $4, blocked = $5,
+                        status = $6, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = $1
+                ''', broadcast_id, last_user_id, sent, failed, blocked, status)
+                return True
+            except Exception as e:
+                print(f"❌ Ошибка сохранения прогресса рассылки: {e}")
+                return False
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def get_running_broadcasts(cls) -> List[Dict[str, Any]]:
+        """Незавершенные рассылки"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id
+            ''')
+            return [dict(row) for row in rows]
+    
+    @classmethod
+    async def iter_broadcast_recipients(
+        cls,
+        after_user_id: int = 0,
+        batch_size: int = 500,
+        segment_size: int = 5000
+    ):
+        """
+        Курсором перебирает получателей рассылки по возрастанию user_id.
+        Читает отрезками по segment_size, чтобы транзакция с курсором
+        не держалась открытой всю рассылку.
+        """
+        while True:
+            count = 0
+            async with cls.read_connection() as conn:
+                async with conn.transaction():
+                    async for row in conn.cursor('''
+                        SELECT user_id FROM users
+                        WHERE user_id > $1 AND blocked_at IS NULL
+                        ORDER BY user_id
+                        LIMIT $2
+                    ''', after_user_id, segment_size, prefetch=batch_size):
+                        after_user_id = row['user_id']
+                        count += 1
+                        yield after_user_id
+            if count < segment_size:
+                return
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def mark_users_blocked(cls, user_ids: List[int]) -> bool:
+        """Помечает пользователей, заблокировавших бота"""
+        if not user_ids:
+            return True
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                await conn.execute('''
+                    UPDATE users SET blocked_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ANY($1::bigint[]) AND blocked_at IS NULL
+                ''', user_ids)
+                return True
+            except Exception as e:
+                print(f"❌ Ошибка пометки заблокировавших: {e}")
+                return False
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def mark_user_active(cls, user_id: int) -> bool:
+        """Снимает пометку блокировки (пользователь снова написал боту)"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                await conn.execute('''
+                    UPDATE users SET blocked_at = NULL
+                    WHERE user_id = $1 AND blocked_at IS NOT NULL
+                ''', user_id)
+                return True
+            except Exception:
+                return False
+    
+    # ==================== ГРУППЫ ====================
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def create_group(
+        cls,
+        owner_id: int,
+        invite_code: str,
+        timetable_hash: str,
+        schedule: List[Dict]
+    ) -> Optional[int]:
+        """Создает группу с расписанием старосты, возвращает id (None - код занят)"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                try:
+                    await conn.execute('''
+                        INSERT INTO timetables (hash, schedule) VALUES ($1, $2)
+                        ON CONFLICT (hash) DO NOTHING
+                    ''', timetable_hash, json.dumps(schedule, ensure_ascii=False))
+                    return await conn.fetchval('''
+                        INSERT INTO groups (invite_code, owner_id, timetable_hash)
+                        VALUES ($1, $2, $3)
+                        ON CONFLICT (invite_code) DO NOTHING
+                        RETURNING id
+                    ''', invite_code, owner_id, timetable_hash)
+                except Exception as e:
+                    print(f"❌ Ошибка создания группы: {e}")
+                    return None
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def publish_timetable(
+        cls,
+        group_id: int,
+        owner_id: int,
+        timetable_hash: str,
+        schedule: List[Dict]
+    ) -> bool:
+        """Переключает группу на новое расписание (старое удаляется, если больше не нужно)"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                try:
+                    await conn.execute('''
+                        INSERT INTO timetables (hash, schedule) VALUES ($1, $2)
+                        ON CONFLICT (hash) DO NOTHING
+                    ''', timetable_hash, json.dumps(schedule, ensure_ascii=False))
+                    old_hash = await conn.fetchval('''
+                        SELECT timetable_hash FROM groups
+                        WHERE id = $1 AND owner_id = $2
+                        FOR UPDATE
+                    ''', group_id, owner_id)
+                    if old_hash is None:
+                        return False
+                    if old_hash == timetable_hash:
+                        return True
+                    await conn.execute('''
+                        UPDATE groups
+                        SET timetable_hash = $2, updated_at = CURRENT_TIMESTAMP
+                        WHERE id = $1
+                    ''', group_id, timetable_hash)
+                    await conn.execute('''
+                        DELETE FROM timetables
+                        WHERE hash = $1
+                          AND NOT EXISTS (SELECT 1 FROM groups WHERE timetable_hash = $1)
+                    ''', old_hash)
+                    return True
+                except Exception as e:
+                    print(f"❌ Ошибка публикации расписания группы: {e}")
+                    return False
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def get_group_by_code(cls, invite_code: str) -> Optional[Dict[str, Any]]:
+        """Группа по коду приглашения"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT id, invite_code, owner_id, timetable_hash
+                FROM groups WHERE invite_code = $1
+            ''', invite_code)
+            return dict(row) if row else None
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def get_group_timetable(
+        cls,
+        group_id: int,
+        known_hash: Optional[str] = None
+    ) -> Optional[Tuple[str, Optional[List[Dict]]]]:
+        """
+        Хэш текущего расписания группы и само расписание.
+        Если хэш совпал с known_hash, расписание не передается (None).
+        """
+        async def query(conn: asyncpg.Connection):
+            row = await conn.fetchrow('''
+                SELECT g.timetable_hash,
+                       CASE WHEN g.timetable_hash = $2 THEN NULL ELSE t.schedule END AS schedule
+                FROM groups g
+                JOIN timetables t ON t.hash = g.timetable_hash
+                WHERE g.id = $1
+            ''', group_id, known_hash)
+            if row is None:
+                return None
+            schedule = row['schedule']
+            return row['timetable_hash'], None if schedule is None else _parse_json(schedule, [])
+        
+        return await cls.read(query)
+    
+    # ==================== ХРАНЕНИЕ И АРХИВ ====================
+    
+    @classmethod
+    async def archive_expired_deadlines(
+        cls,
+        before: str,
+        after_user_id: int = 0,
+        batch_size: int = 500
+    ) -> Tuple[List[int], int, Optional[int]]:
+        """
+        Переносит в deadlines_archive дедлайны с датой раньше before
+        ("ГГГГ-ММ-ДД ЧЧ:ММ") у следующей порции пользователей после after_user_id.
+        У измененных пользователей обновляется updated_at (ETag календаря).
+        Возвращает (user_id с изменениями, число перенесенных дедлайнов,
+        последний просмотренный user_id или None, если пользователи кончились).
+        """
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                # Блокируем порцию, чтобы не затереть дедлайн, добавленный параллельно
+                locked = await conn.fetch('''
+                    SELECT user_id FROM users
+                    WHERE user_id > $1 AND deadlines <> '[]'::jsonb
+                    ORDER BY user_id
+                    LIMIT $2
+                    FOR UPDATE
+                ''', after_user_id, batch_size)
+                if not locked:
+                    return [], 0, None
+                last_user_id = locked[-1]['user_id']
+                
+                rows = await conn.fetch('''
+                    WITH items AS (
+                        SELECT u.user_id, d.item, d.position,
+                               (d.item ->> 'datetime') ~ '^\\d{4}-\\d{2}-\\d{2} \\d{2}:\\d{2}$'
+                               AND (d.item ->> 'datetime') < $3 AS expired
+                        FROM users u
+                        CROSS JOIN LATERAL jsonb_array_elements(u.deadlines)
+                            WITH ORDINALITY AS d(item, position)
+                        WHERE u.user_id > $1 AND u.user_id <= $2
+                          AND jsonb_typeof(u.deadlines) = 'array'
+                    ),
+                    changed AS (
+                        SELECT user_id,
+                               COALESCE(
+                                   jsonb_agg(item ORDER BY position) FILTER (WHERE NOT expired),
+                                   '[]'::jsonb
+                               ) AS kept
+                        FROM items
+                        GROUP BY user_id
+                        HAVING bool_or(expired)
+                    ),
+                    archived AS (
+                        INSERT INTO deadlines_archive (user_id, deadline)
+                        SELECT user_id, item FROM items WHERE expired
+                        RETURNING 1
+                    )
+                    UPDATE users u SET deadlines = c.kept, updated_at = CURRENT_TIMESTAMP
+                    FROM changed c
+                    WHERE u.user_id = c.user_id
+                    RETURNING u.user_id, (SELECT COUNT(*) FROM archived) AS archived
+                ''', after_user_id, last_user_id, before)
+        
+        user_ids = [row['user_id'] for row in rows]
+        cls.mark_written(*user_ids)
+        archived = rows[0]['archived'] if rows else 0
+        return user_ids, archived, last_user_id
+    
+    @classmethod
+    async def archive_idle_users(cls, idle_before: datetime, batch_size: int = 500) -> List[int]:
+        """
+        Переносит в users_archive порцию пользователей без изменений с idle_before,
+        которым нечего напоминать (пустые расписание и дедлайны) или которые
+        заблокировали бота. Возвращает их user_id. При возвращении из архива
+        строка создается заново с новым updated_at.
+        """
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch('''
+                    WITH moved AS (
+                        DELETE FROM users
+                        WHERE user_id IN (
+                            SELECT user_id FROM users
+                            WHERE updated_at < $1
+                              AND (blocked_at IS NOT NULL
+                                   OR (schedule = '[]'::jsonb AND deadlines = '[]'::jsonb
+                                       AND NOT state ? 'group'))
+                            ORDER BY updated_at
+                            LIMIT $2
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING user_id, schedule, deadlines, state,
+                                  created_at, updated_at, blocked_at
+                    ),
+                    archived AS (
+                        INSERT INTO users_archive (
+                            user_id, schedule, deadlines, state,
+                            created_at, updated_at, blocked_at
+                        )
+                        SELECT * FROM moved
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET schedule = EXCLUDED.schedule,
+                            deadlines = EXCLUDED.deadlines,
+                            state = EXCLUDED.state,
+                            updated_at = EXCLUDED.updated_at,
+                            blocked_at = EXCLUDED.blocked_at,
+                            archived_at = CURRENT_TIMESTAMP
+                        RETURNING user_id
+                    )
+                    SELECT user_id FROM archived
+                ''', idle_before, batch_size)
+        
+        user_ids = [row['user_id'] for row in rows]
+        # Реплика еще может отдавать удаленную строку
+        cls.mark_written(*user_ids)
+        return user_ids
+    
+    @classmethod
+    async def prune_applied_writes(cls, applied_before: datetime) -> int:
+        """
+        Удаляет id записей журнала, примененных до applied_before: журнал
+        очищается сразу после воспроизведения, и старые id уже не повторятся
+        """
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                'DELETE FROM applied_writes WHERE applied_at < $1', applied_before
+            )
+        return int(result.split()[-1])
+    
+    # ==================== СТАТИСТИКА ====================
+    
+    @classmethod
+    @guarded(WRITE_TIMEOUT)
+    async def save_stats_rollups(cls, rows: List[Tuple]) -> bool:
+        """
+        Записывает счетчики процесса по часам: (hour, instance, updates, users,
+        schedule_added, deadlines_added, reminders_sent, latency). Значения
+        абсолютные - строка просто перезаписывается.
+        """
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            try:
+                await conn.executemany('''
+                    INSERT INTO stats_hourly (
+                        hour, instance, updates, users, schedule_added,
+                        deadlines_added, reminders_sent, latency
+                    )
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8::jsonb)
+                    ON CONFLICT (hour, instance) DO UPDATE
+                    SET updates = EXCLUDED.updates,
+                        users = EXCLUDED.users,
+                        schedule_added = EXCLUDED.schedule_added,
+                        deadlines_added = EXCLUDED.deadlines_added,
+                        reminders_sent = EXCLUDED.reminders_sent,
+                        latency = EXCLUDED.latency
+                ''', [row[:-1] + (json.dumps(row[-1], ensure_ascii=False),) for row in rows])
+                return True
+            except Exception as e:
+                print(f"❌ Ошибка сохранения статистики: {e}")
+                return False
+    
+    @classmethod
+    @guarded(READ_TIMEOUT)
+    async def load_stats(cls, since: datetime) -> List[Dict[str, Any]]:
+        """Строки stats_hourly всех процессов начиная с часа since"""
+        rows = await cls.read(lambda conn: conn.fetch('''
+            SELECT * FROM stats_hourly WHERE hour >= $1 ORDER BY hour
+        ''', since))
+        return [
+            dict(row, latency=_parse_json(row['latency'], {})) for row in rows
+        ]
@@ -0,0 +1,67 @@
+"""
+Отбрасывание повторно доставленных обновлений Telegram
+
+Telegram присылает обновление заново, если вебхук ответил ошибкой или
+слишком долго отвечал. Последние update_id хранятся в кольцевом буфере
+(порядок поступления) и множестве (быстрая проверка); записи старше окна
+или сверх лимита вытесняются с начала буфера.
+"""
+import time
+import logging
+from collections import deque
+from typing import Deque, Set, Tuple
+
+from cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+# Сколько помним update_id (Telegram повторяет доставку до суток)
+DEDUP_WINDOW = 24 * 3600
+DEDUP_MAX_SIZE = 100_000
+
+
+class UpdateDeduplicator:
+    """Ограниченное по времени и размеру множество обработанных update_id"""
+
+    def __init__(self, window: float = DEDUP_WINDOW, max_size: int = DEDUP_MAX_SIZE):
+        self._window = window
+        self._max_size = max_size
+        self._order: Deque[Tuple[float, int]] = deque()
+        self._seen: Set[int] = set()
+        self.accepted = 0
+        self.duplicates = 0
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def _evict(self, now: float):
+        order, seen = self._order, self._seen
+        cutoff = now - self._window
+        while order and (order[0][0] < cutoff or len(order) > self._max_size):
+            _, update_id = order.popleft()
+            seen.discard(update_id)
+
+    def check_local(self, update_id: int) -> bool:
+        """True, если update_id встречается впервые (и запоминает его)"""
+        now = time.monotonic()
+        self._evict(now)
+        if update_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(update_id)
+        self._order.append((now, update_id))
+        self.accepted += 1
+        return True
+
+    async def check(self, update_id: int) -> bool:
+        """Как check_local, но при нескольких репликах повтор ловится и на другой"""
+        if not self.check_local(update_id):
+            return False
+        if not await shared_cache.claim(f"update:{update_id}", ttl=DEDUP_WINDOW):
+            self.duplicates += 1
+            return False
+        return True
+
+
+# Глобальный фильтр повторов
+update_deduplicator = UpdateDeduplicator()
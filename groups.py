@@ -0,0 +1,171 @@
+"""
+Общие расписания учебных групп
+
+Староста создает группу (/group create) из своего расписания и раздает
+код приглашения. Расписание группы хранится в БД один раз (таблица
+timetables, ключ - хэш содержимого), у участника в state['group'] лежит
+только ссылка на группу, а в его schedule - личные пары. Личная пара в
+тот же день и время заменяет пару группы.
+
+Источник расписания группы - schedule старосты: любое его изменение
+(добавление, импорт, правка из списка) публикуется как новая версия
+расписания группы, и все участники сразу видят ее. В памяти процесса
+расписание группы тоже хранится один раз на все участников.
+"""
+import json
+import time
+import hashlib
+import secrets
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from database import Database, DatabaseUnavailable
+
+logger = logging.getLogger(__name__)
+
+GROUP_KEY = 'group'
+INVITE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+INVITE_LENGTH = 8
+# Как долго доверять закэшированному хэшу расписания группы (секунды)
+GROUP_TTL = 60
+# Сколько разных расписаний держать в памяти
+MAX_TIMETABLES = 1024
+
+
+def timetable_hash(schedule: List[Dict]) -> str:
+    """Адрес расписания - SHA-256 его содержимого"""
+    payload = json.dumps(schedule, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def new_invite_code() -> str:
+    return ''.join(secrets.choice(INVITE_ALPHABET) for _ in range(INVITE_LENGTH))
+
+
+def user_group(state: Dict) -> Optional[Dict[str, Any]]:
+    """Ссылка на группу из state: {'id', 'code', 'owner_id'} или None"""
+    group = state.get(GROUP_KEY) if isinstance(state, dict) else None
+    if isinstance(group, dict) and isinstance(group.get('id'), int):
+        return group
+    return None
+
+
+def is_member(user_id: int, state: Dict) -> bool:
+    """Участник группы, но не староста"""
+    group = user_group(state)
+    return group is not None and group.get('owner_id') != user_id
+
+
+def slot(item: Dict) -> Tuple[Any, Any]:
+    """Место пары в неделе: личная пара в этом месте заменяет пару группы"""
+    return item.get('day'), item.get('time')
+
+
+def merge_schedule(personal: List, timetable: List) -> List:
+    """Личные пары, затем пары группы, не замененные личными"""
+    taken = {slot(item) for item in personal if isinstance(item, dict)}
+    return list(personal) + [
+        item for item in timetable
+        if isinstance(item, dict) and slot(item) not in taken
+    ]
+
+
+class GroupTimetables:
+    """Кэш расписаний групп и публикация изменений старосты"""
+
+    def __init__(self):
+        # group_id -> (хэш текущего расписания, когда проверен)
+        self._groups: Dict[int, Tuple[str, float]] = {}
+        # хэш -> расписание (одно на всех участников)
+        self._timetables: "OrderedDict[str, List[Dict]]" = OrderedDict()
+        self._publishing: Dict[int, asyncio.Task] = {}
+
+    def _remember(self, group_id: int, hash_: str, schedule: List[Dict]):
+        self._groups[group_id] = (hash_, time.monotonic())
+        # Одинаковые расписания разных групп - один объект
+        self._timetables[hash_] = self._timetables.get(hash_, schedule)
+        self._timetables.move_to_end(hash_)
+        while len(self._timetables) > MAX_TIMETABLES:
+            self._timetables.popitem(last=False)
+
+    async def timetable(self, group_id: int) -> List[Dict]:
+        """Текущее расписание группы (пустое, если группы нет)"""
+        cached = self._groups.get(group_id)
+        if cached is not None:
+            hash_, checked = cached
+            if time.monotonic() - checked < GROUP_TTL and hash_ in self._timetables:
+                self._timetables.move_to_end(hash_)
+                return self._timetables[hash_]
+
+        known = cached[0] if cached else None
+        known_schedule = self._timetables.get(known) if known else None
+        result = await Database.get_group_timetable(
+            group_id, known if known_schedule is not None else None
+        )
+        if result is None:
+            return []
+        hash_, schedule = result
+        if schedule is None:
+            # Расписание не менялось - БД его не передавала
+            schedule = known_schedule
+        self._remember(group_id, hash_, schedule)
+        return schedule
+
+    def cached_timetable(self, group_id: int) -> Optional[List[Dict]]:
+        """Расписание группы из памяти, без обращения к БД"""
+        cached = self._groups.get(group_id)
+        if cached is None:
+            return None
+        return self._timetables.get(cached[0])
+
+    async def effective_schedule(self, user_id: int, data: Dict[str, Any]) -> List:
+        """Расписание, которое видит пользователь: личное + группы"""
+        personal = data.get('schedule') or []
+        group = user_group(data.get('state'))
+        if group is None or group.get('owner_id') == user_id:
+            return personal
+        try:
+            timetable = await self.timetable(group['id'])
+        except DatabaseUnavailable:
+            # БД недоступна: последняя известная версия лучше, чем ничего
+            timetable = self.cached_timetable(group['id'])
+            if timetable is None:
+                return personal
+        return merge_schedule(personal, timetable)
+
+    def on_user_change(self, user_id: int, data: Dict[str, Any]):
+        """Подписчик хранилища: изменилось расписание старосты - публикуем его"""
+        group = user_group(data.get('state'))
+        if group is None or group.get('owner_id') != user_id:
+            return
+        schedule = list(data.get('schedule') or [])
+        hash_ = timetable_hash(schedule)
+        cached = self._groups.get(group['id'])
+        if cached is not None and cached[0] == hash_:
+            return
+        # Новое расписание видно участникам этого процесса сразу
+        self._remember(group['id'], hash_, schedule)
+        previous = self._publishing.get(group['id'])
+        if previous is not None and not previous.done():
+            previous.cancel()
+        self._publishing[group['id']] = asyncio.get_running_loop().create_task(
+            self._publish(group['id'], user_id, hash_, schedule)
+        )
+
+    async def _publish(self, group_id: int, owner_id: int, hash_: str, schedule: List[Dict]):
+        try:
+            if await Database.publish_timetable(group_id, owner_id, hash_, schedule):
+                logger.info(f"👥 Расписание группы {group_id} обновлено ({len(schedule)} пар)")
+        except DatabaseUnavailable as e:
+            # Опубликуется при следующем изменении или перечитывании данных старосты
+            self._groups.pop(group_id, None)
+            logger.warning(f"⚠️ Расписание группы {group_id} не опубликовано: {e}")
+        finally:
+            if self._publishing.get(group_id) is asyncio.current_task():
+                del self._publishing[group_id]
+
+
+# Глобальный кэш расписаний групп
+group_timetables = GroupTimetables()
@@ -1,12 +1,15 @@
 """
 Все обработчики команд бота
 """
+import os
+import asyncio
 import logging
-import re
-from datetime import datetime
-from typing import Dict, List
+import tempfile
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
 
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     ContextTypes,
     ConversationHandler,
@@ -20,12 +23,35 @@ from keyboards import (
     get_main_keyboard, 
     get_weekday_keyboard,
     get_cancel_keyboard,
-    WEEKDAYS
+    get_edit_deadline_keyboard,
+    WEEKDAYS,
+    BTN_CANCEL
 )
 from storage import user_storage
+from parsers import parse_schedule_text
+from validators import parse_time_range, parse_deadline, parse_date
+from callback_data import (
+    decode_callback, KIND_FIELDS, KIND_SCHEDULE, KIND_DEADLINES,
+    ACTION_PAGE, ACTION_EDIT, ACTION_DELETE, ACTION_FIELD, DEADLINE_FIELDS,
+    FIELD_NAME, FIELD_DATETIME, FIELD_DESCRIPTION, FIELD_REMINDER
+)
+from views import render_page, render_search_results, data_version, PARSE_MODE
+from search import find_items, MAX_RESULTS
+from groups import (
+    group_timetables, user_group, timetable_hash, new_invite_code, GROUP_KEY
+)
+from importers import SUPPORTED_EXTENSIONS, entry_key, load_schedule_file
+from calendar_feed import feed_url
+from reminders import DEFAULT_TIMEZONE, get_timezone, user_timezone
+from broadcast import is_admin, run_broadcast
+from stats import format_stats, summarize, usage_stats
+from database import Database, DatabaseUnavailable
 
 logger = logging.getLogger(__name__)
 
+# Максимальный размер импортируемого файла
+MAX_IMPORT_SIZE = 5 * 1024 * 1024
+
 # Состояния для ConversationHandler
 (
     ADD_SCHEDULE_DAY,
@@ -36,8 +62,17 @@ logger = logging.getLogger(__name__)
     ADD_DEADLINE_NAME,
     ADD_DEADLINE_DATE,
     ADD_DEADLINE_DESC,
-    ADD_DEADLINE_REMINDER
-) = range(9)
+    ADD_DEADLINE_REMINDER,
+    EDIT_ITEM_VALUE
+) = range(10)
+
+# Подсказки при правке поля дедлайна
+EDIT_FIELD_PROMPTS = {
+    FIELD_NAME: "📝 Введите новое название:",
+    FIELD_DATETIME: "📅 Введите новую дату: ГГГГ-ММ-ДД ЧЧ:ММ",
+    FIELD_DESCRIPTION: "📄 Введите новое описание (или '-' чтобы очистить):",
+    FIELD_REMINDER: "⏰ За сколько минут напомнить?",
+}
 
 # ==================== УПРОЩЕННЫЕ ОБРАБОТЧИКИ ====================
 
@@ -47,6 +82,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Создаем пользователя если нет
     await user_storage.update_user_data(user_id)
+    # Пользователь мог разблокировать бота - снова включаем его в рассылки
+    await Database.mark_user_active(user_id)
     
     await update.message.reply_text(
         "👋 Привет! Я бот-напоминалка для студентов.\n"
@@ -70,11 +107,26 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 /start - Перезапустить бота
 /help - Показать это сообщение
 /reset - Сбросить все данные
+/calendar - Ссылка на расписание для календаря
+/timezone - Часовой пояс для напоминаний
+/holiday - Дни без занятий (праздники)
+/semester - Начало семестра (для четных/нечетных недель)
+/group - Общее расписание группы (староста и код приглашения)
+/find - Поиск по расписанию и дедлайнам
 
 **Форматы данных:**
 - День недели: понедельник, вторник и т.д.
 - Время пары: 14:30-16:00
 - Дата и время дедлайна: 2024-12-31 23:59
+
+**Быстрое добавление пар:**
+/add пн 14:30-16:00 Матан Иванов 15
+Можно несколько строк сразу, по одной паре на строку.
+Пара через неделю: /add пн 14:30-16:00 Матан (нечет)
+
+**Импорт из файла:**
+Отправьте файл .csv (день, время, предмет, преподаватель, напоминание)
+или .ics из календаря.
 """
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
@@ -97,7 +149,9 @@ async def start_add_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['schedule_data'] = {}
     
     await update.message.reply_text(
-        "📅 Выберите день недели для пары:",
+        "📅 Выберите день недели для пары.\n\n"
+        "Или отправьте пары одним сообщением, по одной на строку:\n"
+        "пн 14:30-16:00 Матан Иванов 15",
         reply_markup=get_weekday_keyboard()
     )
     return ADD_SCHEDULE_DAY
@@ -133,10 +187,11 @@ async def add_schedule_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Ввод времени пары"""
     time_input = update.message.text.strip()
     
-    # Проверяем формат
-    if not re.match(r'^\d{2}:\d{2}-\d{2}:\d{2}$', time_input):
+    # Проверяем формат и диапазоны
+    time_range, error = parse_time_range(time_input)
+    if error:
         await update.message.reply_text(
-            "❌ Неверный формат времени.\n"
+            f"❌ Неверное время: {error}.\n"
             "Используйте: **ЧЧ:ММ-ЧЧ:ММ**\n"
             "Пример: *09:00-10:30*",
             parse_mode='Markdown',
@@ -144,7 +199,7 @@ async def add_schedule_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return ADD_SCHEDULE_TIME
     
-    context.user_data['schedule_data']['time'] = time_input
+    context.user_data['schedule_data']['time'] = str(time_range)
     
     await update.message.reply_text(
         "📚 Введите название предмета:",
@@ -191,10 +246,11 @@ async def add_schedule_reminder(update: Update, context: ContextTypes.DEFAULT_TY
         schedule.append(context.user_data['schedule_data'])
         
         # Сохраняем
-        await user_storage.update_user_data(
+        if await user_storage.update_user_data(
             user_id,
             schedule=schedule
-        )
+        ):
+            usage_stats.entries_added(schedule=1)
         
         # Очищаем временные данные
         context.user_data.pop('schedule_data', None)
@@ -213,6 +269,126 @@ async def add_schedule_reminder(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return ADD_SCHEDULE_REMINDER
 
+# ==================== БЫСТРОЕ ДОБАВЛЕНИЕ РАСПИСАНИЯ ====================
+
+async def save_quick_schedule(update: Update, text: str) -> bool:
+    """Разбирает пары из текста и сохраняет их одной записью"""
+    user_id = update.effective_user.id
+    entries, errors = parse_schedule_text(text)
+    
+    message = ""
+    saved = False
+    if entries:
+        # Дописываем к расписанию в БД, а не перезаписываем копию из кэша
+        saved = await user_storage.append_schedule(user_id, entries)
+        if saved:
+            usage_stats.entries_added(schedule=len(entries))
+            message += f"✅ Добавлено пар: {len(entries)}\n"
+        else:
+            message += "❌ Не удалось сохранить расписание. Попробуйте еще раз.\n"
+    
+    if errors:
+        message += "\n❌ Не удалось разобрать:\n"
+        message += "\n".join(f"Строка {line_no}: {error}" for line_no, error in errors)
+        message += "\n\nФормат: пн 14:30-16:00 Предмет Преподаватель 15"
+    
+    if not message:
+        message = "❌ Сообщение пустое."
+    
+    await update.message.reply_text(
+        message,
+        reply_markup=get_main_keyboard() if saved else get_cancel_keyboard()
+    )
+    return saved
+
+async def add_schedule_quick(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Пары, введенные текстом вместо выбора дня"""
+    if await save_quick_schedule(update, update.message.text):
+        context.user_data.pop('schedule_data', None)
+        return ConversationHandler.END
+    return ADD_SCHEDULE_DAY
+
+async def add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /add - добавление пар одним сообщением"""
+    # Берем текст после команды, сохраняя переносы строк
+    parts = update.message.text.split(maxsplit=1)
+    text = parts[1] if len(parts) > 1 else ""
+    
+    if not text.strip():
+        await update.message.reply_text(
+            "Использование: /add пн 14:30-16:00 Матан Иванов 15\n"
+            "Можно несколько строк сразу.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    await save_quick_schedule(update, text)
+
+# ==================== ИМПОРТ РАСПИСАНИЯ ИЗ ФАЙЛА ====================
+
+async def import_schedule_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Импорт пар из присланного файла .csv или .ics"""
+    user_id = update.effective_user.id
+    document = update.message.document
+    file_name = document.file_name or ''
+    
+    if not file_name.lower().endswith(SUPPORTED_EXTENSIONS):
+        await update.message.reply_text(
+            "❌ Поддерживаются только файлы .csv и .ics",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    if document.file_size and document.file_size > MAX_IMPORT_SIZE:
+        await update.message.reply_text(
+            f"❌ Файл слишком большой (максимум {MAX_IMPORT_SIZE // (1024 * 1024)} МБ).",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    # Время из .ics в UTC или с TZID переводится в пояс пользователя
+    user_data = await user_storage.get_user_data(user_id)
+    tz = user_timezone(user_data['state'])
+    
+    # Качаем на диск и разбираем построчно в отдельном потоке
+    telegram_file = await document.get_file()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'import')
+        await telegram_file.download_to_drive(path)
+        try:
+            entries, errors = await asyncio.get_running_loop().run_in_executor(
+                None, load_schedule_file, path, file_name, tz
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"❌ Ошибка чтения файла импорта от user {user_id}: {e}")
+            await update.message.reply_text(
+                "❌ Не удалось прочитать файл.",
+                reply_markup=get_main_keyboard()
+            )
+            return
+    
+    # Пропускаем пары, которые уже есть в расписании
+    existing = {entry_key(item) for item in user_data['schedule'] if isinstance(item, dict)}
+    new_entries = [entry for entry in entries if entry_key(entry) not in existing]
+    
+    if new_entries and not await user_storage.append_schedule(user_id, new_entries):
+        await update.message.reply_text(
+            "❌ Не удалось сохранить расписание. Попробуйте еще раз.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    usage_stats.entries_added(schedule=len(new_entries))
+    
+    message = f"✅ Импортировано пар: {len(new_entries)}"
+    skipped = len(entries) - len(new_entries)
+    if skipped:
+        message += f"\n↩️ Уже были в расписании: {skipped}"
+    if errors:
+        message += "\n\n❌ Пропущены записи:\n"
+        message += "\n".join(f"Строка {line_no}: {error}" for line_no, error in errors)
+    
+    await update.message.reply_text(message, reply_markup=get_main_keyboard())
+
 # ==================== ДОБАВЛЕНИЕ ДЕДЛАЙНА ====================
 
 async def start_add_deadline(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -243,19 +419,8 @@ async def add_deadline_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Ввод даты дедлайна"""
     date_input = update.message.text.strip()
     
-    try:
-        # Проверяем формат
-        datetime.strptime(date_input, "%Y-%m-%d %H:%M")
-        context.user_data['deadline_data']['datetime'] = date_input
-        
-        await update.message.reply_text(
-            "📄 Введите описание дедлайна (необязательно):\n"
-            "Или отправьте '-' чтобы пропустить",
-            reply_markup=get_cancel_keyboard()
-        )
-        return ADD_DEADLINE_DESC
-        
-    except ValueError:
+    # Проверяем формат
+    if parse_deadline(date_input) is None:
         await update.message.reply_text(
             "❌ Неверный формат даты.\n"
             "Используйте: **ГГГГ-ММ-ДД ЧЧ:ММ**\n"
@@ -264,6 +429,15 @@ async def add_deadline_date(update: Update, context: ContextTypes.DEFAULT_TYPE)
             reply_markup=get_cancel_keyboard()
         )
         return ADD_DEADLINE_DATE
+    
+    context.user_data['deadline_data']['datetime'] = date_input
+    
+    await update.message.reply_text(
+        "📄 Введите описание дедлайна (необязательно):\n"
+        "Или отправьте '-' чтобы пропустить",
+        reply_markup=get_cancel_keyboard()
+    )
+    return ADD_DEADLINE_DESC
 
 async def add_deadline_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Ввод описания дедлайна"""
@@ -296,10 +470,11 @@ async def add_deadline_reminder(update: Update, context: ContextTypes.DEFAULT_TY
         deadlines.append(context.user_data['deadline_data'])
         
         # Сохраняем
-        await user_storage.update_user_data(
+        if await user_storage.update_user_data(
             user_id,
             deadlines=deadlines
-        )
+        ):
+            usage_stats.entries_added(deadlines=1)
         
         # Очищаем временные данные
         context.user_data.pop('deadline_data', None)
@@ -320,108 +495,497 @@ async def add_deadline_reminder(update: Update, context: ContextTypes.DEFAULT_TY
 
 # ==================== ПОКАЗ РАСПИСАНИЯ ====================
 
+async def _list_items(user_id: int, user_data: Dict, kind: int) -> Tuple[List, int]:
+    """
+    Записи списка и сколько первых из них свои (их можно править).
+    В расписании участника группы за личными парами идут пары группы.
+    """
+    items = user_data[KIND_FIELDS[kind]]
+    if kind == KIND_SCHEDULE:
+        return await group_timetables.effective_schedule(user_id, user_data), len(items)
+    return items, len(items)
+
+async def _show_list(update: Update, kind: int):
+    """Первая страница расписания или дедлайнов"""
+    user_id = update.effective_user.id
+    user_data = await user_storage.get_user_data(user_id)
+    items, editable = await _list_items(user_id, user_data, kind)
+    page = render_page(user_id, kind, items, editable=editable)
+    
+    if page.markup is None:
+        await update.message.reply_text(page.text, reply_markup=get_main_keyboard())
+        return
+    
+    await update.message.reply_text(
+        page.text,
+        parse_mode=PARSE_MODE,
+        reply_markup=page.markup
+    )
+
 async def show_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показ расписания пользователя"""
+    await _show_list(update, KIND_SCHEDULE)
+
+# ==================== ПОКАЗ ДЕДЛАЙНОВ ====================
+
+async def show_deadlines(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показ дедлайнов пользователя"""
+    await _show_list(update, KIND_DEADLINES)
+
+# ==================== ПОИСК ====================
+
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Поиск по расписанию и дедлайнам: /find запрос"""
+    query = " ".join(context.args or []).strip()
+    if not query:
+        await update.message.reply_text(
+            "🔍 Использование: /find запрос\n"
+            "Например: /find курсовая или /find Иванов",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    matches = await find_items(update.effective_user.id, query)
+    await update.message.reply_text(
+        render_search_results(query, matches, MAX_RESULTS),
+        parse_mode=PARSE_MODE,
+        reply_markup=get_main_keyboard()
+    )
+
+# ==================== РЕДАКТИРОВАНИЕ ИЗ СПИСКА ====================
+
+async def _refresh_page(bot, chat_id: int, message_id: int, user_id: int, kind: int, page: int):
+    """Перерисовывает одно сообщение со страницей списка"""
+    user_data = await user_storage.get_user_data(user_id)
+    items, editable = await _list_items(user_id, user_data, kind)
+    rendered = render_page(user_id, kind, items, page, editable)
+    try:
+        await bot.edit_message_text(
+            rendered.text,
+            chat_id=chat_id,
+            message_id=message_id,
+            parse_mode=PARSE_MODE,
+            reply_markup=rendered.markup
+        )
+    except BadRequest as e:
+        # "message is not modified" и удаленные сообщения - не ошибка
+        logger.debug(f"Страница списка user {user_id} не обновлена: {e}")
+
+async def item_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Кнопки под страницей списка: листание, правка и удаление записей"""
+    query = update.callback_query
+    callback = decode_callback(query.data)
+    if callback is None:
+        await query.answer("⚠️ Кнопка устарела, откройте список заново")
+        return ConversationHandler.END
+    
     user_id = update.effective_user.id
     user_data = await user_storage.get_user_data(user_id)
-    schedule = user_data['schedule']
+    items, editable = await _list_items(user_id, user_data, callback.kind)
+    message = query.message
     
-    if not schedule:
+    # Список изменился после отрисовки: номер записи мог указывать на другую
+    if callback.version != data_version(items):
+        await query.answer("⚠️ Список изменился, показываю актуальный")
+        await _refresh_page(context.bot, message.chat_id, message.message_id, user_id, callback.kind, callback.page)
+        return ConversationHandler.END
+    
+    if callback.action == ACTION_PAGE:
+        await query.answer()
+        await _refresh_page(context.bot, message.chat_id, message.message_id, user_id, callback.kind, callback.page)
+        return ConversationHandler.END
+    
+    if callback.index >= editable:
+        await query.answer("⚠️ Запись не найдена или принадлежит группе")
+        return ConversationHandler.END
+    
+    if callback.action == ACTION_DELETE:
+        own = user_data[KIND_FIELDS[callback.kind]]
+        own = own[:callback.index] + own[callback.index + 1:]
+        await user_storage.update_user_data(user_id, **{KIND_FIELDS[callback.kind]: own})
+        await query.answer("🗑️ Удалено")
+        await _refresh_page(context.bot, message.chat_id, message.message_id, user_id, callback.kind, callback.page)
+        return ConversationHandler.END
+    
+    if callback.action == ACTION_EDIT and callback.kind == KIND_DEADLINES:
+        # Сначала выбор поля дедлайна
+        await query.answer()
+        await query.edit_message_reply_markup(
+            get_edit_deadline_keyboard(callback.version, callback.page, callback.index)
+        )
+        return ConversationHandler.END
+    
+    if callback.action == ACTION_EDIT:
+        prompt = (
+            "✏️ Отправьте пару целиком, как в /add:\n"
+            "пн 14:30-16:00 Матан Иванов 15"
+        )
+    elif callback.action == ACTION_FIELD and callback.field in DEADLINE_FIELDS:
+        prompt = EDIT_FIELD_PROMPTS[callback.field]
+    else:
+        await query.answer()
+        return ConversationHandler.END
+    
+    context.user_data['edit_item'] = {
+        'kind': callback.kind,
+        'version': callback.version,
+        'page': callback.page,
+        'index': callback.index,
+        'field': callback.field,
+        'chat_id': message.chat_id,
+        'message_id': message.message_id,
+    }
+    await query.answer()
+    await context.bot.send_message(
+        chat_id=message.chat_id,
+        text=prompt,
+        reply_markup=get_cancel_keyboard()
+    )
+    return EDIT_ITEM_VALUE
+
+def _edited_item(edit: Dict, item: Dict, text: str):
+    """Запись с новым значением: (запись, None) или (None, ошибка)"""
+    if edit['kind'] == KIND_SCHEDULE:
+        entries, errors = parse_schedule_text(text)
+        if errors or len(entries) != 1:
+            return None, errors[0][1] if errors else "нужна ровно одна пара"
+        entry = entries[0]
+        if item.get('skip'):
+            entry['skip'] = item['skip']
+        return entry, None
+    
+    field = DEADLINE_FIELDS[edit['field']]
+    if field == 'name':
+        if not text:
+            return None, "название не может быть пустым"
+        value = text
+    elif field == 'datetime':
+        if parse_deadline(text) is None:
+            return None, "формат даты: ГГГГ-ММ-ДД ЧЧ:ММ"
+        value = text
+    elif field == 'description':
+        value = "" if text == '-' else text
+    else:
+        try:
+            value = int(text)
+        except ValueError:
+            return None, "введите целое число минут"
+    return {**item, field: value}, None
+
+async def edit_item_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Новое значение записи, выбранной в списке"""
+    edit = context.user_data.get('edit_item')
+    if not edit:
+        return ConversationHandler.END
+    
+    user_id = update.effective_user.id
+    user_data = await user_storage.get_user_data(user_id)
+    items, editable = await _list_items(user_id, user_data, edit['kind'])
+    if edit['version'] != data_version(items) or edit['index'] >= editable:
+        context.user_data.pop('edit_item', None)
+        await update.message.reply_text(
+            "⚠️ Список изменился, откройте его заново.",
+            reply_markup=get_main_keyboard()
+        )
+        return ConversationHandler.END
+    
+    item, error = _edited_item(edit, items[edit['index']], update.message.text.strip())
+    if error:
+        await update.message.reply_text(f"❌ {error}", reply_markup=get_cancel_keyboard())
+        return EDIT_ITEM_VALUE
+    
+    own = list(user_data[KIND_FIELDS[edit['kind']]])
+    own[edit['index']] = item
+    await user_storage.update_user_data(user_id, **{KIND_FIELDS[edit['kind']]: own})
+    context.user_data.pop('edit_item', None)
+    
+    await update.message.reply_text("✅ Изменено.", reply_markup=get_main_keyboard())
+    # Обновляем только сообщение со страницей, где была запись
+    await _refresh_page(context.bot, edit['chat_id'], edit['message_id'], user_id, edit['kind'], edit['page'])
+    return ConversationHandler.END
+
+# ==================== ЭКСПОРТ В КАЛЕНДАРЬ ====================
+
+async def calendar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /calendar - ссылка на подписку в календаре"""
+    user_id = update.effective_user.id
+    url = feed_url(user_id)
+    
+    if not url:
+        await update.message.reply_text(
+            "❌ Экспорт в календарь доступен только в режиме вебхука.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    await update.message.reply_text(
+        "📆 Ссылка для подписки в Google/Apple Календаре:\n"
+        f"{url}\n\n"
+        "Календарь обновляется автоматически. Не делитесь ссылкой с другими.",
+        reply_markup=get_main_keyboard(),
+        disable_web_page_preview=True
+    )
+
+# ==================== ЧАСОВОЙ ПОЯС ====================
+
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /timezone - часовой пояс для напоминаний"""
+    user_id = update.effective_user.id
+    
+    if not context.args:
+        current = await user_storage.get_user_state_value(user_id, 'tz', DEFAULT_TIMEZONE)
         await update.message.reply_text(
-            "📭 Ваше расписание пусто.",
+            f"🌍 Ваш часовой пояс: {current}\n\n"
+            "Чтобы изменить: /timezone Europe/Moscow\n"
+            "Примеры: Europe/Kaliningrad, Asia/Yekaterinburg, Asia/Novosibirsk",
             reply_markup=get_main_keyboard()
         )
         return
     
-    # Группируем по дням
-    schedule_by_day = {day: [] for day in WEEKDAYS}
-    for item in schedule:
-        if isinstance(item, dict) and 'day' in item:
-            day = item['day']
-            if day in schedule_by_day:
-                schedule_by_day[day].append(item)
-    
-    # Формируем сообщение
-    message = "📅 **Ваше расписание:**\n\n"
-    
-    for day in WEEKDAYS:
-        items = schedule_by_day[day]
-        if items:
-            # Сортируем по времени
-            items.sort(key=lambda x: x.get('time', ''))
-            
-            message += f"**{day.capitalize()}:**\n"
-            for i, item in enumerate(items, 1):
-                message += f"{i}. {item.get('className', 'Без названия')}"
-                if 'time' in item:
-                    message += f" ({item['time']})"
-                if 'professor' in item:
-                    message += f" - {item['professor']}"
-                message += "\n"
-            message += "\n"
+    name = context.args[0]
+    if get_timezone(name) is None:
+        await update.message.reply_text(
+            f"❌ Неизвестный часовой пояс: {name}\n"
+            "Используйте формат Регион/Город, например Europe/Moscow",
+            reply_markup=get_main_keyboard()
+        )
+        return
     
+    await user_storage.update_user_state(user_id, tz=name)
     await update.message.reply_text(
-        message,
-        parse_mode='Markdown',
+        f"✅ Часовой пояс установлен: {name}",
         reply_markup=get_main_keyboard()
     )
 
-# ==================== ПОКАЗ ДЕДЛАЙНОВ ====================
+# ==================== ИСКЛЮЧЕНИЯ ИЗ РАСПИСАНИЯ ====================
 
-async def show_deadlines(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показ дедлайнов пользователя"""
+async def holiday_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /holiday - добавить или убрать день без занятий"""
     user_id = update.effective_user.id
-    user_data = await user_storage.get_user_data(user_id)
-    deadlines = user_data['deadlines']
+    holidays = await user_storage.get_user_state_value(user_id, 'holidays', [])
+    
+    if not context.args:
+        listed = "\n".join(f"• {day}" for day in sorted(holidays)) or "нет"
+        await update.message.reply_text(
+            f"🏖 Дни без занятий:\n{listed}\n\n"
+            "Добавить или убрать день: /holiday 2024-11-04",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    day = parse_date(context.args[0])
+    if day is None:
+        await update.message.reply_text(
+            "❌ Неверная дата. Используйте формат ГГГГ-ММ-ДД",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    value = day.isoformat()
+    if value in holidays:
+        holidays = [item for item in holidays if item != value]
+        text = f"✅ {value} снова учебный день"
+    else:
+        holidays = sorted(holidays + [value])
+        text = f"✅ {value} - день без занятий, напоминаний о парах не будет"
+    
+    await user_storage.update_user_state(user_id, holidays=holidays)
+    await update.message.reply_text(text, reply_markup=get_main_keyboard())
+
+async def semester_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /semester - начало семестра для счета недель"""
+    user_id = update.effective_user.id
+    
+    if not context.args:
+        current = await user_storage.get_user_state_value(user_id, 'semester_start')
+        await update.message.reply_text(
+            f"📚 Начало семестра: {current or 'не задано (четность по номеру недели в году)'}\n\n"
+            "Первая неделя семестра считается нечетной (числитель).\n"
+            "Изменить: /semester 2024-09-02",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    day = parse_date(context.args[0])
+    if day is None:
+        await update.message.reply_text(
+            "❌ Неверная дата. Используйте формат ГГГГ-ММ-ДД",
+            reply_markup=get_main_keyboard()
+        )
+        return
     
-    if not deadlines:
+    await user_storage.update_user_state(user_id, semester_start=day.isoformat())
+    await update.message.reply_text(
+        f"✅ Начало семестра: {day.isoformat()}",
+        reply_markup=get_main_keyboard()
+    )
+
+# ==================== ГРУППЫ ====================
+
+GROUP_USAGE = (
+    "/group create - сделать ваше расписание расписанием группы (вы - староста)\n"
+    "/group join КОД - вступить в группу по коду приглашения\n"
+    "/group leave - выйти из группы (пары группы останутся у вас)"
+)
+
+async def _create_group(update: Update, user_id: int, user_data: Dict):
+    schedule = user_data['schedule']
+    if not schedule:
         await update.message.reply_text(
-            "📭 У вас нет дедлайнов.",
+            "❌ Сначала добавьте расписание - оно станет расписанием группы.",
             reply_markup=get_main_keyboard()
         )
         return
     
-    # Фильтруем валидные дедлайны
-    valid_deadlines = []
-    for item in deadlines:
-        if isinstance(item, dict) and 'datetime' in item:
-            try:
-                datetime.strptime(item['datetime'], "%Y-%m-%d %H:%M")
-                valid_deadlines.append(item)
-            except ValueError:
-                continue
-    
-    if not valid_deadlines:
+    # Код случайный: при совпадении с существующим пробуем другой
+    for _ in range(5):
+        code = new_invite_code()
+        group_id = await Database.create_group(user_id, code, timetable_hash(schedule), schedule)
+        if group_id is not None:
+            break
+    else:
         await update.message.reply_text(
-            "📭 У вас нет валидных дедлайнов.",
+            "❌ Не удалось создать группу, попробуйте еще раз.",
             reply_markup=get_main_keyboard()
         )
         return
     
-    # Сортируем по дате
-    valid_deadlines.sort(
-        key=lambda x: datetime.strptime(x['datetime'], "%Y-%m-%d %H:%M")
+    await user_storage.update_user_state(
+        user_id, **{GROUP_KEY: {'id': group_id, 'code': code, 'owner_id': user_id}}
+    )
+    await update.message.reply_text(
+        f"✅ Группа создана. Код приглашения: {code}\n\n"
+        f"Одногруппники вступают командой /group join {code}\n"
+        "Все изменения вашего расписания сразу видны всей группе.",
+        reply_markup=get_main_keyboard()
     )
+
+async def _join_group(update: Update, user_id: int, user_data: Dict, code: str):
+    group = await Database.get_group_by_code(code.upper())
+    if group is None:
+        await update.message.reply_text(
+            "❌ Группа с таким кодом не найдена.",
+            reply_markup=get_main_keyboard()
+        )
+        return
     
-    # Формируем сообщение
-    message = "📝 **Ваши дедлайны:**\n\n"
+    timetable = await group_timetables.timetable(group['id'])
+    # Свои копии пар группы больше не нужны - они придут из общего расписания
+    shared = {entry_key(item) for item in timetable if isinstance(item, dict)}
+    personal = [
+        item for item in user_data['schedule']
+        if not (isinstance(item, dict) and entry_key(item) in shared)
+    ]
+    reference = {'id': group['id'], 'code': group['invite_code'], 'owner_id': group['owner_id']}
+    await user_storage.update_user_data(
+        user_id,
+        schedule=personal,
+        state={**user_data['state'], GROUP_KEY: reference}
+    )
     
-    for i, item in enumerate(valid_deadlines, 1):
-        deadline_dt = datetime.strptime(item['datetime'], "%Y-%m-%d %H:%M")
-        formatted_date = deadline_dt.strftime('%d.%m.%Y %H:%M')
-        
-        message += f"{i}. **{item.get('name', 'Без названия')}**\n"
-        message += f"   📅 До: {formatted_date}\n"
-        if item.get('description'):
-            message += f"   📄 {item['description']}\n"
-        message += f"   ⏰ Напоминание за {item.get('reminderBefore', 0)} мин.\n\n"
+    text = f"✅ Вы в группе {group['invite_code']}: {len(timetable)} пар из общего расписания."
+    removed = len(user_data['schedule']) - len(personal)
+    if removed:
+        text += f"\nУдалено ваших копий этих пар: {removed}"
+    if personal:
+        text += "\nВаши пары в то же время, что и пары группы, заменяют их."
+    await update.message.reply_text(text, reply_markup=get_main_keyboard())
+
+async def _leave_group(update: Update, user_id: int, user_data: Dict, group: Dict):
+    if group.get('owner_id') == user_id:
+        await update.message.reply_text(
+            "❌ Староста не может выйти из группы: расписание группы - это ваше расписание.",
+            reply_markup=get_main_keyboard()
+        )
+        return
     
+    # Пары группы переходят в личное расписание
+    schedule = await group_timetables.effective_schedule(user_id, user_data)
+    state = {key: value for key, value in user_data['state'].items() if key != GROUP_KEY}
+    await user_storage.update_user_data(user_id, schedule=schedule, state=state)
     await update.message.reply_text(
-        message,
-        parse_mode='Markdown',
+        f"✅ Вы вышли из группы {group.get('code')}. Ее пары сохранены в вашем расписании.",
         reply_markup=get_main_keyboard()
     )
 
+async def group_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /group - общее расписание учебной группы"""
+    user_id = update.effective_user.id
+    user_data = await user_storage.get_user_data(user_id)
+    group = user_group(user_data['state'])
+    action = context.args[0].lower() if context.args else ''
+    
+    if action in ('create', 'join') and group is not None:
+        await update.message.reply_text(
+            f"❌ Вы уже в группе {group.get('code')}. Сначала /group leave",
+            reply_markup=get_main_keyboard()
+        )
+    elif action == 'create':
+        await _create_group(update, user_id, user_data)
+    elif action == 'join' and len(context.args) > 1:
+        await _join_group(update, user_id, user_data, context.args[1])
+    elif action == 'leave' and group is not None:
+        await _leave_group(update, user_id, user_data, group)
+    elif group is not None:
+        role = "вы староста" if group.get('owner_id') == user_id else "вы участник"
+        await update.message.reply_text(
+            f"👥 Группа {group.get('code')} ({role})\n\n{GROUP_USAGE}",
+            reply_markup=get_main_keyboard()
+        )
+    else:
+        await update.message.reply_text(
+            f"👥 Вы не состоите в группе.\n\n{GROUP_USAGE}",
+            reply_markup=get_main_keyboard()
+        )
+
+# ==================== РАССЫЛКА ====================
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /broadcast - сообщение всем пользователям (только для администраторов)"""
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        return
+    
+    # Текст после команды с сохранением переносов строк
+    parts = update.message.text.split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    
+    if not text:
+        running = await Database.get_running_broadcasts()
+        status = "\n".join(
+            f"#{item['id']}: доставлено {item['sent']}, заблокировали {item['blocked']}, "
+            f"ошибки {item['failed']} (user_id > {item['last_user_id']})"
+            for item in running
+        ) or "активных рассылок нет"
+        await update.message.reply_text(
+            f"📣 {status}\n\nЗапустить: /broadcast текст сообщения"
+        )
+        return
+    
+    broadcast = await Database.create_broadcast(user_id, text)
+    if broadcast is None:
+        await update.message.reply_text("❌ Не удалось создать рассылку")
+        return
+    
+    context.application.create_task(run_broadcast(context.bot, broadcast))
+    await update.message.reply_text(
+        f"🚀 Рассылка #{broadcast['id']} запущена. Отчет придет по завершении."
+    )
+
+# ==================== СТАТИСТИКА ====================
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /stats [дней] - статистика использования (только для администраторов)"""
+    if not is_admin(update.effective_user.id):
+        return
+    
+    days = int(context.args[0]) if context.args and context.args[0].isdigit() else 7
+    days = min(max(days, 1), 90)
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    rows = await Database.load_stats(today - timedelta(days=days - 1))
+    # Ограничение Telegram на длину сообщения
+    await update.message.reply_text(format_stats(summarize(rows))[:4096])
+
 # ==================== ОБЩИЕ ФУНКЦИИ ====================
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -429,6 +993,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Очищаем временные данные
     context.user_data.pop('schedule_data', None)
     context.user_data.pop('deadline_data', None)
+    context.user_data.pop('edit_item', None)
     
     await update.message.reply_text(
         "❌ Действие отменено.",
@@ -439,7 +1004,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def handle_cancel_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка нажатия кнопки отмены"""
     # Проверяем, является ли сообщение кнопкой отмены
-    if update.message.text == "❌ Отменить":
+    if update.message.text == BTN_CANCEL:
         return await cancel(update, context)
     
     # Если это не кнопка отмены, пропускаем
@@ -449,10 +1014,15 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Глобальный обработчик ошибок"""
     logger.error(f"🚨 Ошибка в обработчике: {context.error}")
     
+    if isinstance(context.error, DatabaseUnavailable):
+        text = "⚠️ База данных временно недоступна. Попробуйте через минуту."
+    else:
+        text = "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз."
+    
     if update and update.effective_user:
         try:
             await update.message.reply_text(
-                "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз.",
+                text,
                 reply_markup=get_main_keyboard()
             )
         except:
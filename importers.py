@@ -0,0 +1,298 @@
+"""
+Импорт расписания из файлов CSV и iCalendar (.ics)
+
+Файл читается построчно генераторами, поэтому в памяти находится только
+текущая строка/событие и итоговый (уже без повторов) список пар.
+"""
+import csv
+import os
+import re
+from datetime import date, datetime, timezone, tzinfo
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from keyboards import WEEKDAYS
+from parsers import DEFAULT_REMINDER, make_entry, resolve_day, resolve_weeks
+from validators import TimeRange, parse_time_range
+
+SUPPORTED_EXTENSIONS = ('.csv', '.ics')
+
+# Сколько ошибок показываем пользователю
+MAX_REPORTED_ERRORS = 20
+
+# Запись из файла: (номер строки, поля)
+Record = Tuple[int, Dict[str, str]]
+
+# ==================== CSV ====================
+
+_CSV_COLUMNS = {
+    'day': ('day', 'weekday', 'день', 'день недели'),
+    'time': ('time', 'время'),
+    'start': ('start', 'начало'),
+    'end': ('end', 'конец', 'окончание'),
+    'className': ('class', 'classname', 'subject', 'предмет', 'название', 'дисциплина'),
+    'professor': ('professor', 'teacher', 'преподаватель'),
+    'reminderBefore': ('reminder', 'reminderbefore', 'напоминание'),
+    'weeks': ('weeks', 'week', 'неделя', 'недели', 'четность'),
+}
+_CSV_HEADER_ALIASES = {
+    alias: field for field, aliases in _CSV_COLUMNS.items() for alias in aliases
+}
+# Порядок колонок для файла без заголовка
+_CSV_POSITIONAL = ['day', 'time', 'className', 'professor', 'reminderBefore']
+
+
+def iter_csv_records(lines: Iterable[str]) -> Iterator[Record]:
+    """Построчно читает CSV (с заголовком или в порядке день,время,предмет,...)"""
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+
+    # Excel с русской локалью сохраняет CSV через точку с запятой
+    delimiter = ';' if first.count(';') > first.count(',') else ','
+    header = next(csv.reader([first], delimiter=delimiter), [])
+    columns = [_CSV_HEADER_ALIASES.get(name.strip().lower()) for name in header]
+
+    if any(columns):
+        reader = csv.reader(lines, delimiter=delimiter)
+        line_offset = 1
+    else:
+        columns = _CSV_POSITIONAL
+        reader = csv.reader(chain([first], lines), delimiter=delimiter)
+        line_offset = 0
+
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        fields = {
+            column: cell.strip()
+            for column, cell in zip(columns, row)
+            if column
+        }
+        yield reader.line_num + line_offset, fields
+
+
+# ==================== iCalendar ====================
+
+_ICS_PROPERTY_RE = re.compile(r'^(?P<name>[A-Za-z-]+)(?P<params>(?:;[^:]*)?):(?P<value>.*)$')
+_ICS_DURATION_RE = re.compile(
+    r'^(?P<sign>[-+]?)P(?:(?P<weeks>\d+)W)?(?:(?P<days>\d+)D)?'
+    r'(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:\d+S)?)?$'
+)
+_ICS_CN_RE = re.compile(r'CN="?(?P<cn>[^";:]+)"?')
+_ICS_TZID_RE = re.compile(r';TZID="?(?P<tzid>[^";:]+)"?', re.IGNORECASE)
+_ICS_KEEP = {'DTSTART', 'DTEND', 'SUMMARY', 'DESCRIPTION', 'ORGANIZER', 'TRIGGER'}
+
+
+def _unescape_ics(value: str) -> str:
+    return (
+        value.replace('\\n', '\n').replace('\\N', '\n')
+        .replace('\\,', ',').replace('\\;', ';').replace('\\\\', '\\')
+    )
+
+
+def iter_ics_lines(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """Склеивает перенесенные строки (RFC 5545, 3.1)"""
+    pending: Optional[str] = None
+    pending_no = 0
+    for line_no, raw in enumerate(lines, 1):
+        line = raw.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending_no, pending
+        pending, pending_no = line, line_no
+    if pending is not None:
+        yield pending_no, pending
+
+
+def iter_ics_records(lines: Iterable[str]) -> Iterator[Record]:
+    """Построчно читает VEVENT-ы календаря"""
+    event: Optional[Dict[str, str]] = None
+    event_line = 0
+    for line_no, line in iter_ics_lines(lines):
+        if line == 'BEGIN:VEVENT':
+            event, event_line = {}, line_no
+            continue
+        if event is None:
+            continue
+        if line == 'END:VEVENT':
+            yield event_line, event
+            event = None
+            continue
+
+        match = _ICS_PROPERTY_RE.match(line)
+        if not match:
+            continue
+        name = match.group('name').upper()
+        if name not in _ICS_KEEP or name in event:
+            continue
+        if name == 'ORGANIZER':
+            cn = _ICS_CN_RE.search(match.group('params'))
+            if cn:
+                event['professor'] = cn.group('cn').strip()
+            continue
+        if name in ('DTSTART', 'DTEND'):
+            if 'VALUE=DATE' in match.group('params').upper():
+                event['allDay'] = '1'
+            tzid = _ICS_TZID_RE.search(match.group('params'))
+            if tzid:
+                event[f'{name}_TZID'] = tzid.group('tzid').strip()
+        event[name] = _unescape_ics(match.group('value'))
+
+
+def _zone(tzid: Optional[str]) -> Optional[tzinfo]:
+    """Пояс из TZID (None - пояса нет или имя не из базы IANA)"""
+    if not tzid:
+        return None
+    try:
+        return ZoneInfo(tzid)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def _ics_datetime(
+    value: str,
+    tzid: Optional[str] = None,
+    tz: Optional[tzinfo] = None
+) -> Optional[Tuple[date, int, int]]:
+    """
+    20240902T090000[Z] -> (дата, часы, минуты) в поясе пользователя tz.
+    Время в UTC (Z) и с TZID переводится в tz; время без пояса
+    (и с неизвестным TZID) берется как в файле.
+    """
+    if len(value) < 13 or value[8] != 'T' or not value[:8].isdigit():
+        return None
+    try:
+        moment = datetime(
+            int(value[:4]), int(value[4:6]), int(value[6:8]),
+            int(value[9:11]), int(value[11:13])
+        )
+    except ValueError:
+        return None
+
+    source = timezone.utc if value.endswith(('Z', 'z')) else _zone(tzid)
+    if source is not None and tz is not None:
+        moment = moment.replace(tzinfo=source).astimezone(tz)
+    return moment.date(), moment.hour, moment.minute
+
+
+def _ics_reminder(trigger: Optional[str]) -> int:
+    """TRIGGER:-PT15M -> 15 (минут до начала)"""
+    if not trigger:
+        return DEFAULT_REMINDER
+    match = _ICS_DURATION_RE.match(trigger.strip())
+    if not match or match.group('sign') == '+':
+        return DEFAULT_REMINDER
+    parts = {key: int(value or 0) for key, value in match.groupdict().items() if key != 'sign'}
+    return ((parts['weeks'] * 7 + parts['days']) * 24 + parts['hours']) * 60 + parts['minutes']
+
+
+# ==================== ПРОВЕРКА ====================
+
+def _entry_from_csv(fields: Dict[str, str]) -> Tuple[Optional[Dict], Optional[str]]:
+    day = resolve_day(fields.get('day', ''))
+    if day is None:
+        return None, f"неизвестный день «{fields.get('day', '')}»"
+
+    time_text = fields.get('time') or f"{fields.get('start', '')}-{fields.get('end', '')}"
+    time_range, error = parse_time_range(time_text)
+    if error:
+        return None, f"{error}: «{time_text}»"
+
+    reminder_text = fields.get('reminderBefore') or str(DEFAULT_REMINDER)
+    if not reminder_text.isdigit():
+        return None, f"неверное напоминание «{reminder_text}»"
+
+    weeks = None
+    if fields.get('weeks'):
+        weeks = resolve_weeks(fields['weeks'])
+        if weeks is None:
+            return None, f"неверная четность недели «{fields['weeks']}»"
+
+    return make_entry(
+        day, time_range,
+        fields.get('className', ''),
+        fields.get('professor', ''),
+        int(reminder_text),
+        weeks
+    )
+
+
+def _entry_from_ics(
+    fields: Dict[str, str],
+    tz: Optional[tzinfo] = None
+) -> Tuple[Optional[Dict], Optional[str]]:
+    if fields.get('allDay'):
+        return None, "событие на весь день пропущено"
+    start = _ics_datetime(fields.get('DTSTART', ''), fields.get('DTSTART_TZID'), tz)
+    end = _ics_datetime(fields.get('DTEND', ''), fields.get('DTEND_TZID'), tz)
+    if start is None or end is None:
+        return None, "нет времени начала или конца"
+    start_minutes = start[1] * 60 + start[2]
+    end_minutes = end[1] * 60 + end[2]
+    if start_minutes >= end_minutes:
+        return None, "время начала должно быть раньше конца"
+
+    return make_entry(
+        WEEKDAYS[start[0].weekday()],
+        TimeRange(start_minutes, end_minutes),
+        fields.get('SUMMARY', '').strip(),
+        fields.get('professor', ''),
+        _ics_reminder(fields.get('TRIGGER'))
+    )
+
+
+def entry_key(entry: Dict) -> Tuple:
+    """Ключ для поиска одинаковых пар"""
+    return (
+        entry.get('day'), entry.get('time'), entry.get('className'),
+        entry.get('professor', ''), entry.get('weeks')
+    )
+
+
+def collect_entries(
+    records: Iterable[Record],
+    is_ics: bool = False,
+    tz: Optional[tzinfo] = None
+) -> Tuple[List[Dict], List[Tuple[int, str]]]:
+    """
+    Проверяет записи пачкой: возвращает уникальные пары и ошибки.
+    Еженедельные повторы одного события в .ics сворачиваются в одну пару.
+    Время событий .ics с поясом переводится в пояс пользователя tz.
+    """
+    entries: List[Dict] = []
+    errors: List[Tuple[int, str]] = []
+    seen = set()
+
+    for line_no, fields in records:
+        entry, error = _entry_from_ics(fields, tz) if is_ics else _entry_from_csv(fields)
+        if error:
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append((line_no, error))
+            continue
+        key = entry_key(entry)
+        if key not in seen:
+            seen.add(key)
+            entries.append(entry)
+
+    return entries, errors
+
+
+def load_schedule_file(
+    path: str,
+    file_name: str,
+    tz: Optional[tzinfo] = None
+) -> Tuple[List[Dict], List[Tuple[int, str]]]:
+    """Читает файл расписания с диска (тип определяется по расширению, tz - пояс пользователя)"""
+    extension = os.path.splitext(file_name or '')[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError(f"Неподдерживаемый формат файла: {extension or file_name}")
+
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as f:
+        if extension == '.ics':
+            return collect_entries(iter_ics_records(f), is_ics=True, tz=tz)
+        return collect_entries(iter_csv_records(f))
@@ -0,0 +1,103 @@
+"""
+Журнал отложенных записей на диске (write-ahead log)
+
+Каждая запись - длина и CRC32 (по 4 байта, big-endian), затем JSON.
+Запись считается принятой только после fsync; fsync выполняется один
+на пачку записей, накопившихся за время предыдущего fsync (group commit).
+Оборванный хвост (процесс убит посреди записи) при чтении отбрасывается.
+"""
+import os
+import json
+import zlib
+import struct
+import asyncio
+import logging
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>II')
+
+
+class WriteAheadJournal:
+    """Файл только для дописывания с пакетным fsync"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._waiters: List[asyncio.Future] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def open(self) -> List[Any]:
+        """Открывает журнал и возвращает уже записанные в нем записи"""
+        records, valid_size = self._read()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'ab')
+        if self._file.tell() != valid_size:
+            logger.warning(f"⚠️ Журнал {self.path}: отброшен оборванный хвост")
+            self._file.truncate(valid_size)
+        return records
+
+    def _read(self):
+        records = []
+        valid_size = 0
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return records, 0
+
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, checksum = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            records.append(json.loads(payload))
+            offset = valid_size = start + length
+        return records, valid_size
+
+    async def append(self, record: Any):
+        """Дописывает запись и ждет, пока она окажется на диске"""
+        payload = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+        await future
+
+    async def _flush(self):
+        """Один fsync на все записи, накопившиеся к этому моменту"""
+        loop = asyncio.get_running_loop()
+        while self._waiters:
+            waiters, self._waiters = self._waiters, []
+            try:
+                self._file.flush()
+                await loop.run_in_executor(None, os.fsync, self._file.fileno())
+            except Exception as e:
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                continue
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def truncate(self):
+        """Очищает журнал (все записи уже в БД); fsync - в пуле потоков, как в _flush"""
+        if self._file is None:
+            return
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.flush()
+        await asyncio.get_running_loop().run_in_executor(None, os.fsync, self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
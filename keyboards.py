@@ -1,6 +1,8 @@
 """
 Все клавиатуры бота
 """
+from typing import List, Tuple
+
 from telegram import (
     ReplyKeyboardMarkup, 
     KeyboardButton,
@@ -8,26 +10,46 @@ from telegram import (
     InlineKeyboardButton
 )
 
+from callback_data import (
+    ItemCallback, encode_callback,
+    KIND_DEADLINES, ACTION_PAGE, ACTION_EDIT, ACTION_DELETE, ACTION_FIELD,
+    FIELD_NONE, FIELD_NAME, FIELD_DATETIME, FIELD_DESCRIPTION, FIELD_REMINDER
+)
+
 # Упорядоченные дни недели
 WEEKDAYS = [
     "понедельник", "вторник", "среда", 
     "четверг", "пятница", "суббота", "воскресенье"
 ]
 
+# Подписи кнопок reply-клавиатур (по ним же маршрутизируются сообщения)
+BTN_ADD_SCHEDULE = "📅 Добавить расписание"
+BTN_ADD_DEADLINE = "⏰ Добавить дедлайн"
+BTN_SHOW_SCHEDULE = "📋 Мое расписание"
+BTN_SHOW_DEADLINES = "📝 Мои дедлайны"
+BTN_RESET = "🔄 Сбросить состояние"
+BTN_HELP = "ℹ️ Помощь"
+BTN_CANCEL = "❌ Отменить"
+
+BUTTON_LABELS = frozenset({
+    BTN_ADD_SCHEDULE, BTN_ADD_DEADLINE, BTN_SHOW_SCHEDULE,
+    BTN_SHOW_DEADLINES, BTN_RESET, BTN_HELP, BTN_CANCEL,
+})
+
 def get_main_keyboard():
     """Основная клавиатура"""
     keyboard = [
         [
-            KeyboardButton("📅 Добавить расписание"),
-            KeyboardButton("⏰ Добавить дедлайн"),
+            KeyboardButton(BTN_ADD_SCHEDULE),
+            KeyboardButton(BTN_ADD_DEADLINE),
         ],
         [
-            KeyboardButton("📋 Мое расписание"),
-            KeyboardButton("📝 Мои дедлайны"),
+            KeyboardButton(BTN_SHOW_SCHEDULE),
+            KeyboardButton(BTN_SHOW_DEADLINES),
         ],
         [
-            KeyboardButton("🔄 Сбросить состояние"),
-            KeyboardButton("ℹ️ Помощь"),
+            KeyboardButton(BTN_RESET),
+            KeyboardButton(BTN_HELP),
         ]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -44,46 +66,71 @@ def get_weekday_keyboard(prefix="day_"):
         ])
     return InlineKeyboardMarkup(keyboard)
 
-def get_edit_schedule_keyboard(day: str, items_count: int):
-    """Клавиатура для редактирования расписания на день"""
+def get_page_keyboard(
+    kind: int,
+    version: int,
+    page: int,
+    pages: int,
+    items: List[Tuple[int, int]]
+):
+    """
+    Инлайн-клавиатура страницы списка: правка и удаление каждой записи
+    и переход между страницами. items - (номер в списке, индекс записи).
+    """
     keyboard = []
-    for i in range(items_count):
+    for number, index in items:
         keyboard.append([
             InlineKeyboardButton(
-                f"✏️ Пара {i+1}",
-                callback_data=f"edit_schedule_{day}_{i}"
+                f"✏️ {number}",
+                callback_data=encode_callback(ItemCallback(ACTION_EDIT, kind, version, page, index))
             ),
             InlineKeyboardButton(
-                f"🗑️ Пара {i+1}",
-                callback_data=f"delete_schedule_{day}_{i}"
+                f"🗑️ {number}",
+                callback_data=encode_callback(ItemCallback(ACTION_DELETE, kind, version, page, index))
             )
         ])
     
-    keyboard.append([
-        InlineKeyboardButton("🔙 Назад", callback_data="back_to_schedule")
-    ])
+    if pages > 1:
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(
+                "◀️", callback_data=encode_callback(ItemCallback(ACTION_PAGE, kind, version, page - 1))
+            ))
+        navigation.append(InlineKeyboardButton(
+            f"{page + 1}/{pages}",
+            callback_data=encode_callback(ItemCallback(ACTION_PAGE, kind, version, page))
+        ))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(
+                "▶️", callback_data=encode_callback(ItemCallback(ACTION_PAGE, kind, version, page + 1))
+            ))
+        keyboard.append(navigation)
     
     return InlineKeyboardMarkup(keyboard)
 
-def get_edit_deadline_keyboard(deadline_index: int):
+def get_edit_deadline_keyboard(version: int, page: int, deadline_index: int):
     """Клавиатура для редактирования дедлайна"""
+    def button(text: str, action: int, field: int = FIELD_NONE):
+        callback = ItemCallback(action, KIND_DEADLINES, version, page, deadline_index, field)
+        return InlineKeyboardButton(text, callback_data=encode_callback(callback))
+    
     keyboard = [
         [
-            InlineKeyboardButton("📝 Название", callback_data=f"edit_deadline_name_{deadline_index}"),
-            InlineKeyboardButton("📅 Дата", callback_data=f"edit_deadline_date_{deadline_index}")
+            button("📝 Название", ACTION_FIELD, FIELD_NAME),
+            button("📅 Дата", ACTION_FIELD, FIELD_DATETIME)
         ],
         [
-            InlineKeyboardButton("📄 Описание", callback_data=f"edit_deadline_desc_{deadline_index}"),
-            InlineKeyboardButton("⏰ Напоминание", callback_data=f"edit_deadline_reminder_{deadline_index}")
+            button("📄 Описание", ACTION_FIELD, FIELD_DESCRIPTION),
+            button("⏰ Напоминание", ACTION_FIELD, FIELD_REMINDER)
         ],
         [
-            InlineKeyboardButton("🗑️ Удалить", callback_data=f"delete_deadline_{deadline_index}"),
-            InlineKeyboardButton("🔙 Назад", callback_data="back_to_deadlines")
+            button("🗑️ Удалить", ACTION_DELETE),
+            button("🔙 Назад", ACTION_PAGE)
         ]
     ]
     return InlineKeyboardMarkup(keyboard)
 
 def get_cancel_keyboard():
     """Клавиатура для отмены действия"""
-    keyboard = [[KeyboardButton("❌ Отменить")]]
+    keyboard = [[KeyboardButton(BTN_CANCEL)]]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""
+Отладка памяти долгоживущего процесса
+
+Маршрут /debug/memory появляется, только если задан DEBUG_TOKEN (запрос
+должен передать его в заголовке X-Debug-Token); без него модуль ничего не
+делает. tracemalloc включается по запросу и замедляет каждое выделение
+памяти, пока включен, поэтому после замеров его стоит выключить.
+
+    /debug/memory                  - размеры отслеживаемых структур
+    /debug/memory?action=start     - включить tracemalloc
+    /debug/memory?action=snapshot  - топ мест выделения памяти и рост с прошлого снимка
+    /debug/memory?action=stop      - выключить tracemalloc
+"""
+import os
+import sys
+import hmac
+import types
+import asyncio
+import logging
+import tracemalloc
+from itertools import islice
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN', '')
+
+# Глубина стека, которую запоминает tracemalloc
+TRACE_FRAMES = int(os.environ.get('TRACEMALLOC_FRAMES', 1))
+# Сколько мест выделения показывать
+TOP_STATS = 25
+# По скольким записям структуры оценивать средний размер записи
+SIZE_SAMPLE = 200
+# Насколько глубоко обходить вложенные объекты при оценке
+MAX_DEPTH = 6
+
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# Общие объекты процесса, на которые ссылаются записи (блокировки - на цикл
+# событий): в размер записи не входят
+_OPAQUE = (type, types.ModuleType, types.FunctionType, types.MethodType, asyncio.AbstractEventLoop)
+
+
+def _deep_size(obj: Any, seen: set, depth: int = 0) -> int:
+    """Размер объекта вместе с вложенными (общие объекты считаются один раз)"""
+    if id(obj) in seen or isinstance(obj, _OPAQUE):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    if depth >= MAX_DEPTH:
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += _deep_size(key, seen, depth + 1) + _deep_size(value, seen, depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for value in obj:
+            size += _deep_size(value, seen, depth + 1)
+    elif hasattr(obj, '__dict__'):
+        size += _deep_size(vars(obj), seen, depth + 1)
+    return size
+
+
+def estimate_size(container: Any) -> int:
+    """
+    Оценка размера структуры: сама структура плюс средний размер записи
+    по первым SIZE_SAMPLE записям, умноженный на их число
+    """
+    size = sys.getsizeof(container, 0)
+    count = len(container)
+    if not count:
+        return size
+    seen = {id(container)}
+    if isinstance(container, dict):
+        sample = list(islice(container.items(), SIZE_SAMPLE))
+        sampled = sum(_deep_size(key, seen) + _deep_size(value, seen) for key, value in sample)
+    else:
+        sample = list(islice(container, SIZE_SAMPLE))
+        sampled = sum(_deep_size(value, seen) for value in sample)
+    return size + sampled * count // len(sample)
+
+
+def _format_size(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+class MemoryProfiler:
+    """Снимки tracemalloc и размеры отслеживаемых структур"""
+
+    def __init__(self):
+        self._structures: Dict[str, Callable[[], Any]] = {}
+        self._previous: Optional[tracemalloc.Snapshot] = None
+
+    def watch(self, name: str, getter: Callable[[], Any]):
+        """Отслеживать структуру (getter вызывается при каждом отчете)"""
+        self._structures[name] = getter
+
+    def structures_report(self) -> List[str]:
+        lines = ["Структуры (записей, оценка размера):"]
+        rows = []
+        for name, getter in self._structures.items():
+            try:
+                container = getter()
+                rows.append((estimate_size(container), name, len(container)))
+            except Exception as e:
+                lines.append(f"  {name}: ошибка {e!r}")
+        for size, name, count in sorted(rows, reverse=True):
+            lines.append(f"  {name}: {count}, ~{_format_size(size)}")
+        return lines
+
+    def start(self) -> List[str]:
+        if tracemalloc.is_tracing():
+            return ["tracemalloc уже включен"]
+        tracemalloc.start(TRACE_FRAMES)
+        self._previous = None
+        logger.warning("🔬 tracemalloc включен")
+        return [f"tracemalloc включен (кадров стека: {TRACE_FRAMES})"]
+
+    def stop(self) -> List[str]:
+        if not tracemalloc.is_tracing():
+            return ["tracemalloc не был включен"]
+        tracemalloc.stop()
+        self._previous = None
+        logger.warning("🔬 tracemalloc выключен")
+        return ["tracemalloc выключен"]
+
+    def snapshot(self) -> List[str]:
+        if not tracemalloc.is_tracing():
+            return ["tracemalloc выключен: сначала ?action=start"]
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+        lines = [
+            f"Отслежено: {_format_size(current)}, пик: {_format_size(peak)}",
+            "",
+            f"Топ-{TOP_STATS} мест выделения:",
+        ]
+        lines += [f"  {stat}" for stat in snapshot.statistics('lineno')[:TOP_STATS]]
+        if self._previous is not None:
+            lines += ["", "Рост с прошлого снимка:"]
+            lines += [
+                f"  {stat}" for stat in snapshot.compare_to(self._previous, 'lineno')[:TOP_STATS]
+            ]
+        self._previous = snapshot
+        return lines
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """GET /debug/memory (токен уже проверен)"""
+        action = request.query.get('action', '')
+        if action == 'start':
+            lines = self.start()
+        elif action == 'stop':
+            lines = self.stop()
+        elif action == 'snapshot':
+            lines = self.snapshot()
+        elif action:
+            raise web.HTTPBadRequest(text="action: start, snapshot или stop")
+        else:
+            lines = []
+        lines += [""] + self.structures_report()
+        return web.Response(text="\n".join(lines))
+
+
+def watch_defaults(application) -> MemoryProfiler:
+    """Профилировщик с основными структурами процесса"""
+    from dedup import update_deduplicator
+    from groups import group_timetables
+    from middlewares import user_lock_middleware
+    from persistence import PostgresPersistence
+    from reminders import reminder_scheduler
+    from search import search_indexes
+    from storage import user_storage
+    from telegram.ext import ConversationHandler
+    from admission import admission
+    import views
+
+    profiler = MemoryProfiler()
+    profiler.watch("UserStateStorage._cache", lambda: user_storage._cache)
+    profiler.watch("UserStateStorage._cache_timestamps", lambda: user_storage._cache_timestamps)
+    profiler.watch("UserStateStorage._user_locks", lambda: user_storage._user_locks)
+    profiler.watch("UserStateStorage._journal", lambda: user_storage._journal)
+    profiler.watch("UserLockMiddleware.user_locks", lambda: user_lock_middleware.user_locks)
+    profiler.watch("Application.user_data", lambda: application.user_data)
+    profiler.watch("Application.chat_data", lambda: application.chat_data)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                profiler.watch(
+                    f"ConversationHandler[{handler.name}]",
+                    lambda handler=handler: handler._conversations
+                )
+    if isinstance(application.persistence, PostgresPersistence):
+        profiler.watch("PostgresPersistence._user_data", lambda: application.persistence._user_data)
+        profiler.watch(
+            "PostgresPersistence._conversations", lambda: application.persistence._conversations
+        )
+    profiler.watch("ReminderScheduler._tables", lambda: reminder_scheduler._tables)
+    profiler.watch("ReminderScheduler._heap", lambda: reminder_scheduler._heap)
+    profiler.watch("ReminderScheduler._followers", lambda: reminder_scheduler._followers)
+    profiler.watch("GroupTimetables._timetables", lambda: group_timetables._timetables)
+    profiler.watch("SearchIndexes._users", lambda: search_indexes._users)
+    profiler.watch("views._page_cache", lambda: views._page_cache)
+    profiler.watch("UserRateLimiter._buckets", lambda: admission.limiter._buckets)
+    profiler.watch("UpdateDeduplicator._seen", lambda: update_deduplicator._seen)
+    return profiler
+
+
+def is_authorized(request: web.Request) -> bool:
+    token = request.headers.get('X-Debug-Token', '').encode()
+    return bool(DEBUG_TOKEN) and hmac.compare_digest(token, DEBUG_TOKEN.encode())
+
+
+def memory_route(get_application: Callable[[], Any]) -> Callable:
+    """Обработчик /debug/memory; профилировщик создается при первом запросе"""
+    profiler: Optional[MemoryProfiler] = None
+
+    async def handle_memory(request: web.Request) -> web.Response:
+        nonlocal profiler
+        if not is_authorized(request):
+            # Без токена маршрута как будто нет
+            raise web.HTTPNotFound()
+        if profiler is None:
+            profiler = watch_defaults(get_application())
+        return await profiler.handle(request)
+
+    return handle_memory
@@ -44,7 +44,13 @@ class UserLockMiddleware:
                 logger.info(f"✅ Обработка завершена для user {user_id} за {elapsed:.2f} сек")
 
 class StateManagementMiddleware:
-    """Middleware для управления состоянием пользователя"""
+    """
+    Middleware для управления состоянием пользователя.
+    
+    Временные данные диалогов (schedule_data, deadline_data и т.д.) живут в
+    context.user_data и сохраняются через PostgresPersistence, поэтому здесь
+    только прогреваем кэш хранилища перед обработчиком.
+    """
     
     async def __call__(
         self, 
@@ -54,44 +60,11 @@ class StateManagementMiddleware:
     ):
         user_id = update.effective_user.id
         
-        # Загружаем состояние пользователя
-        user_data = await user_storage.get_user_data(user_id)
-        
-        # 🔥 ИСПРАВЛЕНИЕ: не присваиваем новый объект, а обновляем существующий
-        if context.user_data is None:
-            context.user_data = {}
-        
-        # Сохраняем старые данные если есть
-        old_user_data = context.user_data.copy() if context.user_data else {}
-        
-        # Очищаем и обновляем
-        context.user_data.clear()
-        context.user_data.update({
-            'schedule': user_data['schedule'],
-            'deadlines': user_data['deadlines'],
-            'state': user_data['state'],
-            # Сохраняем старые временные данные если есть
-            'schedule_data': old_user_data.get('schedule_data'),
-            'deadline_data': old_user_data.get('deadline_data'),
-            'schedule_index': old_user_data.get('schedule_index'),
-            'deadline_index': old_user_data.get('deadline_index'),
-            'schedule_field': old_user_data.get('schedule_field'),
-            'deadline_field': old_user_data.get('deadline_field')
-        })
+        # Загружаем данные пользователя в кэш
+        await user_storage.get_user_data(user_id)
         
         try:
-            # Вызываем обработчик
-            result = await next_handler(update, context)
-            
-            # Автоматически сохраняем состояние после обработки
-            await user_storage.update_user_data(
-                user_id,
-                schedule=context.user_data.get('schedule'),
-                deadlines=context.user_data.get('deadlines'),
-                state=context.user_data.get('state', {})
-            )
-            
-            return result
+            return await next_handler(update, context)
         except Exception as e:
             logger.error(f"❌ Ошибка в обработчике для user {user_id}: {e}")
             raise
@@ -0,0 +1,89 @@
+"""
+Фоновые шаги схемы: индексы CONCURRENTLY и перенос данных порциями
+
+init_database при запуске применяет только DDL-шаги. Шаги ConcurrentIndex
+и Backfill из SCHEMA_STEPS выполняет эта задача, пока бот работает:
+- индекс строится CREATE INDEX CONCURRENTLY - запись в таблицу не
+  блокируется;
+- данные переносятся порциями по BATCH_SIZE строк в отдельных коротких
+  транзакциях с паузой между ними; прогресс хранится в БД, поэтому
+  после перезапуска перенос продолжается с места остановки.
+
+При перегрузке бота или недоступности БД работа откладывается до
+следующего запуска задачи. Несколько процессов не мешают друг другу:
+каждый шаг выполняет тот, кто взял его advisory-блокировку.
+"""
+import time
+import asyncio
+import logging
+
+from telegram.ext import ContextTypes
+
+from admission import admission
+from database import Database, ConcurrentIndex, SCHEMA_STEPS, breaker
+from storage import user_storage
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_INTERVAL = 60
+# Сколько секунд за один запуск задачи переносить данные
+MIGRATION_SLICE = 30
+# Пауза между порциями, чтобы не мешать обычным запросам
+BATCH_PAUSE = 0.2
+
+
+async def _build_index(version: int):
+    step = SCHEMA_STEPS[version]
+    started = time.perf_counter()
+    logger.info(f"🏗️ Шаг схемы {version}: строим индекс {step.name}")
+    if await Database.build_index_concurrently(version):
+        logger.info(
+            f"✅ Шаг схемы {version}: индекс {step.name} "
+            f"построен за {time.perf_counter() - started:.1f} сек"
+        )
+
+
+async def _run_backfill(version: int, deadline: float) -> bool:
+    """Переносит порции до deadline; True, если перенос завершен"""
+    step = SCHEMA_STEPS[version]
+    while time.monotonic() < deadline:
+        if admission.overloaded or breaker.is_open:
+            return False
+        keys = await Database.run_backfill_batch(version)
+        if keys is None:
+            logger.info(f"✅ Шаг схемы {version}: перенос данных {step.table} завершен")
+            return True
+        if not keys:
+            # Порцию обрабатывает другой процесс
+            return False
+        if step.table == 'users':
+            # Закэшированные данные не должны затереть перенесенные
+            for user_id in keys:
+                await user_storage.forget(user_id)
+        await asyncio.sleep(BATCH_PAUSE)
+    return False
+
+
+async def migration_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: выполняет незавершенные фоновые шаги схемы"""
+    try:
+        pending = await Database.pending_online_steps()
+    except Exception as e:
+        logger.debug(f"Фоновые шаги схемы отложены: {e}")
+        return
+    if not pending:
+        # Новые шаги появляются только с новой версией бота
+        context.job.schedule_removal()
+        return
+
+    deadline = time.monotonic() + MIGRATION_SLICE
+    for version in pending:
+        try:
+            if isinstance(SCHEMA_STEPS[version], ConcurrentIndex):
+                await _build_index(version)
+            elif not await _run_backfill(version, deadline):
+                # Следующие шаги ждут завершения этого
+                return
+        except Exception as e:
+            logger.error(f"❌ Ошибка фонового шага схемы {version}: {e}")
+            return
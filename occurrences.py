@@ -0,0 +1,77 @@
+"""
+Исключения из еженедельного расписания: проходит ли пара в конкретную дату
+
+Пара повторяется каждую неделю по полям day + time. Дополнительно
+учитываются исключения:
+- entry['weeks']: 'odd' / 'even' - пара только по нечетным/четным неделям
+  (числитель/знаменатель);
+- entry['skip']: список дат "ГГГГ-ММ-ДД", когда пара отменена;
+- state['holidays']: даты "ГГГГ-ММ-ДД", когда занятий нет совсем;
+- state['semester_start']: дата начала семестра, от нее считается
+  четность недель (без нее - по номеру недели ISO).
+
+Ближайшие срабатывания ищет reminders.FireTable (таблица на неделю в
+секундах UTC), а occurs_on проверяет исключения при срабатывании;
+reminders.iter_occurrences перебирает только настоящие срабатывания.
+"""
+from datetime import date
+from typing import Dict, Optional
+
+from validators import parse_date
+
+ODD = 'odd'
+EVEN = 'even'
+WEEK_PARITIES = (ODD, EVEN)
+WEEK_LABELS = {ODD: 'нечет', EVEN: 'чет'}
+
+
+class Rules:
+    """Исключения пользователя из еженедельного расписания"""
+
+    __slots__ = ('holidays', 'week_one')
+
+    def __init__(self, state: Optional[Dict] = None):
+        state = state if isinstance(state, dict) else {}
+        self.holidays = parse_dates(state.get('holidays'))
+        # Порядковый номер понедельника первой недели семестра
+        self.week_one: Optional[int] = None
+        start = parse_date(state.get('semester_start') or '')
+        if start is not None:
+            self.week_one = start.toordinal() - start.weekday()
+
+    def __bool__(self) -> bool:
+        return bool(self.holidays) or self.week_one is not None
+
+    def parity(self, day: date) -> str:
+        """Четность недели, в которую попадает day"""
+        if self.week_one is None:
+            number = day.isocalendar()[1]
+        else:
+            number = (day.toordinal() - self.week_one) // 7 + 1
+        return ODD if number % 2 else EVEN
+
+
+def parse_dates(values) -> frozenset:
+    """Список "ГГГГ-ММ-ДД" -> множество порядковых номеров дней"""
+    if not isinstance(values, list):
+        return frozenset()
+    result = set()
+    for value in values:
+        parsed = parse_date(value) if isinstance(value, str) else None
+        if parsed is not None:
+            result.add(parsed.toordinal())
+    return frozenset(result)
+
+
+def occurs_on(entry: Dict, day: date, rules: Rules) -> bool:
+    """Проходит ли пара в дату day (день недели не проверяется)"""
+    ordinal = day.toordinal()
+    if ordinal in rules.holidays:
+        return False
+    weeks = entry.get('weeks')
+    if weeks in WEEK_PARITIES and rules.parity(day) != weeks:
+        return False
+    skip = entry.get('skip')
+    if skip and ordinal in parse_dates(skip):
+        return False
+    return True
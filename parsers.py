@@ -0,0 +1,175 @@
+"""
+Разбор и проверка записей расписания
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from keyboards import WEEKDAYS
+from occurrences import EVEN, ODD
+from validators import TimeRange, parse_time_range
+
+# Напоминание по умолчанию, если число минут не указано
+DEFAULT_REMINDER = 15
+MAX_REMINDER = 24 * 60
+
+# Сокращения дней недели в порядке WEEKDAYS
+_DAY_ABBREVIATIONS = [
+    ("пн", "пон", "пнд"),
+    ("вт", "вто", "втр"),
+    ("ср", "сре", "срд"),
+    ("чт", "чет", "чтв"),
+    ("пт", "пят", "птн"),
+    ("сб", "суб", "сбт"),
+    ("вс", "вос", "вск"),
+]
+
+DAY_ALIASES: Dict[str, str] = {}
+for _day, _abbreviations in zip(WEEKDAYS, _DAY_ABBREVIATIONS):
+    DAY_ALIASES[_day] = _day
+    for _alias in _abbreviations:
+        DAY_ALIASES[_alias] = _day
+
+# Четность недели: "(нечет)" / "(чет)", они же числитель / знаменатель
+WEEK_ALIASES = {
+    'нечет': ODD, 'нечёт': ODD, 'числитель': ODD, 'odd': ODD,
+    'чет': EVEN, 'чёт': EVEN, 'знаменатель': EVEN, 'even': EVEN,
+}
+
+# "пн 14:30-16:00 Матан Иванов 15" (день необязателен, если был заголовок)
+_ENTRY_RE = re.compile(
+    r'^(?:(?P<day>[^\W\d_]+)\.?[,:]?\s+)?'
+    r'(?P<time>\d{1,2}[:.]\d{2}\s*[-–—]\s*\d{1,2}[:.]\d{2})'
+    r'(?:\s+(?P<rest>.*?))?'
+    r'(?:\s+(?P<reminder>\d{1,4}))?\s*$'
+)
+# Строка-заголовок с одним днем: "Понедельник:"
+_HEADER_RE = re.compile(r'^(?P<day>[^\W\d_]+)\.?:?$')
+# Пометка четности в скобках в любом месте строки
+_WEEKS_RE = re.compile(r'\s*\((?P<weeks>[^\W\d_]+)\)(?=\s|$)')
+# Явный разделитель предмета и преподавателя
+_SEPARATOR_RE = re.compile(r'\s*(?:\||;|,|\s[-–—]\s)\s*')
+# Инициалы преподавателя: "И.И." или "И."
+_INITIALS_RE = re.compile(r'^[^\W\d_]\.(?:[^\W\d_]\.)?$')
+
+
+def resolve_day(token: str) -> Optional[str]:
+    """Приводит название или сокращение дня к значению из WEEKDAYS"""
+    return DAY_ALIASES.get(token.lower())
+
+
+def resolve_weeks(token: str) -> Optional[str]:
+    """Приводит пометку четности недели к ODD/EVEN"""
+    return WEEK_ALIASES.get(token.strip().lower())
+
+
+def make_entry(
+    day: str,
+    time_range: TimeRange,
+    class_name: str,
+    professor: str = "",
+    reminder: int = DEFAULT_REMINDER,
+    weeks: Optional[str] = None
+) -> Tuple[Optional[Dict], Optional[str]]:
+    """Проверяет поля пары и собирает запись расписания"""
+    if not class_name:
+        return None, "не указан предмет"
+    if not 0 <= reminder <= MAX_REMINDER:
+        return None, f"напоминание должно быть от 0 до {MAX_REMINDER} мин."
+
+    entry = {
+        'day': day,
+        'time': str(time_range),
+        'className': class_name,
+        'reminderBefore': reminder,
+    }
+    if professor:
+        entry['professor'] = professor
+    if weeks:
+        entry['weeks'] = weeks
+    return entry, None
+
+
+def _split_class_professor(rest: str) -> Tuple[str, str]:
+    """Делит остаток строки на предмет и преподавателя"""
+    parts = _SEPARATOR_RE.split(rest, maxsplit=1)
+    if len(parts) == 2:
+        return parts[0].strip(), parts[1].strip()
+
+    words = rest.split()
+    if len(words) < 2:
+        return rest, ""
+    # "Матан Иванов И.И." - инициалы относятся к фамилии
+    if len(words) >= 3 and _INITIALS_RE.match(words[-1]):
+        return " ".join(words[:-2]), " ".join(words[-2:])
+    return " ".join(words[:-1]), words[-1]
+
+
+def parse_schedule_line(
+    line: str,
+    current_day: Optional[str] = None
+) -> Tuple[Optional[Dict], Optional[str], Optional[str]]:
+    """
+    Разбирает одну строку.
+    Возвращает (запись, новый текущий день, ошибка).
+    """
+    header = _HEADER_RE.match(line)
+    if header:
+        day = resolve_day(header.group('day'))
+        if day is None:
+            return None, current_day, f"неизвестный день «{header.group('day')}»"
+        return None, day, None
+
+    weeks = None
+    marker = _WEEKS_RE.search(line)
+    if marker and resolve_weeks(marker.group('weeks')):
+        weeks = resolve_weeks(marker.group('weeks'))
+        line = (line[:marker.start()] + line[marker.end():]).strip()
+
+    match = _ENTRY_RE.match(line)
+    if not match:
+        return None, current_day, "ожидается формат «пн 14:30-16:00 Предмет Преподаватель 15»"
+
+    day = current_day
+    if match.group('day'):
+        day = resolve_day(match.group('day'))
+        if day is None:
+            return None, current_day, f"неизвестный день «{match.group('day')}»"
+    if day is None:
+        return None, current_day, "не указан день недели"
+
+    time_range, error = parse_time_range(match.group('time'))
+    if error:
+        return None, day, error
+
+    rest = (match.group('rest') or "").strip()
+    class_name, professor = _split_class_professor(rest) if rest else ("", "")
+    reminder = DEFAULT_REMINDER
+    if match.group('reminder'):
+        reminder = int(match.group('reminder'))
+
+    entry, error = make_entry(day, time_range, class_name, professor, reminder, weeks)
+    if error:
+        return None, day, error
+    return entry, day, None
+
+
+def parse_schedule_text(text: str) -> Tuple[List[Dict], List[Tuple[int, str]]]:
+    """
+    Разбирает одну или несколько строк расписания.
+    Возвращает (записи, ошибки в виде (номер строки, текст)).
+    """
+    entries: List[Dict] = []
+    errors: List[Tuple[int, str]] = []
+    current_day: Optional[str] = None
+
+    for line_no, raw_line in enumerate(text.splitlines(), 1):
+        line = raw_line.strip()
+        if not line:
+            continue
+        entry, current_day, error = parse_schedule_line(line, current_day)
+        if error:
+            errors.append((line_no, error))
+        elif entry:
+            entries.append(entry)
+
+    return entries, errors
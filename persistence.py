@@ -0,0 +1,195 @@
+"""
+Хранение состояний диалогов в колонке users.state
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import Database
+from storage import user_storage
+
+logger = logging.getLogger(__name__)
+
+ConversationKey = Tuple[int, ...]
+ConversationDict = Dict[ConversationKey, object]
+
+# Ключи внутри users.state
+CONVERSATIONS_KEY = 'conversations'
+USER_DATA_KEY = 'user_data'
+
+
+class PostgresPersistence(BasePersistence):
+    """
+    Persistence для PTB поверх users.state.
+
+    Application вызывает update_* раз в update_interval секунд; изменения
+    копятся в памяти и пишутся одним пакетом через flush_delay секунд,
+    поэтому каждое нажатие кнопки не превращается в запись в БД.
+    """
+
+    def __init__(self, update_interval: float = 30, flush_delay: float = 1):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False,
+                chat_data=False,
+                user_data=True,
+                callback_data=False
+            ),
+            update_interval=update_interval
+        )
+        self._flush_delay = flush_delay
+        # user_id -> {имя диалога -> {chat_id -> состояние}}
+        self._conversations: Dict[int, Dict[str, Dict[str, Any]]] = {}
+        self._user_data: Dict[int, Dict] = {}
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    # ==================== ЗАГРУЗКА ====================
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        try:
+            self._user_data = await Database.load_state_key(USER_DATA_KEY)
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить user_data: {e}")
+            self._user_data = {}
+        return {user_id: dict(data) for user_id, data in self._user_data.items()}
+
+    async def get_conversations(self, name: str) -> ConversationDict:
+        if not self._conversations:
+            try:
+                self._conversations = await Database.load_state_key(CONVERSATIONS_KEY)
+            except Exception as e:
+                logger.error(f"❌ Не удалось загрузить состояния диалогов: {e}")
+                self._conversations = {}
+
+        conversations: ConversationDict = {}
+        for user_id, by_name in self._conversations.items():
+            for chat_id, state in by_name.get(name, {}).items():
+                conversations[(int(chat_id), user_id)] = state
+        return conversations
+
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    # ==================== ОБНОВЛЕНИЕ ====================
+
+    async def update_conversation(
+        self, name: str, key: ConversationKey, new_state: Optional[object]
+    ) -> None:
+        # Ключ диалога при per_chat=True, per_user=True: (chat_id, user_id)
+        chat_id, user_id = key[0], key[-1]
+        by_name = self._conversations.setdefault(user_id, {})
+        states = by_name.setdefault(name, {})
+        if new_state is None:
+            states.pop(str(chat_id), None)
+            if not states:
+                by_name.pop(name, None)
+        else:
+            states[str(chat_id)] = new_state
+        self._mark_dirty(user_id)
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        # Пустые значения не храним
+        cleaned = {key: value for key, value in data.items() if value is not None}
+        if self._user_data.get(user_id, {}) == cleaned:
+            return
+        self._user_data[user_id] = cleaned
+        self._mark_dirty(user_id)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._user_data.pop(user_id, None)
+        self._mark_dirty(user_id)
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+    # ==================== ЗАПИСЬ ====================
+
+    def _mark_dirty(self, user_id: int):
+        """Помечает пользователя и откладывает запись"""
+        self._dirty.add(user_id)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        try:
+            await asyncio.sleep(self._flush_delay)
+        except asyncio.CancelledError:
+            return
+        # Начатую запись не прерываем
+        await asyncio.shield(self._write_dirty())
+
+    def _build_patch(self, user_id: int) -> Tuple[int, Dict, List[str]]:
+        values: Dict[str, Any] = {}
+        removed: List[str] = []
+
+        conversations = self._conversations.get(user_id)
+        if conversations:
+            values[CONVERSATIONS_KEY] = conversations
+        else:
+            self._conversations.pop(user_id, None)
+            removed.append(CONVERSATIONS_KEY)
+
+        user_data = self._user_data.get(user_id)
+        if user_data:
+            values[USER_DATA_KEY] = user_data
+        else:
+            self._user_data.pop(user_id, None)
+            removed.append(USER_DATA_KEY)
+
+        return user_id, values, removed
+
+    async def _write_dirty(self):
+        """Пишет всех измененных пользователей одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            patches = [self._build_patch(user_id) for user_id in dirty]
+
+            try:
+                saved = await Database.patch_user_states(patches)
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи состояний диалогов: {e}")
+                saved = False
+            if not saved:
+                # Попробуем еще раз при следующей записи
+                self._dirty |= dirty
+                return
+
+            for user_id, values, removed in patches:
+                await user_storage.apply_state_patch(user_id, values, removed)
+            logger.info(f"💾 Сохранены состояния диалогов: {len(dirty)} польз.")
+
+    async def flush(self) -> None:
+        """Немедленная запись (вызывается при остановке приложения)"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_dirty()
@@ -0,0 +1,517 @@
+"""
+Напоминания о парах и дедлайнах с учетом часового пояса пользователя
+
+Для каждого пользователя заранее строится таблица срабатываний на неделю
+в секундах UTC. Таблица перестраивается только при изменении данных или
+при смене смещения UTC (переход на летнее/зимнее время), поэтому на каждом
+тике не выполняется никакой работы с часовыми поясами.
+
+Пары группы считаются один раз - в таблице старосты (с его часовым
+поясом, праздниками и началом семестра) - и при срабатывании рассылаются
+всем участникам, кроме тех, у кого в это время своя пара.
+"""
+import os
+import time
+import asyncio
+import heapq
+import logging
+import itertools
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from telegram.error import Forbidden
+from telegram.ext import ContextTypes
+
+from cache import shared_cache
+from database import Database, DatabaseUnavailable
+from groups import is_member, slot, user_group
+from keyboards import WEEKDAYS
+from occurrences import Rules, occurs_on
+from stats import usage_stats
+from storage import user_storage
+from validators import format_deadline, parse_deadline, parse_time_range
+from workers import owns
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'Europe/Moscow')
+
+# Период проверки напоминаний (секунды)
+TICK_INTERVAL = 30
+# Напоминания, опоздавшие больше чем на это время, не отправляем
+MAX_LATENESS = 10 * 60
+# Напоминания пользователя из одного окна (секунды) приходят одним сообщением
+DIGEST_WINDOW = max(1, int(os.environ.get('REMINDER_DIGEST_WINDOW', 5 * 60)))
+# Сколько сообщений пакета отправляем одновременно
+SEND_BATCH_SIZE = 25
+
+WEEK = 7 * 24 * 3600
+# 1970-01-05 00:00 UTC - понедельник, от него считаем недели
+_EPOCH_MONDAY = 4 * 24 * 3600
+
+# Вид напоминания в таблице
+SCHEDULE = 's'
+DEADLINE = 'd'
+
+
+@lru_cache(maxsize=None)
+def get_timezone(name: str) -> Optional[ZoneInfo]:
+    """ZoneInfo по имени (None, если такого пояса нет)"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def user_timezone(state: Dict) -> ZoneInfo:
+    """Часовой пояс пользователя из state (или пояс по умолчанию)"""
+    name = state.get('tz') if isinstance(state, dict) else None
+    return (name and get_timezone(name)) or get_timezone(DEFAULT_TIMEZONE)
+
+
+def _utc_offset(tz: ZoneInfo, ts: int) -> int:
+    return int(datetime.fromtimestamp(ts, tz).utcoffset().total_seconds())
+
+
+# Пояс -> (момент, момент ближайшей смены смещения UTC после него): между
+# ними смещение не меняется, и таблицы всех пользователей пояса, построенные
+# в этом промежутке, действуют до одного и того же момента
+_offset_periods: Dict[ZoneInfo, Tuple[int, int]] = {}
+
+
+def next_transition(tz: ZoneInfo, after: int, horizon_days: int = 400) -> int:
+    """Момент ближайшей смены смещения UTC после after"""
+    period = _offset_periods.get(tz)
+    if period is not None and period[0] <= after < period[1]:
+        return period[1]
+    transition = _find_transition(tz, after, horizon_days)
+    _offset_periods[tz] = (after, transition)
+    return transition
+
+
+def _find_transition(tz: ZoneInfo, after: int, horizon_days: int) -> int:
+    base = _utc_offset(tz, after)
+    day = 24 * 3600
+    low = after
+    for _ in range(horizon_days):
+        high = low + day
+        if _utc_offset(tz, high) != base:
+            while high - low > 1:
+                middle = (low + high) // 2
+                if _utc_offset(tz, middle) == base:
+                    low = middle
+                else:
+                    high = middle
+            return high
+        low = high
+    # Переходов нет - все равно перестроим таблицу когда-нибудь
+    return after + horizon_days * day
+
+
+def offset_transitions(tz: ZoneInfo, start: int, end: int) -> List[int]:
+    """Все смены смещения UTC в промежутке [start, end) - для VTIMEZONE календаря"""
+    transitions = []
+    moment = start
+    while moment < end:
+        moment = _find_transition(tz, moment, (end - moment) // (24 * 3600) + 1)
+        if moment < end:
+            transitions.append(moment)
+    return transitions
+
+
+def _week_second(ts: int) -> int:
+    return (ts - _EPOCH_MONDAY) % WEEK
+
+
+class FireTable:
+    """Таблица срабатываний напоминаний одного пользователя"""
+
+    __slots__ = (
+        'user_id', 'version', 'schedule', 'deadlines', 'state', 'tz', 'rules',
+        'weekly', 'weekly_keys', 'once', 'once_keys', 'valid_until'
+    )
+
+    def __init__(self, user_id: int, version: int, schedule: List, deadlines: List, state: Dict):
+        self.user_id = user_id
+        self.version = version
+        self.schedule = schedule
+        self.deadlines = deadlines
+        self.state = state
+        self.tz = user_timezone(state)
+        # Праздники и четность недель
+        self.rules = Rules(state)
+        # (секунда недели UTC, индекс пары)
+        self.weekly: List[Tuple[int, int]] = []
+        self.weekly_keys: List[int] = []
+        # (момент UTC, индекс дедлайна)
+        self.once: List[Tuple[int, int]] = []
+        self.once_keys: List[int] = []
+        self.valid_until = 0
+
+    def build(self, now: int) -> 'FireTable':
+        """Пересчитывает таблицу для смещения UTC, действующего в момент now"""
+        tz = self.tz
+        offset = _utc_offset(tz, now)
+
+        weekly = []
+        for index, item in enumerate(self.schedule):
+            if not isinstance(item, dict) or item.get('day') not in WEEKDAYS:
+                continue
+            reminder = item.get('reminderBefore')
+            time_range, error = parse_time_range(item.get('time', ''))
+            if error or not isinstance(reminder, int):
+                continue
+            local = WEEKDAYS.index(item['day']) * 86400 + (time_range.start - reminder) * 60
+            weekly.append(((local - offset) % WEEK, index))
+
+        once = []
+        for index, item in enumerate(self.deadlines):
+            if not isinstance(item, dict):
+                continue
+            reminder = item.get('reminderBefore')
+            deadline = parse_deadline(item.get('datetime', ''))
+            if deadline is None or not isinstance(reminder, int):
+                continue
+            fire = int(deadline.replace(tzinfo=tz).timestamp()) - reminder * 60
+            if fire > now:
+                once.append((fire, index))
+
+        weekly.sort()
+        once.sort()
+        self.weekly, self.weekly_keys = weekly, [key for key, _ in weekly]
+        self.once, self.once_keys = once, [key for key, _ in once]
+        self.valid_until = next_transition(tz, now)
+        return self
+
+    def __bool__(self) -> bool:
+        return bool(self.weekly or self.once)
+
+    def next_after(self, ts: int) -> Optional[int]:
+        """Ближайшее срабатывание строго после ts"""
+        candidates = []
+        if self.weekly_keys:
+            second = _week_second(ts)
+            week_base = ts - second
+            i = bisect_right(self.weekly_keys, second)
+            if i < len(self.weekly_keys):
+                candidates.append(week_base + self.weekly_keys[i])
+            else:
+                candidates.append(week_base + WEEK + self.weekly_keys[0])
+        j = bisect_right(self.once_keys, ts)
+        if j < len(self.once_keys):
+            candidates.append(self.once_keys[j])
+        return min(candidates) if candidates else None
+
+    def items_at(self, ts: int) -> List[Tuple[str, Dict]]:
+        """Напоминания, срабатывающие ровно в ts"""
+        items = []
+        second = _week_second(ts)
+        start, end = bisect_left(self.weekly_keys, second), bisect_right(self.weekly_keys, second)
+        for _, index in self.weekly[start:end]:
+            item = self.schedule[index]
+            # Отмененные пары, праздники, чужая четность недели
+            if self.rules or item.get('weeks') or item.get('skip'):
+                day = datetime.fromtimestamp(ts + item['reminderBefore'] * 60, self.tz).date()
+                if not occurs_on(item, day, self.rules):
+                    continue
+            items.append((SCHEDULE, item))
+        start, end = bisect_left(self.once_keys, ts), bisect_right(self.once_keys, ts)
+        items += [(DEADLINE, self.deadlines[index]) for _, index in self.once[start:end]]
+        return items
+
+
+def iter_occurrences(
+    table: FireTable,
+    after: int,
+    horizon_days: int = 366
+) -> Iterator[Tuple[int, List[Tuple[str, Dict]]]]:
+    """
+    Настоящие срабатывания таблицы после after по порядку: (момент UTC,
+    [(вид, запись)]). Моменты, где все пары отменены (праздник, skip,
+    чужая четность недели), пропускаются; после смены смещения UTC
+    таблица пересчитывается. Не дальше horizon_days дней от after.
+    """
+    end = after + horizon_days * 86400
+    ts = after
+    while True:
+        following = table.next_after(ts)
+        if following is None or following > end:
+            return
+        if following >= table.valid_until:
+            # Смещение UTC сменилось - дальше считаем по новой таблице
+            ts = max(ts, table.valid_until - 1)
+            table = FireTable(
+                table.user_id, table.version, table.schedule, table.deadlines, table.state
+            ).build(ts + 1)
+            continue
+        ts = following
+        items = table.items_at(ts)
+        if items:
+            yield ts, items
+
+
+class ReminderScheduler:
+    """Очередь ближайших срабатываний по всем пользователям"""
+
+    def __init__(self):
+        self._tables: Dict[int, FireTable] = {}
+        # (момент UTC, user_id, версия таблицы); устаревшие записи пропускаются
+        self._heap: List[Tuple[int, int, int]] = []
+        self._versions = itertools.count()
+        # староста -> {участник: места в неделе, занятые личными парами}
+        self._followers: Dict[int, Dict[int, frozenset]] = {}
+        self._following: Dict[int, int] = {}
+        # Пока идет load_all, таблицы старост строятся после обхода всех пользователей
+        self._loading = False
+        # user_id -> до какого момента срабатывания его таблицы уже отправлены:
+        # дайджест окна отправляет будущие напоминания раньше срока, и
+        # перестроенная от now таблица не должна отправить их снова
+        self._sent_through: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def needs(self, user_id: int) -> bool:
+        """
+        Нужна ли процессу таблица пользователя: воркер строит таблицы только
+        своих пользователей и старост, в группах которых есть его пользователи
+        """
+        return owns(user_id) or user_id in self._followers
+
+    def update_user(self, user_id: int, data: Dict[str, Any]):
+        """Перестраивает таблицу пользователя (подписчик изменений хранилища)"""
+        if owns(user_id):
+            self._follow(user_id, data.get('state') or {}, data.get('schedule') or [])
+        if not self.needs(user_id):
+            self._tables.pop(user_id, None)
+            return
+        now = int(time.time())
+        table = FireTable(
+            user_id,
+            next(self._versions),
+            data.get('schedule') or [],
+            data.get('deadlines') or [],
+            data.get('state') or {}
+        ).build(now)
+        if not table:
+            self._tables.pop(user_id, None)
+            return
+        self._tables[user_id] = table
+        self._push(table, max(now, self._sent_through.get(user_id, now)))
+
+    def _follow(self, user_id: int, state: Dict, schedule: List):
+        """Подписывает участника группы на срабатывания таблицы старосты"""
+        previous = self._following.pop(user_id, None)
+        if previous is not None:
+            followers = self._followers.get(previous, {})
+            followers.pop(user_id, None)
+            if not followers:
+                self._followers.pop(previous, None)
+                # Таблица чужого старосты больше не нужна
+                if not owns(previous):
+                    self._tables.pop(previous, None)
+
+        group = user_group(state)
+        if group is None or group.get('owner_id') == user_id:
+            return
+        owner_id = group['owner_id']
+        self._following[user_id] = owner_id
+        self._followers.setdefault(owner_id, {})[user_id] = frozenset(
+            slot(item) for item in schedule if isinstance(item, dict)
+        )
+        if owner_id not in self._tables and not owns(owner_id) and not self._loading:
+            # Староста другого воркера: его таблицу загружаем сами
+            asyncio.get_running_loop().create_task(self._load_owner(owner_id))
+
+    async def _load_owner(self, owner_id: int):
+        try:
+            data = await user_storage.get_user_data(owner_id)
+        except Exception as e:
+            logger.error(f"❌ Не удалось загрузить расписание старосты {owner_id}: {e}")
+            return
+        if owner_id in self._followers and owner_id not in self._tables:
+            self.update_user(owner_id, data)
+
+    def recipients(
+        self,
+        table: FireTable,
+        items: List[Tuple[int, str, Dict]]
+    ) -> List[Tuple[int, List[Tuple[int, str, Dict]]]]:
+        """Кому отправить срабатывания таблицы: владельцу и участникам его группы"""
+        result = [(table.user_id, items)]
+        followers = self._followers.get(table.user_id)
+        if not followers:
+            return result
+        # Участникам - только пары (дедлайны у каждого свои)
+        shared = [entry for entry in items if entry[1] == SCHEDULE]
+        if not shared:
+            return result
+        for member_id, taken in followers.items():
+            member_items = [entry for entry in shared if slot(entry[2]) not in taken]
+            if member_items:
+                result.append((member_id, member_items))
+        return result
+
+    def _push(self, table: FireTable, after: int):
+        ts = table.next_after(after)
+        if ts is not None:
+            heapq.heappush(self._heap, (ts, table.user_id, table.version))
+
+    async def load_all(self):
+        """
+        Строит таблицы для пользователей с парами или дедлайнами: своих и
+        старост их групп (остальных обслуживают другие воркеры)
+        """
+        started = time.perf_counter()
+        # Старосты чужих воркеров - до конца обхода, пока не известны их участники
+        owners: Dict[int, Dict[str, Any]] = {}
+        self._loading = True
+        try:
+            async for user_id, schedule, deadlines, state in Database.iter_reminder_sources():
+                data = {'schedule': schedule, 'deadlines': deadlines, 'state': state}
+                if owns(user_id):
+                    self.update_user(user_id, data)
+                elif user_group(state) is not None and not is_member(user_id, state):
+                    owners[user_id] = data
+        finally:
+            self._loading = False
+        for owner_id, data in owners.items():
+            if owner_id in self._followers:
+                self.update_user(owner_id, data)
+        logger.info(
+            f"⏰ Таблицы напоминаний построены: {len(self._tables)} польз. "
+            f"за {time.perf_counter() - started:.2f} сек"
+        )
+
+    def pop_due(self, now: int, window: int = 1) -> List[Tuple[int, FireTable, List[Tuple[int, str, Dict]]]]:
+        """
+        Забирает все срабатывания не позже now.
+        Срабатывания пользователя из одного окна window секунд склеиваются
+        в одну запись: (начало окна, таблица, [(момент, вид, запись)]).
+        """
+        due = []
+        # Отметки, которые уже в прошлом, ничего не меняют: таблицы строятся от now
+        if self._sent_through:
+            self._sent_through = {
+                user_id: sent for user_id, sent in self._sent_through.items() if sent > now
+            }
+        while self._heap and self._heap[0][0] <= now:
+            ts, user_id, version = heapq.heappop(self._heap)
+            table = self._tables.get(user_id)
+            if table is None or table.version != version:
+                continue
+
+            if ts >= table.valid_until:
+                # Сменилось смещение UTC: пересчитываем таблицу от момента перехода
+                table = self._rebuild(table)
+                continue
+
+            window_start = ts - ts % window
+            window_end = window_start + window
+            items = []
+            last = ts
+            while True:
+                items += [(last, kind, item) for kind, item in table.items_at(last)]
+                following = table.next_after(last)
+                if following is None or following >= window_end or following >= table.valid_until:
+                    break
+                last = following
+            if items:
+                due.append((window_start, table, items))
+            if last > now:
+                self._sent_through[user_id] = last
+            self._push(table, last)
+        return due
+
+    def _rebuild(self, table: FireTable) -> FireTable:
+        transition = table.valid_until
+        table = FireTable(
+            table.user_id, next(self._versions),
+            table.schedule, table.deadlines, table.state
+        ).build(transition)
+        self._tables[table.user_id] = table
+        self._push(table, transition - 1)
+        return table
+
+
+def format_reminder(items: List[Tuple[int, str, Dict]], now: int) -> str:
+    """Текст напоминания (несколько напоминаний окна - одним сообщением)"""
+    lines = []
+    for fire, kind, item in items:
+        # Внутри окна напоминание может уйти раньше: считаем минуты от now
+        minutes = max(0, round((fire - now) / 60) + item.get('reminderBefore', 0))
+        if kind == SCHEDULE:
+            line = f"🔔 Через {minutes} мин. пара: {item.get('className', 'Без названия')} ({item.get('time')})"
+            if item.get('professor'):
+                line += f" - {item['professor']}"
+        else:
+            deadline = parse_deadline(item.get('datetime', ''))
+            when = format_deadline(deadline) if deadline else item.get('datetime')
+            line = f"⏰ Через {minutes} мин. дедлайн: {item.get('name', 'Без названия')} ({when})"
+        lines.append(line)
+    if len(lines) > 1:
+        lines.insert(0, f"📬 Напоминания ({len(lines)}):")
+    return "\n".join(lines)
+
+
+async def _send_reminder(context: ContextTypes.DEFAULT_TYPE, user_id: int, text: str):
+    try:
+        await context.bot.send_message(chat_id=user_id, text=text)
+        usage_stats.reminder_sent()
+    except Forbidden:
+        logger.info(f"🚫 User {user_id} заблокировал бота")
+        # Рассылки таких пользователей пропускают
+        try:
+            await Database.mark_users_blocked([user_id])
+        except DatabaseUnavailable:
+            pass
+    except Exception as e:
+        logger.error(f"❌ Не удалось отправить напоминание user {user_id}: {e}")
+
+
+async def reminder_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: отправляет наступившие напоминания одним пакетом"""
+    now = int(time.time())
+    # Свои пары и пары группы из одного окна - одним сообщением;
+    # (получатель, начало окна) -> {чья таблица: срабатывания}
+    digests: Dict[Tuple[int, int], Dict[int, List[Tuple[int, str, Dict]]]] = {}
+    for window_start, table, items in reminder_scheduler.pop_due(now, DIGEST_WINDOW):
+        for user_id, user_items in reminder_scheduler.recipients(table, items):
+            sources = digests.setdefault((user_id, window_start), {})
+            sources.setdefault(table.user_id, []).extend(user_items)
+
+    batch = []
+    for (user_id, window_start), sources in digests.items():
+        if now - max(entry[0] for items in sources.values() for entry in items) > MAX_LATENESS:
+            continue
+        # Воркер отправляет напоминания только своим пользователям
+        if not owns(user_id):
+            continue
+        # При нескольких репликах напоминание отправляет только одна. Своя
+        # таблица и таблица старосты срабатывают на разных тиках, поэтому
+        # ключ у каждой свой; первый момент (а не окно) в ключе - чтобы
+        # напоминание, добавленное позже в том же окне, не считалось отправленным
+        items = []
+        for source, source_items in sources.items():
+            first = min(entry[0] for entry in source_items)
+            if await shared_cache.claim(f"reminder:{user_id}:{source}:{first}", ttl=2 * MAX_LATENESS):
+                items += source_items
+        if not items:
+            continue
+        items.sort(key=lambda entry: entry[0])
+        batch.append((user_id, format_reminder(items, now)))
+
+    for start in range(0, len(batch), SEND_BATCH_SIZE):
+        await asyncio.gather(*(
+            _send_reminder(context, user_id, text)
+            for user_id, text in batch[start:start + SEND_BATCH_SIZE]
+        ))
+    if len(batch) > 1:
+        logger.info(f"📬 Отправлено напоминаний: {len(batch)}")
+
+
+# Глобальный планировщик напоминаний
+reminder_scheduler = ReminderScheduler()
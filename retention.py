@@ -0,0 +1,89 @@
+"""
+Обслуживание таблицы users: прошедшие дедлайны и неактивные пользователи
+
+Раз в сутки:
+- дедлайны, прошедшие больше DEADLINE_RETENTION_DAYS назад, переносятся
+  из users.deadlines в deadlines_archive;
+- пользователи без изменений дольше ARCHIVE_AFTER_DAYS, которым нечего
+  напоминать (или которые заблокировали бота), переносятся в users_archive.
+  При следующем обращении пользователь возвращается из архива;
+- удаляются id записей журнала, примененных больше APPLIED_WRITES_DAYS назад.
+
+Все изменения идут небольшими порциями в отдельных транзакциях.
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from telegram.ext import ContextTypes
+
+from cache import shared_cache
+from database import Database
+from storage import user_storage
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 180))
+# Запас на разницу часовых поясов: дата дедлайна хранится в местном времени
+DEADLINE_RETENTION_DAYS = int(os.environ.get('DEADLINE_RETENTION_DAYS', 2))
+# Сколько хранить id примененных записей журнала (см. storage)
+APPLIED_WRITES_DAYS = 30
+
+RETENTION_INTERVAL = 24 * 3600
+RETENTION_BATCH_SIZE = 500
+# Пауза между порциями, чтобы не мешать обычным запросам
+BATCH_PAUSE = 0.1
+
+
+async def archive_expired_deadlines(now: datetime) -> int:
+    """Переносит прошедшие дедлайны в архив, возвращает их число"""
+    cutoff = now - timedelta(days=DEADLINE_RETENTION_DAYS)
+    before = f"{cutoff:%Y-%m-%d %H:%M}"
+    total = 0
+    after_user_id = 0
+    while True:
+        user_ids, archived, after_user_id = await Database.archive_expired_deadlines(
+            before, after_user_id, RETENTION_BATCH_SIZE
+        )
+        if after_user_id is None:
+            return total
+        total += archived
+        for user_id in user_ids:
+            await user_storage.forget(user_id)
+        await asyncio.sleep(BATCH_PAUSE)
+
+
+async def archive_idle_users(now: datetime) -> int:
+    """Переносит неактивных пользователей в архив, возвращает их число"""
+    idle_before = now - timedelta(days=ARCHIVE_AFTER_DAYS)
+    total = 0
+    while True:
+        user_ids = await Database.archive_idle_users(idle_before, RETENTION_BATCH_SIZE)
+        total += len(user_ids)
+        for user_id in user_ids:
+            await user_storage.forget(user_id)
+        if len(user_ids) < RETENTION_BATCH_SIZE:
+            return total
+        await asyncio.sleep(BATCH_PAUSE)
+
+
+async def retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача обслуживания (на все реплики - один раз в сутки)"""
+    now = datetime.now(timezone.utc)
+    if not await shared_cache.claim(f"retention:{now:%Y-%m-%d}", ttl=RETENTION_INTERVAL):
+        return
+
+    started = time.perf_counter()
+    try:
+        deadlines = await archive_expired_deadlines(now)
+        users = await archive_idle_users(now)
+        await Database.prune_applied_writes(now - timedelta(days=APPLIED_WRITES_DAYS))
+    except Exception as e:
+        logger.error(f"❌ Ошибка обслуживания БД: {e}")
+        return
+    logger.info(
+        f"🧹 Архив: дедлайнов {deadlines}, пользователей {users} "
+        f"за {time.perf_counter() - started:.1f} сек"
+    )
@@ -0,0 +1,77 @@
+"""
+Маршрутизация нажатий на кнопки reply-клавиатуры
+
+Вместо цепочки MessageHandler(filters.Regex("^...$")), где каждое сообщение
+по очереди проверяется всеми регулярками, подпись кнопки ищется в словаре
+подпись -> обработчик за одно обращение.
+
+Диалоги (ConversationHandler) имеют приоритет для подписей из
+conversation_labels (например, "Отменить"): если активный диалог готов
+принять такое сообщение, маршрутизатор его пропускает, и сообщение
+достается диалогу. Остальные кнопки диалоги не перехватывают - шаги
+диалогов принимают только USER_INPUT, то есть текст, не совпадающий
+ни с одной кнопкой.
+"""
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
+
+from telegram import Message, MessageEntity, Update
+from telegram.ext import BaseHandler, ConversationHandler, filters
+
+from keyboards import BUTTON_LABELS
+
+class _UserInput(filters.MessageFilter):
+    """
+    То же, что filters.TEXT & ~filters.COMMAND, но без подписей кнопок.
+    Одной проверкой вместо трех составных фильтров.
+    """
+
+    __slots__ = ()
+
+    def filter(self, message: Message) -> bool:
+        text = message.text
+        if not text or text in BUTTON_LABELS:
+            return False
+        entities = message.entities
+        return not (
+            entities
+            and entities[0].type == MessageEntity.BOT_COMMAND
+            and entities[0].offset == 0
+        )
+
+
+# Текст, введенный в шаге диалога, но не нажатие на кнопку меню
+USER_INPUT = _UserInput(name="USER_INPUT")
+
+
+class LabelRouter(BaseHandler):
+    """Один обработчик на все кнопки: словарь подпись -> callback"""
+
+    __slots__ = ('routes', 'conversations', 'conversation_labels')
+
+    def __init__(
+        self,
+        routes: Dict[str, Callable],
+        conversations: Sequence[ConversationHandler] = (),
+        conversation_labels: Iterable[str] = ()
+    ):
+        super().__init__(self._dispatch)
+        self.routes = dict(routes)
+        self.conversations = list(conversations)
+        self.conversation_labels = frozenset(conversation_labels)
+
+    def check_update(self, update: object) -> Optional[Callable]:
+        if not isinstance(update, Update) or update.message is None:
+            return None
+        callback = self.routes.get(update.message.text)
+        if callback is None:
+            return None
+        if update.message.text not in self.conversation_labels:
+            return callback
+        for conversation in self.conversations:
+            check = conversation.check_update(update)
+            if check is not None and check is not False:
+                return None
+        return callback
+
+    async def _dispatch(self, update: Update, context) -> Any:
+        return await self.routes[update.message.text](update, context)
@@ -0,0 +1,173 @@
+"""
+Поиск по расписанию и дедлайнам (/find)
+
+Запись найдена, если в ее тексте (название и преподаватель пары, название
+и описание дедлайна) встречаются все слова запроса. Длинные слова
+сравниваются без последних букв, чтобы "курсовую" находила "курсовая".
+
+Если данные пользователя уже в памяти (обычный случай - он только что
+работал с ботом), поиск идет по индексу в памяти: нормализованные тексты
+записей, которые пересобираются только после изменения данных. Иначе
+записи отбирает БД, и в процесс попадают только найденные. Участникам
+группы и при недоступной БД поиск идет в памяти.
+"""
+import re
+from collections import OrderedDict
+from itertools import chain, repeat
+from typing import Any, Dict, List, NamedTuple, Tuple
+
+from callback_data import KIND_SCHEDULE, KIND_DEADLINES
+from database import Database, DatabaseUnavailable
+from groups import group_timetables, slot, user_group
+from storage import user_storage
+
+# Сколько результатов показывать
+MAX_RESULTS = 20
+# Слова запроса короче этого не учитываются
+MIN_TERM_LENGTH = 2
+# У слов длиннее этого отбрасываются окончания (но не короче MIN_STEM_LENGTH)
+STEM_FROM_LENGTH = 5
+MIN_STEM_LENGTH = 4
+# Для скольких пользователей держать индекс в памяти
+MAX_INDEXES = 4096
+
+_WORD = re.compile(r'\w+')
+
+# Поля записей, по которым идет поиск
+SEARCH_FIELDS = {
+    KIND_SCHEDULE: ('className', 'professor'),
+    KIND_DEADLINES: ('name', 'description'),
+}
+
+
+class Match(NamedTuple):
+    kind: int
+    item: Dict[str, Any]
+    # False - пара из расписания группы
+    own: bool = True
+
+
+def normalize(text: str) -> str:
+    return text.lower().replace('ё', 'е')
+
+
+def query_terms(query: str) -> List[str]:
+    """Основы слов запроса без повторов"""
+    terms = []
+    for word in _WORD.findall(normalize(query)):
+        if len(word) < MIN_TERM_LENGTH:
+            continue
+        if len(word) > STEM_FROM_LENGTH:
+            word = word[:max(MIN_STEM_LENGTH, len(word) - 2)]
+        if word not in terms:
+            terms.append(word)
+    return terms
+
+
+def _document(kind: int, item: Any) -> str:
+    if not isinstance(item, dict):
+        return ''
+    return normalize(' '.join(
+        str(item[field]) for field in SEARCH_FIELDS[kind] if item.get(field)
+    ))
+
+
+def _documents(kind: int, items: List) -> List[str]:
+    return [_document(kind, item) for item in items]
+
+
+class SearchIndexes:
+    """Нормализованные тексты записей по пользователям"""
+
+    def __init__(self, max_users: int = MAX_INDEXES):
+        self._max_users = max_users
+        # user_id -> (тексты личных пар, тексты дедлайнов)
+        self._users: "OrderedDict[int, Tuple[List[str], List[str]]]" = OrderedDict()
+        # Расписание группы -> его тексты (последнее, по объекту расписания)
+        self._timetables: Dict[int, Tuple[List, List[str]]] = {}
+
+    def on_user_change(self, user_id: int, data: Dict[str, Any]):
+        """Подписчик хранилища: данные изменились - индекс пересоберется при поиске"""
+        self._users.pop(user_id, None)
+
+    def _user_documents(self, user_id: int, data: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+        schedule = data.get('schedule') or []
+        deadlines = data.get('deadlines') or []
+        documents = self._users.get(user_id)
+        # Длина не совпала - данные изменены, но еще не сохранены
+        if documents is None or (len(documents[0]), len(documents[1])) != (len(schedule), len(deadlines)):
+            documents = (_documents(KIND_SCHEDULE, schedule), _documents(KIND_DEADLINES, deadlines))
+            self._users[user_id] = documents
+            if len(self._users) > self._max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return documents
+
+    def _timetable_documents(self, group_id: int, timetable: List) -> List[str]:
+        # Расписание группы в памяти не меняется, новая версия - новый объект
+        cached = self._timetables.get(group_id)
+        if cached is None or cached[0] is not timetable:
+            cached = self._timetables[group_id] = (timetable, _documents(KIND_SCHEDULE, timetable))
+        return cached[1]
+
+    async def search(self, user_id: int, data: Dict[str, Any], terms: List[str]) -> List[Match]:
+        """Поиск по данным пользователя в памяти"""
+        schedule = data.get('schedule') or []
+        deadlines = data.get('deadlines') or []
+        schedule_docs, deadline_docs = self._user_documents(user_id, data)
+        entries = [
+            zip(repeat(KIND_SCHEDULE), schedule, schedule_docs, repeat(True)),
+        ]
+
+        group = user_group(data.get('state'))
+        if group is not None and group.get('owner_id') != user_id:
+            try:
+                timetable = await group_timetables.timetable(group['id'])
+            except DatabaseUnavailable:
+                timetable = group_timetables.cached_timetable(group['id']) or []
+            # Пары группы идут за личными и не показываются, если их место занято личной
+            taken = {slot(item) for item in schedule if isinstance(item, dict)}
+            entries.append(
+                (KIND_SCHEDULE, item, document, False)
+                for item, document in zip(timetable, self._timetable_documents(group['id'], timetable))
+                if isinstance(item, dict) and slot(item) not in taken
+            )
+        entries.append(zip(repeat(KIND_DEADLINES), deadlines, deadline_docs, repeat(True)))
+
+        matches = []
+        for kind, item, document, own in chain.from_iterable(entries):
+            if document and all(term in document for term in terms):
+                matches.append(Match(kind, item, own))
+                if len(matches) >= MAX_RESULTS:
+                    break
+        return matches
+
+
+def _like_pattern(term: str) -> str:
+    return '%' + term.replace('\\', '\\\\').replace('_', '\\_').replace('%', '\\%') + '%'
+
+
+async def find_items(user_id: int, query: str) -> List[Match]:
+    """Записи пользователя, подходящие под запрос (не больше MAX_RESULTS)"""
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    data = user_storage.peek(user_id)
+    if data is None:
+        try:
+            found = await Database.search_user_items(
+                user_id, [_like_pattern(term) for term in terms], MAX_RESULTS
+            )
+        except DatabaseUnavailable:
+            found = None
+        if found is not None and not found[1]:
+            return [Match(kind, item) for kind, _, item in found[0]]
+        # Участник группы (или БД недоступна): нужны полные данные
+        data = await user_storage.get_user_data(user_id)
+    return await search_indexes.search(user_id, data, terms)
+
+
+# Глобальные индексы поиска
+search_indexes = SearchIndexes()
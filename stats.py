@@ -0,0 +1,290 @@
+"""
+Статистика использования без записи в БД на каждое обновление
+
+Процесс считает в памяти по часам: обновления, активных пользователей
+(HyperLogLog - 4 КБ на час при любом числе пользователей), добавленные
+пары и дедлайны, отправленные напоминания и гистограммы времени
+обработки по маршрутам (команда, кнопка, вид callback). Раз в минуту
+текущие часы записываются одним upsert в stats_hourly - строка на
+(час, процесс) с абсолютными значениями, поэтому повтор записи ничего не
+портит. /stats объединяет строки всех процессов: счетчики складываются,
+скетчи пользователей объединяются (максимум по регистрам).
+"""
+import math
+import time
+import uuid
+import logging
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from callback_data import CALLBACK_PREFIX
+from database import Database, DatabaseUnavailable
+from keyboards import BUTTON_LABELS
+
+logger = logging.getLogger(__name__)
+
+STATS_INTERVAL = 60
+# Точность HyperLogLog: 2^HLL_PRECISION регистров, ошибка около 1.6%
+HLL_PRECISION = 12
+# Границы корзин гистограммы времени обработки (миллисекунды)
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Сколько часов хранить в памяти, если БД недоступна
+MAX_UNFLUSHED_HOURS = 48
+# Команды бота со своим маршрутом; остальные "/..." идут в общий 'command',
+# иначе каждая опечатка стала бы отдельным ключом в stats_hourly
+COMMAND_ROUTES = frozenset({
+    'start', 'help', 'reset', 'add', 'calendar', 'timezone', 'holiday',
+    'semester', 'broadcast', 'group', 'find', 'stats', 'cancel',
+})
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix64(value: int) -> int:
+    """64-битное перемешивание (splitmix64): id пользователей идут подряд"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return value ^ (value >> 31)
+
+
+class HyperLogLog:
+    """Оценка числа различных пользователей по фиксированному объему памяти"""
+
+    __slots__ = ('registers',)
+
+    SIZE = 1 << HLL_PRECISION
+
+    def __init__(self, registers: Optional[bytes] = None):
+        if registers is not None and len(registers) == self.SIZE:
+            self.registers = bytearray(registers)
+        else:
+            self.registers = bytearray(self.SIZE)
+
+    def add(self, value: int):
+        hashed = _mix64(value)
+        index = hashed >> (64 - HLL_PRECISION)
+        rest = (hashed << HLL_PRECISION) & _MASK64
+        rank = 64 - rest.bit_length() + 1 if rest else 64 - HLL_PRECISION + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        size = self.SIZE
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # Малые значения точнее дает линейный подсчет
+            estimate = size * math.log(size / zeros)
+        return round(estimate)
+
+
+class HourStats:
+    """Счетчики одного часа"""
+
+    __slots__ = (
+        'hour', 'updates', 'users', 'schedule_added', 'deadlines_added',
+        'reminders_sent', 'latency'
+    )
+
+    def __init__(self, hour: int):
+        self.hour = hour
+        self.updates = 0
+        self.users = HyperLogLog()
+        self.schedule_added = 0
+        self.deadlines_added = 0
+        self.reminders_sent = 0
+        # маршрут -> [число, сумма мс, корзины...]
+        self.latency: Dict[str, List[float]] = {}
+
+    def record_latency(self, route: str, milliseconds: float):
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = [0, 0.0] + [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        histogram[0] += 1
+        histogram[1] += milliseconds
+        histogram[2 + bisect_left(LATENCY_BUCKETS_MS, milliseconds)] += 1
+
+
+def update_route(update: Update) -> str:
+    """Маршрут обновления для гистограмм: команда, кнопка или вид callback"""
+    message = update.message
+    if message is not None:
+        text = message.text
+        if text:
+            if text.startswith('/'):
+                command = text.split(maxsplit=1)[0].split('@')[0].lower()
+                return command if command[1:] in COMMAND_ROUTES else 'command'
+            if text in BUTTON_LABELS:
+                return text
+            return 'text'
+        if message.document is not None:
+            return 'document'
+        return 'message'
+    if update.callback_query is not None:
+        data = update.callback_query.data or ''
+        if data.startswith(CALLBACK_PREFIX):
+            return 'callback:list'
+        return 'callback:' + data.split('_', 1)[0]
+    return 'other'
+
+
+def percentile(histogram: List[float], share: float) -> Optional[int]:
+    """Верхняя граница корзины, в которую попадает доля share обновлений"""
+    total = histogram[0]
+    if not total:
+        return None
+    needed = total * share
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS_MS + (None,), histogram[2:]):
+        seen += count
+        if seen >= needed:
+            return bound
+    return None
+
+
+class UsageStats:
+    """Счетчики процесса по часам и их запись в БД"""
+
+    def __init__(self):
+        self.instance_id = uuid.uuid4().hex[:12]
+        self._hours: Dict[int, HourStats] = {}
+
+    def _current(self) -> HourStats:
+        hour = int(time.time()) // 3600 * 3600
+        stats = self._hours.get(hour)
+        if stats is None:
+            stats = self._hours[hour] = HourStats(hour)
+            # Пока БД недоступна, старые часы копятся - самые старые теряются
+            while len(self._hours) > MAX_UNFLUSHED_HOURS:
+                del self._hours[min(self._hours)]
+        return stats
+
+    def record_update(self, user_id: Optional[int], route: str, seconds: float):
+        stats = self._current()
+        stats.updates += 1
+        if user_id is not None:
+            stats.users.add(user_id)
+        stats.record_latency(route, seconds * 1000)
+
+    def entries_added(self, schedule: int = 0, deadlines: int = 0):
+        stats = self._current()
+        stats.schedule_added += schedule
+        stats.deadlines_added += deadlines
+
+    def reminder_sent(self):
+        self._current().reminders_sent += 1
+
+    async def flush(self) -> bool:
+        """Записывает все накопленные часы; завершенные часы после записи забываются"""
+        if not self._hours:
+            return True
+        current = self._current().hour
+        rows = [
+            (
+                datetime.fromtimestamp(stats.hour, timezone.utc), self.instance_id,
+                stats.updates, bytes(stats.users.registers), stats.schedule_added,
+                stats.deadlines_added, stats.reminders_sent, stats.latency
+            )
+            for stats in self._hours.values()
+        ]
+        if not await Database.save_stats_rollups(rows):
+            return False
+        for hour in [hour for hour in self._hours if hour < current]:
+            del self._hours[hour]
+        return True
+
+
+async def stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: запись счетчиков в stats_hourly"""
+    try:
+        await usage_stats.flush()
+    except DatabaseUnavailable as e:
+        logger.debug(f"Статистика не записана, повтор через минуту: {e}")
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Объединяет строки stats_hourly разных процессов: итоги по часам,
+    активные пользователи по дням (UTC) и время обработки по маршрутам
+    """
+    hours: Dict[datetime, Dict[str, Any]] = {}
+    days: Dict[str, HyperLogLog] = {}
+    routes: Dict[str, List[float]] = {}
+    for row in rows:
+        hour = hours.setdefault(row['hour'], {
+            'updates': 0, 'users': HyperLogLog(), 'schedule_added': 0,
+            'deadlines_added': 0, 'reminders_sent': 0, 'latency': [],
+        })
+        sketch = HyperLogLog(row['users'])
+        hour['users'].merge(sketch)
+        days.setdefault(f"{row['hour']:%Y-%m-%d}", HyperLogLog()).merge(sketch)
+        for key in ('updates', 'schedule_added', 'deadlines_added', 'reminders_sent'):
+            hour[key] += row[key]
+        for route, histogram in (row['latency'] or {}).items():
+            total = routes.get(route)
+            if total is None:
+                routes[route] = list(histogram)
+            else:
+                routes[route] = [a + b for a, b in zip(total, histogram)]
+            hour['latency'].append(histogram)
+
+    for hour in hours.values():
+        merged: List[float] = []
+        for histogram in hour.pop('latency'):
+            merged = [a + b for a, b in zip(merged, histogram)] if merged else list(histogram)
+        hour['p95'] = percentile(merged, 0.95) if merged else None
+        hour['users'] = hour['users'].count()
+    return {
+        'hours': dict(sorted(hours.items())),
+        'days': {day: sketch.count() for day, sketch in sorted(days.items())},
+        'routes': routes,
+    }
+
+
+def format_stats(summary: Dict[str, Any], last_hours: int = 24) -> str:
+    """Текст ответа /stats"""
+    if not summary['hours']:
+        return "📊 Статистики пока нет."
+
+    lines = ["📊 Статистика (время UTC)", "", "Активные пользователи по дням:"]
+    for day, users in summary['days'].items():
+        lines.append(f"  {day}: ~{users}")
+
+    lines += [
+        "", f"По часам (последние {last_hours}):",
+        "  час: обновления / пользователи / +пары / +дедлайны / напоминания / p95",
+    ]
+    for hour, row in list(summary['hours'].items())[-last_hours:]:
+        p95 = f"≤{row['p95']} мс" if row['p95'] else "-"
+        lines.append(
+            f"  {hour:%d.%m %H}:00: {row['updates']} / ~{row['users']} / "
+            f"+{row['schedule_added']} / +{row['deadlines_added']} / {row['reminders_sent']} / {p95}"
+        )
+
+    slowest: List[Tuple[float, str, List[float]]] = sorted(
+        ((histogram[1] / histogram[0], route, histogram)
+         for route, histogram in summary['routes'].items() if histogram[0]),
+        reverse=True
+    )[:10]
+    if slowest:
+        lines += ["", "Время обработки по маршрутам (среднее / p95):"]
+        for average, route, histogram in slowest:
+            p95 = percentile(histogram, 0.95)
+            lines.append(
+                f"  {route}: {average:.0f} мс / {'≤' + str(p95) if p95 else '>' + str(LATENCY_BUCKETS_MS[-1])} мс "
+                f"(n={histogram[0]:.0f})"
+            )
+    return "\n".join(lines)
+
+
+# Глобальные счетчики процесса
+usage_stats = UsageStats()
@@ -1,10 +1,30 @@
 """
 Хранилище состояний пользователей с блокировками
 """
+import os
+import uuid
 import asyncio
-from typing import List, Dict, Any, Optional
+import logging
+from collections import deque
+from typing import List, Dict, Any, Optional, Callable, Deque, Tuple
 from datetime import datetime, timedelta
-from database import Database
+from database import Database, DatabaseUnavailable
+from cache import shared_cache
+from journal import WriteAheadJournal
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей можно отложить, пока БД недоступна
+MAX_PENDING_WRITES = 10_000
+# Пауза между попытками дописать отложенные записи (секунды)
+REPLAY_INTERVAL = 5
+# Файл журнала отложенных записей (на Railway - путь на подключенном volume)
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', 'pending_writes.journal')
+
+# Виды операций записи
+OP_SAVE = 'save'
+OP_APPEND = 'append'
+OP_STATE = 'state'
 
 class UserStateStorage:
     """Потокобезопасное хранилище состояний пользователей"""
@@ -15,6 +35,14 @@ class UserStateStorage:
         self._cache: Dict[int, Dict[str, Any]] = {}
         self._cache_ttl = timedelta(minutes=5)
         self._cache_timestamps: Dict[int, datetime] = {}
+        self._listeners: List[Callable[[int, Dict[str, Any]], None]] = []
+        self._remote_filter: Optional[Callable[[int], bool]] = None
+        # Записи, отложенные пока БД недоступна: (операция, user_id, данные)
+        self._journal: Deque[Tuple[str, int, Dict[str, Any]]] = deque()
+        self._pending: Dict[int, int] = {}
+        self._replay_task: Optional[asyncio.Task] = None
+        # Копия отложенных записей на диске (открывается в recover_journal)
+        self._wal: Optional[WriteAheadJournal] = None
     
     async def _get_user_lock(self, user_id: int) -> asyncio.Lock:
         """Получаем блокировку для конкретного пользователя"""
@@ -23,20 +51,127 @@ class UserStateStorage:
                 self._user_locks[user_id] = asyncio.Lock()
             return self._user_locks[user_id]
     
-    async def get_user_data(self, user_id: int) -> Dict[str, Any]:
-        """Получаем данные пользователя с блокировкой"""
-        # Проверяем кэш
+    async def start(self):
+        """Подключаем общий кэш (если настроен REDIS_URL)"""
+        await shared_cache.connect(on_invalidate=self._on_remote_change)
+    
+    async def close(self):
+        """Дописываем отложенные записи (если БД уже доступна) и отключаем общий кэш"""
+        if self._replay_task:
+            self._replay_task.cancel()
+        if self._journal:
+            try:
+                await self.replay_pending()
+            except Exception as e:
+                logger.error(f"❌ Не удалось дописать отложенные записи: {e}")
+            if self._journal:
+                logger.warning(
+                    f"⚠️ Отложенных записей: {len(self._journal)}, "
+                    "они будут дописаны из журнала при следующем запуске"
+                )
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+        await shared_cache.close()
+    
+    def invalidate_local(self, user_id: int):
+        """Сбрасывает L1-кэш пользователя (данные изменил другой процесс)"""
+        self._cache.pop(user_id, None)
+        self._cache_timestamps.pop(user_id, None)
+    
+    def _on_remote_change(self, user_id: int):
+        """Данные пользователя изменил другой процесс"""
+        self.invalidate_local(user_id)
+        # Чужих пользователей не перечитываем: подписчикам они не нужны
+        if self._remote_filter is None or self._remote_filter(user_id):
+            self._notify_later(user_id)
+    
+    def set_remote_filter(self, predicate: Callable[[int], bool]):
+        """Каких пользователей перечитывать для подписчиков после изменений в других процессах"""
+        self._remote_filter = predicate
+    
+    async def invalidate(self, user_id: int):
+        """Сбрасывает кэши пользователя во всех процессах"""
+        self.invalidate_local(user_id)
+        await shared_cache.invalidate(user_id)
+        self._notify_later(user_id)
+    
+    async def forget(self, user_id: int):
+        """Сбрасывает кэши без перечитывания (изменились только прошедшие данные)"""
+        self.invalidate_local(user_id)
+        await shared_cache.invalidate(user_id)
+    
+    def add_change_listener(self, listener: Callable[[int, Dict[str, Any]], None]):
+        """Подписка на изменения данных пользователя (расписание, дедлайны, state)"""
+        self._listeners.append(listener)
+    
+    def _notify(self, user_id: int, data: Dict[str, Any]):
+        """Сообщает подписчикам о новых данных пользователя"""
+        for listener in self._listeners:
+            try:
+                listener(user_id, data)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в подписчике изменений user {user_id}: {e}")
+    
+    def _notify_later(self, user_id: int):
+        """Перечитывает данные и оповещает подписчиков в фоне"""
+        if not self._listeners:
+            return
+        
+        async def reload():
+            self._notify(user_id, await self.get_user_data(user_id))
+        
+        asyncio.get_running_loop().create_task(reload())
+    
+    async def apply_state_patch(self, user_id: int, values: Dict, removed: List[str]):
+        """Применяет к кэшу изменения state, уже записанные в БД"""
+        if user_id in self._cache:
+            state = dict(self._cache[user_id]['state'])
+            for key in removed:
+                state.pop(key, None)
+            state.update(values)
+            self._cache[user_id]['state'] = state
+        await shared_cache.invalidate(user_id)
+    
+    def _remember(self, user_id: int, data: Dict[str, Any]):
+        """Кладет данные в L1-кэш"""
+        self._cache[user_id] = data.copy()
+        self._cache_timestamps[user_id] = datetime.now()
+    
+    def peek(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Данные из L1-кэша без обращения к БД (None, если их там нет или они устарели)"""
         if user_id in self._cache:
-            if datetime.now() - self._cache_timestamps[user_id] < self._cache_ttl:
+            fresh = datetime.now() - self._cache_timestamps[user_id] < self._cache_ttl
+            if fresh or user_id in self._pending:
                 return self._cache[user_id].copy()
+        return None
+    
+    async def get_user_data(self, user_id: int) -> Dict[str, Any]:
+        """Получаем данные пользователя с блокировкой"""
+        # Проверяем кэш (с отложенными записями кэш новее БД)
+        cached = self.peek(user_id)
+        if cached is not None:
+            return cached
         
         # Блокируем по пользователю
         user_lock = await self._get_user_lock(user_id)
         async with user_lock:
-            data = await Database.load_user_data(user_id)
+            try:
+                # Общий кэш других реплик
+                data, version = await shared_cache.get_versioned(user_id)
+                if data is None:
+                    data = await Database.load_user_data(user_id)
+                    # Чтение идет без блокировки записи: кладем в L2, только если
+                    # никто не записал данные, пока мы читали из БД
+                    await shared_cache.populate(user_id, data, version)
+            except DatabaseUnavailable:
+                # БД недоступна: отдаем устаревшие данные, если они есть
+                if user_id in self._cache:
+                    logger.warning(f"⚠️ БД недоступна, user {user_id} получает данные из кэша")
+                    return self._cache[user_id].copy()
+                raise
             # Кэшируем
-            self._cache[user_id] = data.copy()
-            self._cache_timestamps[user_id] = datetime.now()
+            self._remember(user_id, data)
             return data
     
     async def update_user_data(
@@ -47,53 +182,194 @@ class UserStateStorage:
         state: Optional[Dict] = None
     ) -> bool:
         """Обновляем данные пользователя с блокировкой"""
+        fields = {
+            key: value
+            for key, value in (('schedule', schedule), ('deadlines', deadlines), ('state', state))
+            if value is not None
+        }
+        return await self._write(OP_SAVE, user_id, fields)
+    
+    async def append_schedule(self, user_id: int, entries: List[Dict]) -> bool:
+        """Добавляет пары в расписание без перезаписи остальных данных"""
+        return await self._write(OP_APPEND, user_id, {'entries': entries})
+    
+    async def update_user_state(self, user_id: int, **kwargs) -> bool:
+        """Обновляет только состояние пользователя"""
+        return await self._write(OP_STATE, user_id, kwargs)
+    
+    # ==================== ЗАПИСЬ И ОТЛОЖЕННЫЕ ЗАПИСИ ====================
+    
+    async def _write(self, op: str, user_id: int, payload: Dict[str, Any]) -> bool:
+        """Пишет в БД, а если она недоступна - откладывает запись"""
         user_lock = await self._get_user_lock(user_id)
-        async with user_lock:
-            # Загружаем текущие данные
+        async with user_lock, shared_cache.lock(user_id):
+            # Пока у пользователя есть отложенные записи, новые встают за ними,
+            # чтобы сохранить порядок; записи остальных идут в БД сразу
+            if not self._pending.get(user_id):
+                try:
+                    return await self._apply(op, user_id, payload)
+                except DatabaseUnavailable as e:
+                    logger.warning(f"⚠️ Запись user {user_id} отложена: {e}")
+            return await self._defer(op, user_id, payload)
+    
+    async def _apply(
+        self,
+        op: str,
+        user_id: int,
+        payload: Dict[str, Any],
+        refresh_cache: bool = True
+    ) -> bool:
+        """Выполняет операцию записи в БД и обновляет кэши"""
+        if op == OP_SAVE:
+            # Загружаем текущие данные и обновляем только указанные поля
             current_data = await Database.load_user_data(user_id)
+            new_data = {key: payload.get(key, current_data[key]) for key in ('schedule', 'deadlines', 'state')}
             
-            # Обновляем только указанные поля
-            new_schedule = schedule if schedule is not None else current_data['schedule']
-            new_deadlines = deadlines if deadlines is not None else current_data['deadlines']
-            new_state = state if state is not None else current_data['state']
-            
-            # Сохраняем
             success = await Database.save_user_data(
-                user_id, 
-                new_schedule, 
-                new_deadlines, 
-                new_state
+                user_id,
+                new_data['schedule'],
+                new_data['deadlines'],
+                new_data['state']
             )
-            
-            if success:
-                # Обновляем кэш
-                self._cache[user_id] = {
-                    'schedule': new_schedule,
-                    'deadlines': new_deadlines,
-                    'state': new_state
-                }
-                self._cache_timestamps[user_id] = datetime.now()
-            
+            if success and refresh_cache:
+                self._remember(user_id, new_data)
+                await shared_cache.set(user_id, new_data)
+                self._notify(user_id, new_data)
+            elif success:
+                await shared_cache.invalidate(user_id)
             return success
-    
-    async def update_user_state(self, user_id: int, **kwargs) -> bool:
-        """Обновляет только состояние пользователя"""
-        user_lock = await self._get_user_lock(user_id)
-        async with user_lock:
-            # Получаем текущее состояние
-            current_state = await Database.get_user_state(user_id)
-            
-            # Обновляем поля
-            current_state.update(kwargs)
-            
-            # Сохраняем
-            success = await Database.update_user_state(user_id, current_state)
-            
-            if success and user_id in self._cache:
+        
+        if op == OP_APPEND:
+            # id есть только у записей из журнала (в старых журналах его нет)
+            success = await Database.append_schedule_entries(
+                user_id, payload['entries'], payload.get('id')
+            )
+            if success and refresh_cache:
+                await self.invalidate(user_id)
+            elif success:
+                await shared_cache.invalidate(user_id)
+            return success
+        
+        # OP_STATE: получаем текущее состояние и обновляем поля
+        current_state = await Database.get_user_state(user_id)
+        current_state.update(payload)
+        success = await Database.update_user_state(user_id, current_state)
+        if success:
+            if refresh_cache and user_id in self._cache:
                 self._cache[user_id]['state'] = current_state.copy()
                 self._cache_timestamps[user_id] = datetime.now()
+            await shared_cache.invalidate(user_id)
+            if refresh_cache:
+                self._notify_later(user_id)
+        return success
+    
+    async def _defer(self, op: str, user_id: int, payload: Dict[str, Any]) -> bool:
+        """
+        Откладывает запись до восстановления БД (сразу видна в L1-кэше).
+        Подтверждается только после записи в журнал на диске.
+        """
+        if len(self._journal) >= MAX_PENDING_WRITES:
+            raise DatabaseUnavailable("очередь отложенных записей переполнена")
+        
+        if op == OP_APPEND:
+            # Добавление не идемпотентно: по id БД узнает уже примененную запись
+            payload = {**payload, 'id': uuid.uuid4().hex}
+        self._journal.append((op, user_id, payload))
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        self._apply_to_cache(op, user_id, payload)
+        
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.get_running_loop().create_task(self._replay_loop())
+        
+        if self._wal is not None:
+            try:
+                await self._wal.append([op, user_id, payload])
+            except OSError as e:
+                # Запись уже в очереди в памяти: отказ привел бы к повтору и дублю
+                logger.error(f"❌ Журнал недоступен, запись user {user_id} только в памяти: {e}")
+        return True
+    
+    async def recover_journal(self, path: str = JOURNAL_PATH) -> int:
+        """
+        Открывает журнал на диске и дописывает в БД записи, оставшиеся
+        после аварийной остановки. Возвращает число восстановленных записей.
+        """
+        wal = WriteAheadJournal(path)
+        records = await asyncio.get_running_loop().run_in_executor(None, wal.open)
+        self._wal = wal
+        
+        for op, user_id, payload in records:
+            self._journal.append((op, user_id, payload))
+            self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        if not records:
+            return 0
+        
+        logger.info(f"📼 В журнале найдено отложенных записей: {len(records)}")
+        await self.replay_pending()
+        if self._journal and (self._replay_task is None or self._replay_task.done()):
+            self._replay_task = asyncio.get_running_loop().create_task(self._replay_loop())
+        return len(records)
+    
+    def _apply_to_cache(self, op: str, user_id: int, payload: Dict[str, Any]):
+        """Применяет отложенную запись к L1-кэшу, чтобы пользователь ее видел"""
+        if user_id in self._cache:
+            data = dict(self._cache[user_id])
+        elif op == OP_SAVE and len(payload) == 3:
+            data = {}
+        else:
+            return
+        
+        if op == OP_SAVE:
+            data.update(payload)
+        elif op == OP_APPEND:
+            data['schedule'] = list(data['schedule']) + payload['entries']
+        else:
+            data['state'] = {**data['state'], **payload}
+        self._remember(user_id, data)
+        self._notify(user_id, data)
+    
+    async def _replay_loop(self):
+        """Периодически пытается дописать отложенные записи"""
+        while self._journal:
+            await asyncio.sleep(REPLAY_INTERVAL)
+            try:
+                await self.replay_pending()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи отложенных изменений: {e}")
+    
+    async def replay_pending(self) -> int:
+        """Дописывает отложенные записи в БД по порядку, возвращает их число"""
+        replayed = 0
+        while self._journal:
+            op, user_id, payload = self._journal[0]
+            user_lock = await self._get_user_lock(user_id)
+            try:
+                async with user_lock, shared_cache.lock(user_id):
+                    # Кэш уже содержит эту и следующие записи пользователя
+                    last = self._pending.get(user_id, 0) <= 1
+                    success = await self._apply(op, user_id, payload, refresh_cache=last)
+            except DatabaseUnavailable:
+                break
             
-            return success
+            if not success:
+                logger.error(f"❌ Отложенная запись user {user_id} ({op}) не применилась и отброшена")
+            self._journal.popleft()
+            left = self._pending.pop(user_id, 1) - 1
+            if left > 0:
+                self._pending[user_id] = left
+            replayed += 1
+        
+        if replayed:
+            logger.info(f"💾 Дописаны отложенные записи: {replayed}, осталось {len(self._journal)}")
+        if not self._journal and self._wal is not None:
+            # Контрольная точка: все записи журнала уже в БД
+            await self._wal.truncate()
+        return replayed
+    
+    @property
+    def pending_writes(self) -> int:
+        """Сколько записей ждут восстановления БД"""
+        return len(self._journal)
     
     async def get_user_state_value(self, user_id: int, key: str, default=None):
         """Получает конкретное значение из состояния"""
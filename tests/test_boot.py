@@ -0,0 +1,45 @@
+import asyncio
+
+import bot
+
+
+def test_database_down_at_boot_still_starts_cache_and_reminders(monkeypatch):
+    calls = []
+    attempts = {'init': 0}
+
+    async def init_database():
+        attempts['init'] += 1
+        calls.append('init')
+        if attempts['init'] < 3:
+            raise OSError("connection refused")
+        return False
+
+    async def recover_journal():
+        return 0
+
+    async def start():
+        calls.append('cache')
+
+    async def load_all():
+        calls.append('load')
+
+    listeners = []
+    monkeypatch.setattr(bot.Database, 'init_database', init_database)
+    monkeypatch.setattr(bot.user_storage, 'recover_journal', recover_journal)
+    monkeypatch.setattr(bot.user_storage, 'start', start)
+    monkeypatch.setattr(bot.user_storage, 'add_change_listener', listeners.append)
+    monkeypatch.setattr(bot.user_storage, 'set_remote_filter', lambda predicate: None)
+    monkeypatch.setattr(bot.reminder_scheduler, 'load_all', load_all)
+    monkeypatch.setattr(bot, 'REMINDERS_RETRY_INTERVAL', 0)
+
+    async def scenario():
+        db_ok = await bot.init_storage({})
+        await asyncio.wait_for(bot._reminders_task, 1)
+        return db_ok
+
+    assert asyncio.run(scenario()) is False
+    assert 'cache' in calls
+    assert bot.reminder_scheduler.update_user in listeners
+    assert bot.group_timetables.on_user_change in listeners
+    # Схема применяется после восстановления БД, затем строятся таблицы
+    assert calls[-2:] == ['init', 'load'] and attempts['init'] == 3
@@ -0,0 +1,113 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import storage
+from cache import SharedCache
+from storage import UserStateStorage
+
+OLD = {'schedule': [], 'deadlines': [], 'state': {'v': 1}}
+NEW = {'schedule': [], 'deadlines': [], 'state': {'v': 2}}
+
+
+async def connected(server, invalidated=None):
+    cache = SharedCache()
+    await cache.connect(
+        on_invalidate=(invalidated.append if invalidated is not None else lambda user_id: None),
+        client=fakeredis.aioredis.FakeRedis(server=server)
+    )
+    return cache
+
+
+def run(scenario):
+    return asyncio.run(scenario(fakeredis.FakeServer()))
+
+
+def test_populate_fills_empty_key_without_broadcast():
+    async def scenario(server):
+        received = []
+        reader, other = await connected(server), await connected(server, received)
+        data, version = await reader.get_versioned(1)
+        assert data is None
+        assert await reader.populate(1, OLD, version)
+        await asyncio.sleep(1.2)
+        result = (await other.get_versioned(1))[0], received
+        await reader.close()
+        await other.close()
+        return result
+
+    data, received = run(scenario)
+    assert data == OLD
+    assert received == []
+
+
+def test_populate_does_not_overwrite_newer_write():
+    async def scenario(server):
+        reader, writer = await connected(server), await connected(server)
+        _, version = await reader.get_versioned(1)
+        # Пока читатель ходил в БД, другая реплика записала новые данные
+        await writer.set(1, NEW)
+        stored = await reader.populate(1, OLD, version)
+        result = stored, (await reader.get_versioned(1))[0]
+        await reader.close()
+        await writer.close()
+        return result
+
+    assert run(scenario) == (False, NEW)
+
+
+def test_populate_after_concurrent_invalidation_is_skipped():
+    async def scenario(server):
+        reader, writer = await connected(server), await connected(server)
+        await writer.set(1, OLD)
+        await writer.invalidate(1)
+        _, version = await reader.get_versioned(1)
+        await writer.invalidate(1)
+        stored = await reader.populate(1, OLD, version)
+        result = stored, (await reader.get_versioned(1))[0]
+        await reader.close()
+        await writer.close()
+        return result
+
+    assert run(scenario) == (False, None)
+
+
+def test_populate_never_replaces_existing_value():
+    async def scenario(server):
+        reader, writer = await connected(server), await connected(server)
+        await writer.set(1, NEW)
+        data, version = await reader.get_versioned(1)
+        stored = await reader.populate(1, OLD, version)
+        result = stored, (await reader.get_versioned(1))[0]
+        await reader.close()
+        await writer.close()
+        return result
+
+    assert run(scenario) == (False, NEW)
+
+
+def test_cold_read_through_storage(monkeypatch):
+    loads = []
+
+    async def load_user_data(user_id):
+        loads.append(user_id)
+        return OLD
+
+    monkeypatch.setattr(storage.Database, 'load_user_data', staticmethod(load_user_data))
+
+    async def scenario(server):
+        received = []
+        cache, other = await connected(server), await connected(server, received)
+        monkeypatch.setattr(storage, 'shared_cache', cache)
+        first, second = UserStateStorage(), UserStateStorage()
+        assert await first.get_user_data(1) == OLD
+        # Вторая реплика берет данные из L2, не обращаясь к БД
+        assert await second.get_user_data(1) == OLD
+        await asyncio.sleep(1.2)
+        await cache.close()
+        await other.close()
+        return received
+
+    assert run(scenario) == []
+    assert loads == [1]
@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import calendar_feed
+
+SCHEDULE = [{'day': 'понедельник', 'time': '09:00-10:30', 'className': 'Матанализ'}]
+DEADLINES = [{'name': 'Курсовая', 'datetime': '2027-03-01 18:00'}]
+
+
+def feed(state):
+    return "".join(calendar_feed.iter_calendar(1, SCHEDULE, DEADLINES, state)).split("\r\n")
+
+
+def test_events_carry_user_timezone():
+    lines = feed({'tz': 'America/New_York'})
+    assert "X-WR-TIMEZONE:America/New_York" in lines
+    assert "TZID:America/New_York" in lines
+    assert "DTSTART;TZID=America/New_York:20270301T180000" in lines
+    starts = [line for line in lines if line.startswith("DTSTART") and "T090000" in line]
+    assert starts and all(line.startswith("DTSTART;TZID=America/New_York:") for line in starts)
+    # Ни одного времени без пояса внутри событий
+    event_times = [line for line in lines if line.startswith(("DTSTART:", "DTEND:", "EXDATE:"))]
+    timezone_block = lines[lines.index("BEGIN:VTIMEZONE"):lines.index("END:VTIMEZONE")]
+    assert all(line in timezone_block for line in event_times)
+
+
+def test_vtimezone_lists_dst_transitions():
+    lines = calendar_feed._vtimezone(ZoneInfo('America/New_York'), 2026)
+    assert "DTSTART:20260308T020000" in lines
+    assert "DTSTART:20261101T020000" in lines
+    assert lines.count("BEGIN:DAYLIGHT") == 3
+    # Пояс без перехода на летнее время - одно описание
+    moscow = calendar_feed._vtimezone(ZoneInfo('Europe/Moscow'), 2026)
+    assert moscow.count("BEGIN:STANDARD") == 1 and "TZOFFSETTO:+0300" in moscow
+
+
+def test_week_starts_in_user_timezone():
+    # Воскресенье 22:00 UTC - уже понедельник в Москве
+    now = datetime(2026, 10, 18, 22, 0, tzinfo=timezone.utc)
+    assert calendar_feed._week_start(now.astimezone(ZoneInfo('Europe/Moscow'))) == datetime(2026, 10, 19)
+    assert calendar_feed._week_start(now) == datetime(2026, 10, 12)
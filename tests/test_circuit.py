@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+import database
+from circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, DatabaseUnavailable
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == HALF_OPEN
+    return breaker
+
+
+def test_single_trial_in_half_open():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_failed_trial_reopens():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_released_trial_lets_next_request_through():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+def test_cancelled_guarded_trial_does_not_wedge_breaker(monkeypatch):
+    breaker = half_open_breaker()
+    monkeypatch.setattr(database, 'breaker', breaker)
+    started = asyncio.Event()
+
+    @database.guarded(timeout=5)
+    async def slow_query():
+        started.set()
+        await asyncio.sleep(10)
+
+    @database.guarded(timeout=5)
+    async def fast_query():
+        return 'ok'
+
+    async def scenario():
+        trial = asyncio.create_task(slow_query())
+        await started.wait()
+        # Пока идет пробный запрос, остальные отклоняются
+        with pytest.raises(DatabaseUnavailable):
+            await fast_query()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        return await fast_query()
+
+    assert asyncio.run(scenario()) == 'ok'
+    assert breaker.state == CLOSED
@@ -0,0 +1,39 @@
+from zoneinfo import ZoneInfo
+
+from importers import collect_entries, iter_ics_records
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+
+
+def import_ics(*event_lines, tz=MOSCOW):
+    lines = ["BEGIN:VCALENDAR", "BEGIN:VEVENT", *event_lines, "SUMMARY:Матанализ", "END:VEVENT", "END:VCALENDAR"]
+    return collect_entries(iter_ics_records(line + "\r\n" for line in lines), is_ics=True, tz=tz)
+
+
+def test_utc_times_are_converted_to_user_timezone():
+    # Экспорт Google: 06:00Z - это 09:00 по Москве
+    entries, errors = import_ics("DTSTART:20240902T060000Z", "DTEND:20240902T073000Z")
+    assert errors == []
+    assert entries[0]['day'] == 'понедельник'
+    assert entries[0]['time'] == '09:00-10:30'
+
+
+def test_utc_conversion_can_move_the_weekday():
+    # Воскресенье 22:30Z - понедельник 01:30 по Москве
+    entries, _ = import_ics("DTSTART:20240901T223000Z", "DTEND:20240901T230000Z")
+    assert entries[0]['day'] == 'понедельник'
+    assert entries[0]['time'] == '01:30-02:00'
+
+
+def test_tzid_times_are_converted_to_user_timezone():
+    entries, errors = import_ics(
+        "DTSTART;TZID=Europe/Berlin:20240902T080000",
+        'DTEND;TZID="Europe/Berlin":20240902T093000',
+    )
+    assert errors == []
+    assert entries[0]['time'] == '09:00-10:30'
+
+
+def test_floating_and_unknown_tzid_times_are_kept():
+    entries, _ = import_ics("DTSTART:20240902T090000", "DTEND;TZID=Russian Standard Time:20240902T103000")
+    assert entries[0]['time'] == '09:00-10:30'
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import threading
+
+import journal
+from journal import WriteAheadJournal
+
+
+def test_records_survive_reopen_until_truncate(tmp_path):
+    path = str(tmp_path / 'pending.journal')
+
+    async def write():
+        wal = WriteAheadJournal(path)
+        assert wal.open() == []
+        await wal.append(['append', 1, {'entries': [{'day': 'Понедельник'}]}])
+        await wal.append(['state', 1, {'v': 2}])
+        wal.close()
+
+    async def reopen_and_truncate():
+        wal = WriteAheadJournal(path)
+        records = wal.open()
+        await wal.truncate()
+        wal.close()
+        return records
+
+    asyncio.run(write())
+    records = asyncio.run(reopen_and_truncate())
+    assert records == [['append', 1, {'entries': [{'day': 'Понедельник'}]}], ['state', 1, {'v': 2}]]
+    assert WriteAheadJournal(path).open() == []
+
+
+def test_truncate_fsyncs_off_the_event_loop(tmp_path, monkeypatch):
+    threads = []
+    real_fsync = os.fsync
+
+    def fsync(fd):
+        threads.append(threading.current_thread())
+        real_fsync(fd)
+
+    monkeypatch.setattr(journal.os, 'fsync', fsync)
+
+    async def scenario():
+        wal = WriteAheadJournal(str(tmp_path / 'pending.journal'))
+        wal.open()
+        await wal.truncate()
+        wal.close()
+
+    asyncio.run(scenario())
+    assert threads and threading.main_thread() not in threads
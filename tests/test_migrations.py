@@ -0,0 +1,213 @@
+import asyncio
+import re
+
+import pytest
+
+import database
+import migrations
+from circuit import CircuitBreaker
+from database import MIGRATION_LOCK_ID, SCHEMA_STEPS, Backfill, ConcurrentIndex, Database
+
+BACKFILL = 90
+INDEX = 91
+
+
+class FakePostgres:
+    """Состояние БД для фоновых шагов схемы: версии, прогресс, блокировки, индексы"""
+
+    def __init__(self, keys=()):
+        self.applied = set(SCHEMA_STEPS)
+        self.backfills = {}
+        self.keys = sorted(keys)
+        self.locks = set()
+        self.indexes = {}
+        self.statements = []
+
+
+class FakeTransaction:
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        # Блокировки xact_lock снимаются с концом транзакции
+        self._conn.db.locks -= self._conn.xact_locks
+        self._conn.xact_locks = set()
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+        self.xact_locks = set()
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    async def fetch(self, query, *args):
+        if 'FROM schema_version' in query:
+            return [{'version': version} for version in self.db.applied]
+        last_key, limit = args
+        keys = [key for key in self.db.keys if last_key is None or key > last_key]
+        return [{'key': key} for key in keys[:limit]]
+
+    async def fetchval(self, query, *args):
+        if 'pg_try_advisory' in query:
+            lock_id = args[0]
+            if lock_id in self.db.locks:
+                return False
+            self.db.locks.add(lock_id)
+            if 'xact' in query:
+                self.xact_locks.add(lock_id)
+            return True
+        if 'schema_backfills' in query:
+            return self.db.backfills.get(args[0], {}).get('last_key')
+        if 'indisvalid' in query:
+            return self.db.indexes.get(args[0])
+        raise AssertionError(query)
+
+    async def execute(self, query, *args, timeout=None):
+        self.db.statements.append(' '.join(query.split()))
+        if 'pg_advisory_unlock' in query:
+            self.db.locks.discard(args[0])
+        elif 'INSERT INTO schema_version' in query:
+            self.db.applied.add(args[0])
+        elif 'INSERT INTO schema_backfills' in query:
+            version, last_key, rows = args
+            previous = self.db.backfills.get(version, {'rows': 0})
+            self.db.backfills[version] = {'last_key': last_key, 'rows': previous['rows'] + rows}
+        elif 'DELETE FROM schema_backfills' in query:
+            self.db.backfills.pop(args[0], None)
+        elif query.startswith('DROP INDEX'):
+            self.db.indexes.pop(query.split()[-1], None)
+        elif query.startswith('CREATE INDEX'):
+            self.db.indexes[re.search(r'EXISTS (\w+)', query).group(1)] = True
+
+
+class FakeAcquire:
+    def __init__(self, db):
+        self._db = db
+
+    async def __aenter__(self):
+        return FakeConnection(self._db)
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakePool:
+    def __init__(self, db):
+        self._db = db
+
+    def acquire(self):
+        return FakeAcquire(self._db)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakePostgres(keys=range(1, 6))
+    monkeypatch.setitem(SCHEMA_STEPS, BACKFILL, Backfill(
+        'users', "UPDATE users SET state = state WHERE user_id = ANY($1)", batch_size=2
+    ))
+    monkeypatch.setitem(SCHEMA_STEPS, INDEX, ConcurrentIndex('idx_test', "ON users (user_id)"))
+    db.applied -= {BACKFILL, INDEX}
+
+    async def get_pool():
+        return FakePool(db)
+
+    monkeypatch.setattr(Database, 'get_pool', get_pool)
+    breaker = CircuitBreaker("primary")
+    monkeypatch.setattr(database, 'breaker', breaker)
+    monkeypatch.setattr(migrations, 'breaker', breaker)
+    return db
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_group_index_is_built_online():
+    assert isinstance(SCHEMA_STEPS[5], ConcurrentIndex)
+    assert SCHEMA_STEPS[5].name == 'idx_users_group'
+    ddl = [step for step in SCHEMA_STEPS.values() if isinstance(step, str)]
+    assert not any('idx_users_group' in step for step in ddl)
+
+
+def test_backfill_resumes_from_saved_progress(db):
+    # Прошлый процесс успел обработать ключи 1 и 2
+    db.backfills[BACKFILL] = {'last_key': 2, 'rows': 2}
+
+    assert run(Database.run_backfill_batch(BACKFILL)) == [3, 4]
+    assert db.backfills[BACKFILL] == {'last_key': 4, 'rows': 4}
+    assert run(Database.run_backfill_batch(BACKFILL)) == [5]
+    assert BACKFILL not in db.applied
+    assert run(Database.run_backfill_batch(BACKFILL)) is None
+    assert BACKFILL in db.applied and BACKFILL not in db.backfills
+    updates = [statement for statement in db.statements if statement.startswith('UPDATE users')]
+    assert len(updates) == 2
+
+
+def test_backfill_batch_held_by_other_process_returns_empty(db):
+    db.locks.add(MIGRATION_LOCK_ID + BACKFILL)
+    assert run(Database.run_backfill_batch(BACKFILL)) == []
+    assert BACKFILL not in db.backfills
+
+
+def test_index_build_held_by_other_process_is_skipped(db):
+    db.locks.add(MIGRATION_LOCK_ID + INDEX)
+    assert run(Database.build_index_concurrently(INDEX)) is False
+    assert INDEX not in db.applied and 'idx_test' not in db.indexes
+
+
+def test_invalid_index_is_dropped_and_rebuilt(db):
+    # Прерванный CREATE INDEX CONCURRENTLY оставил нерабочий индекс
+    db.indexes['idx_test'] = False
+    assert run(Database.build_index_concurrently(INDEX)) is True
+    ddl = [statement for statement in db.statements if 'INDEX' in statement]
+    assert ddl == [
+        'DROP INDEX CONCURRENTLY IF EXISTS idx_test',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_test ON users (user_id)',
+    ]
+    assert db.indexes['idx_test'] is True and INDEX in db.applied
+    assert MIGRATION_LOCK_ID + INDEX not in db.locks
+
+
+def test_valid_index_is_only_recorded(db):
+    db.indexes['idx_test'] = True
+    assert run(Database.build_index_concurrently(INDEX)) is True
+    assert not [statement for statement in db.statements if 'INDEX' in statement]
+    assert INDEX in db.applied
+
+
+class FakeJob:
+    def __init__(self):
+        self.removed = False
+
+    def schedule_removal(self):
+        self.removed = True
+
+
+class FakeContext:
+    def __init__(self):
+        self.job = FakeJob()
+
+
+def test_migration_job_runs_pending_steps_then_stops(db, monkeypatch):
+    forgotten = []
+
+    async def forget(user_id):
+        forgotten.append(user_id)
+
+    monkeypatch.setattr(migrations.user_storage, 'forget', forget)
+    monkeypatch.setattr(migrations, 'BATCH_PAUSE', 0)
+    assert run(Database.pending_online_steps()) == [BACKFILL, INDEX]
+
+    context = FakeContext()
+    run(migrations.migration_job(context))
+    assert {BACKFILL, INDEX} <= db.applied
+    assert forgotten == [1, 2, 3, 4, 5]
+    assert not context.job.removed
+
+    run(migrations.migration_job(context))
+    assert context.job.removed
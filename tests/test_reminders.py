@@ -0,0 +1,218 @@
+import asyncio
+from datetime import datetime, timezone
+from itertools import islice
+
+import pytest
+
+import reminders
+from reminders import DEADLINE, ReminderScheduler
+
+# Понедельник 10:00 UTC, граница окна дайджеста
+BASE = int(datetime(2030, 1, 7, 10, 0, tzinfo=timezone.utc).timestamp())
+WINDOW = 300
+
+
+def deadline(name: str, minute: int) -> dict:
+    return {'name': name, 'datetime': f"2030-01-07 10:{minute:02d}", 'reminderBefore': 0}
+
+
+def user_data(*deadlines) -> dict:
+    return {'schedule': [], 'deadlines': list(deadlines), 'state': {'tz': 'UTC'}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [BASE - 60]
+    monkeypatch.setattr(reminders.time, 'time', lambda: now[0])
+    return now
+
+
+def names(due):
+    return [[item['name'] for _, kind, item in items if kind == DEADLINE] for _, _, items in due]
+
+
+def test_window_items_are_not_resent_after_rebuild(clock):
+    scheduler = ReminderScheduler()
+    scheduler.update_user(1, user_data(deadline('a', 0), deadline('b', 2)))
+
+    clock[0] = BASE
+    assert names(scheduler.pop_due(clock[0], WINDOW)) == [['a', 'b']]
+
+    # Любая запись внутри окна перестраивает таблицу от now
+    scheduler.update_user(1, user_data(deadline('a', 0), deadline('b', 2)))
+    clock[0] = BASE + 150
+    assert scheduler.pop_due(clock[0], WINDOW) == []
+
+
+def test_item_added_later_in_window_still_fires(clock):
+    scheduler = ReminderScheduler()
+    scheduler.update_user(1, user_data(deadline('a', 0), deadline('b', 2)))
+    clock[0] = BASE
+    scheduler.pop_due(clock[0], WINDOW)
+
+    clock[0] = BASE + 60
+    scheduler.update_user(1, user_data(deadline('a', 0), deadline('b', 2), deadline('c', 3)))
+    clock[0] = BASE + 180
+    assert names(scheduler.pop_due(clock[0], WINDOW)) == [['c']]
+
+
+def test_sent_marks_expire(clock):
+    scheduler = ReminderScheduler()
+    scheduler.update_user(1, user_data(deadline('a', 0), deadline('b', 2)))
+    clock[0] = BASE
+    scheduler.pop_due(clock[0], WINDOW)
+    assert scheduler._sent_through
+
+    clock[0] = BASE + 600
+    scheduler.pop_due(clock[0], WINDOW)
+    assert not scheduler._sent_through
+
+
+class FakeClaims:
+    """Общий кэш с одной репликой: ключ можно занять один раз"""
+
+    def __init__(self):
+        self.keys = set()
+
+    async def claim(self, key, ttl):
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+class FakeContext:
+    def __init__(self):
+        self.bot = FakeBot()
+
+
+def test_group_reminder_not_swallowed_by_own_reminder(clock, monkeypatch):
+    scheduler = ReminderScheduler()
+    monkeypatch.setattr(reminders, 'reminder_scheduler', scheduler)
+    claims = FakeClaims()
+    monkeypatch.setattr(reminders, 'shared_cache', claims)
+    group = {'id': 1, 'code': 'abc', 'owner_id': 10}
+    scheduler.update_user(10, {
+        'schedule': [{'day': 'понедельник', 'time': '10:02-11:30', 'className': 'Матан', 'reminderBefore': 0}],
+        'deadlines': [],
+        'state': {'tz': 'UTC', 'group': group},
+    })
+    scheduler.update_user(20, {
+        'schedule': [],
+        'deadlines': [deadline('a', 0)],
+        'state': {'tz': 'UTC', 'group': group},
+    })
+    context = FakeContext()
+
+    # Своя таблица участника и таблица старосты срабатывают на разных тиках одного окна
+    clock[0] = BASE
+    asyncio.run(reminders.reminder_job(context))
+    clock[0] = BASE + 150
+    asyncio.run(reminders.reminder_job(context))
+
+    member_messages = [text for chat_id, text in context.bot.sent if chat_id == 20]
+    assert len(member_messages) == 2
+    assert 'Матан' in member_messages[1]
+    assert [chat_id for chat_id, _ in context.bot.sent].count(10) == 1
+    # У своей таблицы и таблицы старосты разные ключи, даже при одном моменте
+    assert {key.rsplit(':', 1)[0] for key in claims.keys} == {
+        'reminder:20:20', 'reminder:20:10', 'reminder:10:10'
+    }
+
+
+def test_cached_transitions_match_direct_search():
+    tz = reminders.get_timezone('Europe/Berlin')
+    start = int(datetime(2030, 1, 1, tzinfo=timezone.utc).timestamp())
+    # Вперед по году и вразнобой: кэш не должен отдавать чужой промежуток
+    moments = [start + day * 86400 + 3600 for day in range(365)]
+    moments += moments[::-7]
+    for moment in moments:
+        assert reminders.next_transition(tz, moment) == reminders._find_transition(tz, moment, 400)
+
+
+def test_worker_builds_only_own_users_and_their_group_owners(monkeypatch):
+    # Воркер обслуживает только четные user_id
+    monkeypatch.setattr(reminders, 'owns', lambda user_id: user_id % 2 == 0)
+    group = {'id': 1, 'code': 'abc', 'owner_id': 11}
+    lesson = [{'day': 'понедельник', 'time': '10:00-11:30', 'className': 'Матан', 'reminderBefore': 0}]
+    rows = [
+        (11, lesson, [], {'tz': 'UTC', 'group': group}),   # чужой староста своего участника
+        (13, lesson, [], {'tz': 'UTC'}),                   # чужой пользователь
+        (15, lesson, [], {'tz': 'UTC', 'group': {'id': 2, 'code': 'x', 'owner_id': 15}}),
+        (20, [], [deadline('a', 0)], {'tz': 'UTC', 'group': group}),
+        (22, lesson, [], {'tz': 'UTC'}),
+    ]
+
+    async def iter_reminder_sources():
+        for row in rows:
+            yield row
+
+    monkeypatch.setattr(reminders.Database, 'iter_reminder_sources', iter_reminder_sources)
+    scheduler = ReminderScheduler()
+    asyncio.run(scheduler.load_all())
+    assert set(scheduler._tables) == {11, 20, 22}
+    assert scheduler.needs(11) and not scheduler.needs(13) and not scheduler.needs(15)
+
+    # Участник ушел из группы - таблица чужого старосты больше не нужна
+    scheduler.update_user(20, {'schedule': [], 'deadlines': [deadline('a', 0)], 'state': {'tz': 'UTC'}})
+    assert set(scheduler._tables) == {20, 22}
+    # Изменения чужих пользователей таблиц не создают
+    scheduler.update_user(13, {'schedule': lesson, 'deadlines': [], 'state': {'tz': 'UTC'}})
+    assert 13 not in scheduler._tables
+
+
+def test_joining_foreign_group_loads_owner_table(monkeypatch):
+    monkeypatch.setattr(reminders, 'owns', lambda user_id: user_id % 2 == 0)
+    group = {'id': 1, 'code': 'abc', 'owner_id': 11}
+    lesson = [{'day': 'понедельник', 'time': '10:00-11:30', 'className': 'Матан', 'reminderBefore': 0}]
+
+    async def get_user_data(user_id):
+        return {'schedule': lesson, 'deadlines': [], 'state': {'tz': 'UTC', 'group': group}}
+
+    monkeypatch.setattr(reminders.user_storage, 'get_user_data', get_user_data)
+
+    async def scenario():
+        scheduler = ReminderScheduler()
+        scheduler.update_user(20, {'schedule': [], 'deadlines': [], 'state': {'tz': 'UTC', 'group': group}})
+        await asyncio.sleep(0)
+        return scheduler
+
+    assert 11 in asyncio.run(scenario())._tables
+
+
+def lesson(day: str, **extra) -> dict:
+    return {'day': day, 'time': '09:00-10:30', 'subject': 'Матанализ', 'reminderBefore': 0, **extra}
+
+
+def occurrence_days(schedule, state, count):
+    table = reminders.FireTable(1, 1, schedule, [], {'tz': 'UTC', **state}).build(BASE)
+    moments = reminders.iter_occurrences(table, BASE)
+    return [datetime.fromtimestamp(ts, timezone.utc).date().isoformat() for ts, _ in islice(moments, count)]
+
+
+def test_occurrences_skip_holidays():
+    # Понедельники с 2030-01-14; 2030-01-21 - праздник
+    days = occurrence_days([lesson('понедельник')], {'holidays': ['2030-01-21']}, 3)
+    assert days == ['2030-01-14', '2030-01-28', '2030-02-04']
+
+
+def test_occurrences_follow_week_parity():
+    # Семестр с 2030-01-07: эта неделя первая (нечетная), пара по четным
+    state = {'semester_start': '2030-01-07'}
+    days = occurrence_days([lesson('понедельник', weeks='even')], state, 3)
+    assert days == ['2030-01-14', '2030-01-28', '2030-02-11']
+
+
+def test_occurrences_skip_cancelled_dates_and_stop_at_horizon():
+    table = reminders.FireTable(1, 1, [lesson('среда', skip=['2030-01-09'])], [], {'tz': 'UTC'}).build(BASE)
+    moments = list(reminders.iter_occurrences(table, BASE, horizon_days=14))
+    assert [datetime.fromtimestamp(ts, timezone.utc).date().isoformat() for ts, _ in moments] == ['2030-01-16']
+    assert moments[0][1][0][0] == reminders.SCHEDULE
@@ -0,0 +1,175 @@
+import asyncio
+
+import pytest
+
+import database
+from circuit import CLOSED, OPEN, CircuitBreaker
+from database import Database
+
+
+class StubAcquire:
+    """Как asyncpg.pool.PoolAcquireContext: await и async with"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __await__(self):
+        return self._pool._acquire().__await__()
+
+    async def __aenter__(self):
+        return await self._pool._acquire()
+
+    async def __aexit__(self, *exc_info):
+        self._pool.released += 1
+
+
+class StubConnection:
+    def __init__(self, pool):
+        self._pool = pool
+
+    async def fetchrow(self, query, *args):
+        self._pool.queries.append(args)
+        if self._pool.delay:
+            await asyncio.sleep(self._pool.delay)
+        if self._pool.error is not None:
+            raise self._pool.error
+        return self._pool.rows.get(args[0])
+
+
+class StubPool:
+    def __init__(self, name, rows=None, delay=0.0, error=None, acquire_error=None):
+        self.name = name
+        self.rows = rows or {}
+        self.delay = delay
+        self.error = error
+        self.acquire_error = acquire_error
+        self.queries = []
+        self.released = 0
+
+    async def _acquire(self):
+        if self.acquire_error is not None:
+            raise self.acquire_error
+        return StubConnection(self)
+
+    def acquire(self, timeout=None):
+        return StubAcquire(self)
+
+    async def release(self, conn):
+        self.released += 1
+
+
+ROW = {'schedule': [], 'deadlines': [], 'state': {'tz': 'UTC'}}
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    primary = StubPool('primary', rows={1: ROW, 2: ROW})
+    replica = StubPool('replica', rows={1: ROW})
+    monkeypatch.setenv('DATABASE_REPLICA_URL', 'postgres://replica')
+    monkeypatch.setattr(Database, 'get_pool', classmethod(lambda cls: _value(primary)))
+    monkeypatch.setattr(Database, 'get_replica_pool', classmethod(lambda cls: _value(replica)))
+    monkeypatch.setattr(Database, '_recent_writes', {})
+    monkeypatch.setattr(database, 'breaker', CircuitBreaker("primary", failure_threshold=1))
+    monkeypatch.setattr(database, 'replica_breaker', CircuitBreaker("replica", failure_threshold=1))
+    monkeypatch.setattr(database, 'REPLICA_TIMEOUT', 0.05)
+    return primary, replica
+
+
+async def _value(value):
+    return value
+
+
+def test_reads_go_to_replica(pools):
+    primary, replica = pools
+    assert asyncio.run(Database.get_user_state(1)) == {'tz': 'UTC'}
+    assert replica.queries == [(1,)]
+    assert primary.queries == []
+    assert replica.released == 1
+
+
+def test_no_replica_configured_reads_primary(pools, monkeypatch):
+    primary, replica = pools
+    monkeypatch.delenv('DATABASE_REPLICA_URL')
+    asyncio.run(Database.get_user_state(1))
+    assert replica.queries == []
+    assert primary.queries == [(1,)]
+
+
+def test_recent_writer_reads_primary_until_window_passes(pools, monkeypatch):
+    primary, replica = pools
+    now = [1000.0]
+    monkeypatch.setattr(database.time, 'monotonic', lambda: now[0])
+    Database.mark_written(1)
+
+    asyncio.run(Database.get_user_state(1))
+    assert primary.queries == [(1,)]
+    # Другие пользователи по-прежнему читают с реплики
+    asyncio.run(Database.get_user_state(2))
+    assert replica.queries == [(2,)]
+
+    now[0] += database.REPLICA_STICKY_SECONDS + 0.1
+    asyncio.run(Database.get_user_state(1))
+    assert replica.queries == [(2,), (1,)]
+    assert primary.queries == [(1,)]
+
+
+def test_slow_replica_falls_back_without_tripping_primary(pools):
+    primary, replica = pools
+    replica.delay = 1.0
+    assert asyncio.run(Database.get_user_state(1)) == {'tz': 'UTC'}
+    assert primary.queries == [(1,)]
+    assert replica.released == 1
+    assert database.replica_breaker.state == OPEN
+    assert database.breaker.state == CLOSED
+
+    # Пока предохранитель реплики разомкнут, чтение сразу идет на основную
+    asyncio.run(Database.get_user_state(1))
+    assert len(replica.queries) == 1
+    assert len(primary.queries) == 2
+
+
+def test_replica_connection_error_falls_back(pools):
+    primary, replica = pools
+    replica.error = ConnectionResetError("replica went away")
+    assert asyncio.run(Database.get_user_state(1)) == {'tz': 'UTC'}
+    assert primary.queries == [(1,)]
+    assert database.replica_breaker.state == OPEN
+    assert database.breaker.state == CLOSED
+
+
+def test_replica_acquire_error_falls_back(pools):
+    primary, replica = pools
+    replica.acquire_error = OSError("connection refused")
+    asyncio.run(Database.get_user_state(1))
+    assert primary.queries == [(1,)]
+    assert database.replica_breaker.state == OPEN
+
+
+def test_load_user_data_reads_replica_only(pools, monkeypatch):
+    primary, replica = pools
+    created = []
+
+    async def create_user(user_id):
+        created.append(user_id)
+        return True
+
+    monkeypatch.setattr(Database, 'create_user_if_not_exists', staticmethod(create_user))
+    assert asyncio.run(Database.load_user_data(1))['state'] == {'tz': 'UTC'}
+    assert created == []
+    assert primary.queries == []
+
+
+def test_load_user_data_missing_on_replica_creates_on_primary(pools, monkeypatch):
+    primary, replica = pools
+    created = []
+
+    async def create_user(user_id):
+        created.append(user_id)
+        return True
+
+    monkeypatch.setattr(Database, 'create_user_if_not_exists', staticmethod(create_user))
+    # Пользователь 2 есть на основной БД, но реплика его еще не получила
+    assert asyncio.run(Database.load_user_data(2))['state'] == {'tz': 'UTC'}
+    assert created == [2]
+    assert replica.queries == [(2,)]
+    assert primary.queries == [(2,)]
@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+
+from telegram.ext import CommandHandler, ConversationHandler
+
+import bot
+from stats import COMMAND_ROUTES, update_route
+
+
+def text_update(text):
+    message = SimpleNamespace(text=text, document=None)
+    return SimpleNamespace(message=message, callback_query=None)
+
+
+def test_registered_commands_get_their_own_route():
+    assert update_route(text_update('/stats')) == '/stats'
+    assert update_route(text_update('/Add@SomeBot пн 09:00')) == '/add'
+
+
+def test_unknown_commands_share_one_route():
+    routes = {update_route(text_update(f'/typo{n}')) for n in range(100)}
+    assert routes == {'command'}
+    assert update_route(text_update('/')) == 'command'
+
+
+def test_allow_list_covers_every_registered_command(monkeypatch):
+    monkeypatch.setattr(bot, 'application', None)
+    bot.setup_handlers()
+    application = bot.application
+    commands = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            nested = [handler]
+            if isinstance(handler, ConversationHandler):
+                nested = handler.entry_points + handler.fallbacks
+            for item in nested:
+                if isinstance(item, CommandHandler):
+                    commands |= item.commands
+    assert commands and commands <= COMMAND_ROUTES
@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+import database
+import storage
+from circuit import CircuitBreaker
+from database import Database
+from storage import OP_APPEND, OP_STATE, UserStateStorage
+
+
+def test_pending_writes_of_one_user_do_not_hold_back_others(monkeypatch):
+    applied = []
+
+    async def apply(self, op, user_id, payload, refresh_cache=True):
+        applied.append((user_id, payload))
+        return True
+
+    monkeypatch.setattr(UserStateStorage, '_apply', apply)
+    monkeypatch.setattr(storage, 'REPLAY_INTERVAL', 3600)
+
+    async def scenario():
+        store = UserStateStorage()
+        # У пользователя 1 запись осталась в очереди с прошлого сбоя
+        await store._defer(OP_STATE, 1, {'v': 1})
+        await store.update_user_state(2, v=2)
+        await store.update_user_state(1, v=3)
+        store._replay_task.cancel()
+        return store
+
+    store = asyncio.run(scenario())
+    # Пользователь 2 записан сразу, новая запись пользователя 1 - за его отложенной
+    assert applied == [(2, {'v': 2})]
+    assert [(user_id, payload) for _, user_id, payload in store._journal] == [(1, {'v': 1}), (1, {'v': 3})]
+
+
+class FakeTransaction:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeConnection:
+    """users.schedule и applied_writes одного пользователя"""
+
+    def __init__(self):
+        self.schedule = []
+        self.applied = set()
+
+    def transaction(self):
+        return FakeTransaction()
+
+    async def fetchval(self, query, write_id, user_id):
+        assert 'applied_writes' in query
+        if write_id in self.applied:
+            return None
+        self.applied.add(write_id)
+        return write_id
+
+    async def execute(self, query, user_id, entries_json):
+        self.schedule += json.loads(entries_json)
+
+
+class FakeAcquire:
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def __aenter__(self):
+        return self._conn
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakePool:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def acquire(self):
+        return FakeAcquire(self._conn)
+
+
+def test_replayed_append_is_applied_once_but_equal_entries_are_kept(monkeypatch, tmp_path):
+    conn = FakeConnection()
+
+    async def get_pool():
+        return FakePool(conn)
+
+    monkeypatch.setattr(Database, 'get_pool', get_pool)
+    monkeypatch.setattr(database, 'breaker', CircuitBreaker("primary"))
+    monkeypatch.setattr(storage, 'REPLAY_INTERVAL', 3600)
+    lesson = {'day': 'понедельник', 'time': '09:00-10:30', 'subject': 'Матанализ'}
+
+    async def scenario():
+        store = UserStateStorage()
+        await store.recover_journal(str(tmp_path / 'journal'))
+        # Одна и та же пара добавлена дважды, пока БД была недоступна
+        await store._defer(OP_APPEND, 1, {'entries': [lesson]})
+        await store._defer(OP_APPEND, 1, {'entries': [lesson]})
+        store._replay_task.cancel()
+        records = list(store._journal)
+        assert records[0][2]['id'] != records[1][2]['id']
+        # Первая запись применилась, но процесс упал до очистки журнала
+        await store._apply(*records[0], refresh_cache=False)
+        await store.replay_pending()
+
+    asyncio.run(scenario())
+    assert conn.schedule == [lesson, lesson]
+    assert len(conn.applied) == 2
@@ -0,0 +1,55 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from workers import Dispatcher
+
+
+def test_forward_streams_worker_response():
+    chunks = [b'BEGIN:VCALENDAR\r\n', b'X' * 50000, b'END:VCALENDAR\r\n']
+
+    async def calendar(request):
+        response = web.StreamResponse(headers={'ETag': '"1-2"'})
+        response.content_type = 'text/calendar'
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        for chunk in chunks:
+            await response.write(chunk)
+            await asyncio.sleep(0)
+        await response.write_eof()
+        return response
+
+    async def scenario():
+        worker_app = web.Application()
+        worker_app.router.add_get('/calendar/{token}.ics', calendar)
+        worker_server = TestServer(worker_app)
+        await worker_server.start_server()
+
+        dispatcher = Dispatcher('main.py', 1, 0)
+        worker = dispatcher.workers[0]
+        worker.url = str(worker_server.make_url('')).rstrip('/')
+        worker.ready = True
+        dispatcher._session = aiohttp.ClientSession()
+        front_app = web.Application()
+        front_app.router.add_get('/calendar/{token}.ics', dispatcher.handle_calendar)
+        front_server = TestServer(front_app)
+        await front_server.start_server()
+
+        try:
+            async with aiohttp.ClientSession() as client:
+                async with client.get(front_server.make_url('/calendar/1.abc.ics')) as response:
+                    return (
+                        response.status, response.headers.get('ETag'),
+                        response.headers.get('Transfer-Encoding'), await response.read()
+                    )
+        finally:
+            await dispatcher._session.close()
+            await front_server.close()
+            await worker_server.close()
+
+    status, etag, encoding, body = asyncio.run(scenario())
+    assert status == 200 and etag == '"1-2"'
+    assert encoding == 'chunked'
+    assert body == b''.join(chunks)
@@ -0,0 +1,135 @@
+"""
+Разбор и проверка пользовательского ввода (время пар, даты дедлайнов)
+
+Парсеры написаны вручную под фиксированные форматы: без регулярных
+выражений и strptime (медленный и зависит от локали), с проверкой
+диапазонов за один проход.
+"""
+from datetime import date, datetime
+from typing import NamedTuple, Optional, Tuple
+
+# Разделители начала и конца пары: дефис, en dash, em dash
+_RANGE_SEPARATORS = "-–—"
+
+TIME_RANGE_FORMAT_HINT = "ЧЧ:ММ-ЧЧ:ММ"
+
+
+class TimeRange(NamedTuple):
+    """Время пары в минутах от начала суток"""
+    start: int
+    end: int
+
+    def __str__(self) -> str:
+        sh, sm = divmod(self.start, 60)
+        eh, em = divmod(self.end, 60)
+        return f"{sh:02d}:{sm:02d}-{eh:02d}:{em:02d}"
+
+
+def _two_digits(text: str, i: int) -> int:
+    """Число из двух цифр text[i:i+2] или -1"""
+    a, b = ord(text[i]) - 48, ord(text[i + 1]) - 48
+    if 0 <= a <= 9 and 0 <= b <= 9:
+        return a * 10 + b
+    return -1
+
+
+def _parse_clock(text: str, i: int, n: int) -> Tuple[int, int]:
+    """
+    Читает "Ч:ММ" или "ЧЧ:ММ" (также через точку) с позиции i.
+    Возвращает (минуты от начала суток или -1, позиция после времени).
+    """
+    # Часы: одна или две цифры
+    if i >= n:
+        return -1, i
+    hours = ord(text[i]) - 48
+    if not 0 <= hours <= 9:
+        return -1, i
+    i += 1
+    if i < n and 0 <= ord(text[i]) - 48 <= 9:
+        hours = hours * 10 + ord(text[i]) - 48
+        i += 1
+
+    if i + 3 > n or text[i] not in ":.":
+        return -1, i
+    minutes = _two_digits(text, i + 1)
+    if minutes < 0 or hours > 23 or minutes > 59:
+        return -1, i
+    return hours * 60 + minutes, i + 3
+
+
+def parse_time_range(text: str) -> Tuple[Optional[TimeRange], Optional[str]]:
+    """
+    Разбирает "ЧЧ:ММ-ЧЧ:ММ".
+    Возвращает (время пары, ошибка).
+    """
+    text = text.strip()
+    n = len(text)
+
+    # Быстрый путь для канонического "ЧЧ:ММ-ЧЧ:ММ"
+    if n == 11 and text[2] == ':' and text[5] == '-' and text[8] == ':':
+        sh, sm = _two_digits(text, 0), _two_digits(text, 3)
+        eh, em = _two_digits(text, 6), _two_digits(text, 9)
+        if min(sh, sm, eh, em) < 0 or sh > 23 or eh > 23 or sm > 59 or em > 59:
+            return None, f"неверное время, формат {TIME_RANGE_FORMAT_HINT}"
+        start, end = sh * 60 + sm, eh * 60 + em
+        if start >= end:
+            return None, "время начала должно быть раньше конца"
+        return TimeRange(start, end), None
+
+    start, i = _parse_clock(text, 0, n)
+    if start < 0:
+        return None, f"неверное время, формат {TIME_RANGE_FORMAT_HINT}"
+
+    while i < n and text[i] == ' ':
+        i += 1
+    if i >= n or text[i] not in _RANGE_SEPARATORS:
+        return None, f"неверное время, формат {TIME_RANGE_FORMAT_HINT}"
+    i += 1
+    while i < n and text[i] == ' ':
+        i += 1
+
+    end, i = _parse_clock(text, i, n)
+    if end < 0 or i != n:
+        return None, f"неверное время, формат {TIME_RANGE_FORMAT_HINT}"
+    if start >= end:
+        return None, "время начала должно быть раньше конца"
+    return TimeRange(start, end), None
+
+
+def parse_deadline(text: str) -> Optional[datetime]:
+    """Разбирает "ГГГГ-ММ-ДД ЧЧ:ММ" (None, если формат или дата неверны)"""
+    if len(text) != 16 or text[4] != '-' or text[7] != '-' or text[10] != ' ' or text[13] != ':':
+        return None
+
+    century, year_low = _two_digits(text, 0), _two_digits(text, 2)
+    month, day = _two_digits(text, 5), _two_digits(text, 8)
+    hour, minute = _two_digits(text, 11), _two_digits(text, 14)
+    if min(century, year_low, month, day, hour, minute) < 0:
+        return None
+
+    try:
+        return datetime(century * 100 + year_low, month, day, hour, minute)
+    except ValueError:
+        # 31 февраля, 24:00 и т.п.
+        return None
+
+
+def parse_date(text: str) -> Optional[date]:
+    """Разбирает "ГГГГ-ММ-ДД" (None, если формат или дата неверны)"""
+    if len(text) != 10 or text[4] != '-' or text[7] != '-':
+        return None
+
+    century, year_low = _two_digits(text, 0), _two_digits(text, 2)
+    month, day = _two_digits(text, 5), _two_digits(text, 8)
+    if min(century, year_low, month, day) < 0:
+        return None
+
+    try:
+        return date(century * 100 + year_low, month, day)
+    except ValueError:
+        return None
+
+
+def format_deadline(value: datetime) -> str:
+    """ДД.ММ.ГГГГ ЧЧ:ММ без strftime"""
+    return f"{value.day:02d}.{value.month:02d}.{value.year:04d} {value.hour:02d}:{value.minute:02d}"
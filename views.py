@@ -0,0 +1,188 @@
+"""
+Постраничный показ расписания и дедлайнов
+
+Страница - текст не длиннее лимита сообщения Telegram и инлайн-клавиатура
+с кнопками правки/удаления записей (только для первых editable записей:
+остальные - пары группы, их меняет староста). Отрисованные страницы
+кэшируются по (пользователь, список, версия данных, страница, editable):
+версия - контрольная сумма списка, поэтому любое изменение данных само
+дает новый ключ, а листание неизменного списка обходится без повторной
+отрисовки.
+"""
+import json
+import zlib
+from collections import OrderedDict
+from html import escape
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup
+
+from callback_data import KIND_SCHEDULE
+from keyboards import WEEKDAYS, get_page_keyboard
+from occurrences import WEEK_LABELS
+from validators import parse_deadline, format_deadline
+
+# Записей на странице
+PAGE_SIZE = 8
+# Сколько отрисованных страниц держать в памяти
+PAGE_CACHE_SIZE = 2048
+# Длинные поля обрезаются, чтобы страница гарантированно влезла в сообщение
+MAX_FIELD_LENGTH = 120
+
+PARSE_MODE = 'HTML'
+
+
+class Page(NamedTuple):
+    text: str
+    markup: Optional[InlineKeyboardMarkup]
+    page: int
+    version: int
+
+
+_page_cache: "OrderedDict[Tuple[int, int, int, int, int], Page]" = OrderedDict()
+
+
+def data_version(items: List[Any]) -> int:
+    """Версия данных списка - CRC32 его содержимого"""
+    payload = json.dumps(items, ensure_ascii=False, sort_keys=True, default=str)
+    return zlib.crc32(payload.encode('utf-8'))
+
+
+def _short(value: Any) -> str:
+    text = str(value)
+    if len(text) > MAX_FIELD_LENGTH:
+        text = text[:MAX_FIELD_LENGTH - 1] + "…"
+    return escape(text)
+
+
+def _schedule_order(schedule: List) -> List[int]:
+    """Индексы пар в порядке показа: по дню недели, затем по времени"""
+    indexes = [
+        index for index, item in enumerate(schedule)
+        if isinstance(item, dict) and item.get('day') in WEEKDAYS
+    ]
+    indexes.sort(key=lambda i: (WEEKDAYS.index(schedule[i]['day']), schedule[i].get('time', '')))
+    return indexes
+
+
+def _deadline_order(deadlines: List) -> List[int]:
+    """Индексы дедлайнов с корректной датой, по возрастанию даты"""
+    dated = []
+    for index, item in enumerate(deadlines):
+        if isinstance(item, dict) and 'datetime' in item:
+            deadline_dt = parse_deadline(item['datetime'])
+            if deadline_dt is not None:
+                dated.append((deadline_dt, index))
+    dated.sort()
+    return [index for _, index in dated]
+
+
+def _schedule_lines(schedule: List, numbered: List[Tuple[int, int]], editable: int) -> List[str]:
+    lines = []
+    current_day = None
+    for number, index in numbered:
+        item = schedule[index]
+        if item['day'] != current_day:
+            current_day = item['day']
+            lines.append(f"\n<b>{current_day.capitalize()}:</b>")
+        line = f"{number}. "
+        if index >= editable:
+            line += "👥 "
+        line += _short(item.get('className', 'Без названия'))
+        if 'time' in item:
+            line += f" ({_short(item['time'])})"
+        if item.get('weeks') in WEEK_LABELS:
+            line += f" [{WEEK_LABELS[item['weeks']]}]"
+        if item.get('professor'):
+            line += f" - {_short(item['professor'])}"
+        lines.append(line)
+    return lines
+
+
+def _deadline_lines(deadlines: List, numbered: List[Tuple[int, int]]) -> List[str]:
+    lines = []
+    for number, index in numbered:
+        item = deadlines[index]
+        lines.append(f"\n{number}. <b>{_short(item.get('name', 'Без названия'))}</b>")
+        lines.append(f"   📅 До: {format_deadline(parse_deadline(item['datetime']))}")
+        if item.get('description'):
+            lines.append(f"   📄 {_short(item['description'])}")
+        lines.append(f"   ⏰ Напоминание за {item.get('reminderBefore', 0)} мин.")
+    return lines
+
+
+def _render(kind: int, items: List, page: int, version: int, editable: int) -> Page:
+    if kind == KIND_SCHEDULE:
+        order = _schedule_order(items)
+        title, empty = "📅 <b>Ваше расписание</b>", "📭 Ваше расписание пусто."
+    else:
+        order = _deadline_order(items)
+        title, empty = "📝 <b>Ваши дедлайны</b>", "📭 У вас нет дедлайнов."
+    if not order:
+        return Page(empty, None, 0, version)
+
+    pages = (len(order) + PAGE_SIZE - 1) // PAGE_SIZE
+    page = min(max(page, 0), pages - 1)
+    first = page * PAGE_SIZE
+    numbered = list(enumerate(order[first:first + PAGE_SIZE], first + 1))
+
+    if pages > 1:
+        title += f" (стр. {page + 1}/{pages})"
+    if kind == KIND_SCHEDULE:
+        lines = _schedule_lines(items, numbered, editable)
+    else:
+        lines = _deadline_lines(items, numbered)
+
+    text = title + ":\n" + "\n".join(lines)
+    buttons = [(number, index) for number, index in numbered if index < editable]
+    return Page(text, get_page_keyboard(kind, version, page, pages, buttons), page, version)
+
+
+def render_page(
+    user_id: int,
+    kind: int,
+    items: List,
+    page: int = 0,
+    editable: Optional[int] = None
+) -> Page:
+    """Страница списка (из кэша, если список с тех пор не менялся)"""
+    version = data_version(items)
+    editable = len(items) if editable is None else editable
+    key = (user_id, kind, version, page, editable)
+    cached = _page_cache.get(key)
+    if cached is not None:
+        _page_cache.move_to_end(key)
+        return cached
+
+    result = _render(kind, items, page, version, editable)
+    _page_cache[key] = result
+    if len(_page_cache) > PAGE_CACHE_SIZE:
+        _page_cache.popitem(last=False)
+    return result
+
+
+def render_search_results(query: str, matches: List[Any], limit: int) -> str:
+    """Результаты /find: пары и дедлайны одним списком"""
+    if not matches:
+        return f"🔍 По запросу «{_short(query)}» ничего не найдено."
+    lines = [f"🔍 <b>Найдено по запросу «{_short(query)}»:</b>"]
+    for kind, item, own in matches:
+        if kind == KIND_SCHEDULE:
+            line = "📅 " + ("" if own else "👥 ")
+            line += f"{str(item.get('day', '')).capitalize()} "
+            if 'time' in item:
+                line += f"{_short(item['time'])} "
+            line += f"- {_short(item.get('className', 'Без названия'))}"
+            if item.get('professor'):
+                line += f" ({_short(item['professor'])})"
+        else:
+            line = f"📝 <b>{_short(item.get('name', 'Без названия'))}</b>"
+            deadline_dt = parse_deadline(str(item.get('datetime', '')))
+            if deadline_dt is not None:
+                line += f" - до {format_deadline(deadline_dt)}"
+            if item.get('description'):
+                line += f"\n   📄 {_short(item['description'])}"
+        lines.append(line)
+    if len(matches) >= limit:
+        lines.append(f"\nПоказаны первые {limit}. Уточните запрос.")
+    return "\n".join(lines)
@@ -0,0 +1,336 @@
+"""
+Несколько процессов-обработчиков на одной машине
+
+При WEB_CONCURRENCY > 1 главный процесс становится диспетчером: он
+запускает WEB_CONCURRENCY воркеров (тот же main.py с WORKER_ID и своим
+портом на 127.0.0.1) и пересылает каждый вебхук воркеру, которому
+принадлежит пользователь обновления. Все обновления одного пользователя
+обрабатывает один процесс - его L1-кэш, блокировки, лимит запросов и
+порядок обновлений остаются в одном месте. Ссылки на календарь
+пересылаются так же, по user_id из токена.
+
+Диспетчер следит за воркерами: упавший или переставший отвечать на
+/health воркер перезапускается. Пока воркер не готов, его обновления
+получают 503 - Telegram повторит их позже, порядок не нарушится. При
+остановке диспетчер сначала дожидается уже пересланных запросов, затем
+посылает воркерам SIGTERM, и каждый воркер дорабатывает свои запросы.
+
+Фоновые задачи между воркерами согласуются так же, как между репликами,
+через общий кэш Redis, поэтому без REDIS_URL запускается один процесс.
+"""
+import os
+import sys
+import signal
+import asyncio
+import logging
+from typing import Any, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Номер воркера (задается диспетчером; None - обычный процесс)
+WORKER_ID: Optional[int] = int(os.environ['WORKER_ID']) if os.environ.get('WORKER_ID') else None
+WORKER_HOST = '127.0.0.1'
+
+# Проверка здоровья воркеров
+HEALTH_INTERVAL = 10
+HEALTH_TIMEOUT = 5
+MAX_HEALTH_FAILURES = 3
+# Сколько ждать готовности запущенного воркера
+STARTUP_TIMEOUT = 120
+# Пауза перед перезапуском упавшего воркера (удваивается до максимума)
+RESTART_BACKOFF = 1
+MAX_RESTART_BACKOFF = 30
+# Сколько воркер может дорабатывать запросы после SIGTERM
+DRAIN_TIMEOUT = 60
+# Размер порции при пересылке ответа воркера
+FORWARD_CHUNK_SIZE = 16 * 1024
+
+# Виды обновлений и поле с пользователем
+_UPDATE_USER_FIELDS = (
+    ('message', 'from'),
+    ('callback_query', 'from'),
+    ('edited_message', 'from'),
+    ('inline_query', 'from'),
+    ('chosen_inline_result', 'from'),
+    ('shipping_query', 'from'),
+    ('pre_checkout_query', 'from'),
+    ('poll_answer', 'user'),
+    ('my_chat_member', 'from'),
+    ('chat_member', 'from'),
+    ('chat_join_request', 'from'),
+)
+
+# Заголовки соединения не пересылаются
+_HOP_HEADERS = frozenset({
+    'host', 'connection', 'keep-alive', 'content-length', 'transfer-encoding',
+    'te', 'trailer', 'upgrade', 'proxy-authorization', 'proxy-connection',
+})
+
+
+def worker_count() -> int:
+    """Сколько воркеров запускать (1 - без диспетчера)"""
+    if WEB_CONCURRENCY > 1 and not os.environ.get('REDIS_URL'):
+        logger.warning(
+            f"⚠️ WEB_CONCURRENCY={WEB_CONCURRENCY} требует REDIS_URL "
+            "(общий кэш для фоновых задач), запускается один процесс"
+        )
+        return 1
+    return max(WEB_CONCURRENCY, 1)
+
+
+def worker_for(user_id: int, count: int) -> int:
+    """Воркер пользователя: перемешиваем id, чтобы соседние id расходились"""
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % count
+
+
+def owns(user_id: int) -> bool:
+    """Обслуживает ли этот процесс пользователя (вне режима воркеров - всех)"""
+    if WORKER_ID is None:
+        return True
+    return worker_for(user_id, WEB_CONCURRENCY) == WORKER_ID
+
+
+def is_primary() -> bool:
+    """Процесс, выполняющий разовые действия при запуске (установка вебхука)"""
+    return WORKER_ID is None or WORKER_ID == 0
+
+
+def update_user_id(data: Any) -> Optional[int]:
+    """user_id из необработанного JSON обновления"""
+    if not isinstance(data, dict):
+        return None
+    for kind, field in _UPDATE_USER_FIELDS:
+        payload = data.get(kind)
+        if isinstance(payload, dict):
+            user = payload.get(field)
+            if isinstance(user, dict) and isinstance(user.get('id'), int):
+                return user['id']
+            return None
+    return None
+
+
+class WorkerProcess:
+    """Один воркер: процесс, порт и состояние"""
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.url = f"http://{WORKER_HOST}:{port}"
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.ready = False
+        self.restarts = 0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+
+class Dispatcher:
+    """Пересылка запросов воркерам по пользователю и надзор за воркерами"""
+
+    def __init__(self, script: str, count: int, base_port: int):
+        self._script = script
+        self._count = count
+        self.workers: List[WorkerProcess] = [
+            WorkerProcess(index, base_port + index) for index in range(count)
+        ]
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self.forwarded = 0
+        self.unavailable = 0
+
+    # ==================== НАДЗОР ====================
+
+    async def start(self, app: web.Application):
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, keepalive_timeout=60)
+        )
+        self._tasks = [
+            asyncio.create_task(self._supervise(worker)) for worker in self.workers
+        ]
+        logger.info(f"👷 Диспетчер: запущено воркеров {self._count}")
+
+    async def _spawn(self, worker: WorkerProcess):
+        env = dict(os.environ, WORKER_ID=str(worker.index), PORT=str(worker.port))
+        # Своя группа процессов: сигналы терминала получает только диспетчер
+        worker.process = await asyncio.create_subprocess_exec(
+            sys.executable, self._script, env=env, start_new_session=True
+        )
+        logger.info(f"👷 Воркер {worker.index} запущен (pid {worker.pid}, порт {worker.port})")
+
+    async def _healthy(self, worker: WorkerProcess) -> bool:
+        try:
+            async with self._session.get(
+                f"{worker.url}/health", timeout=aiohttp.ClientTimeout(total=HEALTH_TIMEOUT)
+            ) as response:
+                return response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _watch(self, worker: WorkerProcess):
+        """Ждет готовности воркера, затем проверяет его здоровье"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        while not await self._healthy(worker):
+            if loop.time() - started > STARTUP_TIMEOUT:
+                logger.error(f"❌ Воркер {worker.index} не запустился за {STARTUP_TIMEOUT} сек")
+                worker.process.kill()
+                return
+            await asyncio.sleep(1)
+        worker.ready = True
+        logger.info(f"✅ Воркер {worker.index} готов")
+
+        failures = 0
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            if await self._healthy(worker):
+                failures = 0
+                continue
+            failures += 1
+            if failures >= MAX_HEALTH_FAILURES:
+                logger.error(f"❌ Воркер {worker.index} не отвечает, перезапуск")
+                worker.ready = False
+                worker.process.terminate()
+                return
+
+    async def _supervise(self, worker: WorkerProcess):
+        backoff = RESTART_BACKOFF
+        while not self._stopping:
+            await self._spawn(worker)
+            watcher = asyncio.create_task(self._watch(worker))
+            started = asyncio.get_running_loop().time()
+            code = await worker.process.wait()
+            worker.ready = False
+            watcher.cancel()
+            if self._stopping:
+                return
+            # Долго проработавший воркер перезапускается сразу
+            if asyncio.get_running_loop().time() - started > MAX_RESTART_BACKOFF * 2:
+                backoff = RESTART_BACKOFF
+            worker.restarts += 1
+            logger.error(
+                f"❌ Воркер {worker.index} завершился с кодом {code}, "
+                f"перезапуск через {backoff} сек"
+            )
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_RESTART_BACKOFF)
+
+    async def stop(self, app: web.Application):
+        """Остановка после того, как диспетчер доотправил запросы: воркеры дорабатывают свои"""
+        self._stopping = True
+        running = [
+            worker.process for worker in self.workers
+            if worker.process is not None and worker.process.returncode is None
+        ]
+        for process in running:
+            process.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(process.wait() for process in running)), DRAIN_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            for process in running:
+                if process.returncode is None:
+                    process.kill()
+            logger.error(f"❌ Воркеры не завершились за {DRAIN_TIMEOUT} сек и остановлены")
+        for task in self._tasks:
+            task.cancel()
+        await self._session.close()
+        logger.info("✅ Воркеры остановлены")
+
+    # ==================== ПЕРЕСЫЛКА ====================
+
+    async def _forward(self, worker: WorkerProcess, request: web.Request, body: bytes) -> web.StreamResponse:
+        if not worker.ready:
+            self.unavailable += 1
+            return web.Response(status=503, text="worker unavailable")
+        headers = {
+            name: value for name, value in request.headers.items()
+            if name.lower() not in _HOP_HEADERS
+        }
+        stream: Optional[web.StreamResponse] = None
+        try:
+            async with self._session.request(
+                request.method, worker.url + request.path_qs, data=body, headers=headers
+            ) as response:
+                # Ответ передается порциями по мере получения (календарь - потоком)
+                stream = web.StreamResponse(
+                    status=response.status,
+                    headers={
+                        name: value for name, value in response.headers.items()
+                        if name.lower() not in _HOP_HEADERS
+                    }
+                )
+                await stream.prepare(request)
+                async for chunk in response.content.iter_chunked(FORWARD_CHUNK_SIZE):
+                    await stream.write(chunk)
+                await stream.write_eof()
+                self.forwarded += 1
+                return stream
+        except aiohttp.ClientError as e:
+            self.unavailable += 1
+            logger.warning(f"⚠️ Воркер {worker.index} недоступен: {e}")
+            if stream is not None:
+                # Заголовки уже отправлены - клиент получит оборванный ответ
+                raise
+            return web.Response(status=503, text="worker unavailable")
+
+    def _worker_for_user(self, user_id: Optional[int]) -> WorkerProcess:
+        if user_id is None:
+            return self.workers[0]
+        return self.workers[worker_for(user_id, self._count)]
+
+    async def handle_webhook(self, request: web.Request) -> web.StreamResponse:
+        body = await request.read()
+        try:
+            user_id = update_user_id(await request.json())
+        except ValueError:
+            user_id = None
+        return await self._forward(self._worker_for_user(user_id), request, body)
+
+    async def handle_calendar(self, request: web.Request) -> web.StreamResponse:
+        user_part = request.match_info['token'].partition('.')[0]
+        user_id = int(user_part) if user_part.isdigit() else None
+        return await self._forward(self._worker_for_user(user_id), request, b'')
+
+    async def handle_debug(self, request: web.Request) -> web.StreamResponse:
+        """Отладочные маршруты воркера: ?worker=N (по умолчанию 0)"""
+        index = request.query.get('worker', '0')
+        if not index.isdigit() or int(index) >= self._count:
+            raise web.HTTPNotFound()
+        return await self._forward(self.workers[int(index)], request, b'')
+
+    async def health_check(self, request: web.Request) -> web.Response:
+        lines = [
+            f"✅ Диспетчер работает, воркеров: {self._count}",
+            f"Переслано: {self.forwarded}, воркер недоступен: {self.unavailable}",
+        ]
+        for worker in self.workers:
+            status = "готов" if worker.ready else "запускается"
+            lines.append(
+                f"Воркер {worker.index}: {status}, pid {worker.pid}, перезапусков: {worker.restarts}"
+            )
+        return web.Response(
+            text="\n".join(lines),
+            status=200 if any(worker.ready for worker in self.workers) else 503
+        )
+
+
+def create_dispatcher_app(script: str, count: int, port: int) -> web.Application:
+    """Приложение диспетчера: воркеры слушают порты port+1 ... port+count"""
+    dispatcher = Dispatcher(script, count, port + 1)
+    app = web.Application()
+    app.router.add_get('/', dispatcher.health_check)
+    app.router.add_get('/health', dispatcher.health_check)
+    app.router.add_post('/webhook', dispatcher.handle_webhook)
+    app.router.add_get('/calendar/{token}.ics', dispatcher.handle_calendar)
+    app.router.add_get('/debug/memory', dispatcher.handle_debug)
+    app.on_startup.append(dispatcher.start)
+    # on_cleanup - после того, как уже принятые запросы переданы воркерам
+    app.on_cleanup.append(dispatcher.stop)
+    return app